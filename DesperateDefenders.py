@@ -2,7 +2,7 @@
 #   1. Boot up introduction, and main menu
 #      Prompt user for which option to choose
 #       1. Start game
-#       2. Load game using .txt file
+#       2. Load game from save.dat
 #       3. Options
 #           - Edit field
 #           - adjust spawning frequency
@@ -31,7 +31,7 @@
 #                   - ronin upgrade -> Stats +1, +1 Range
 #           3 end turn
 #           4. save game
-#               - Opens .txt file and writes game_vars & field
+#               - writes game_vars & field to save.dat
 #           5. Spells
 #               - fireball 3x3
 #               - healing circle
@@ -56,15 +56,28 @@
 #           - I did this because the game felt too easy with the original
 #             where only 1 monster spawn when a monster dies
 #   4. show the main map (cycle starts again from 2b)
-# ----------------------------------------------------------------------------------#
 
 
 # 0 Upon booting up the game, import necessary modules
 import random
-import math
 import json
+import copy
+import bisect
+import collections
+import hashlib
+import heapq
+import itertools
+import mmap
+import operator
+import os
+import re
+import struct
+import threading
+import time
 
 # 0.1 Game variables
+#   - settings for new games, the options menu changes these
+#   - every GameEngine works on its own copy
 game_vars = {
     "turn": 0,  # Current Turn
     "monster_kill_target": 20,  # kills needed to win game
@@ -82,129 +95,1935 @@ game_vars = {
     "first_time_spell_shop": 1,  # Detects if it is first time showing spells
     "game_mode": 0,  # game modes normal = 0, endless = 1
     "options_changed": 0,  # options changed = False = 0 , options changed = True = 1
+    "spawn_queue_limit": 5,  # monsters that can wait in each lane for the spawn cell to free up
 }
 
 row_name = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-field = [[None, None, None, None, None, None, None],
-         [None, None, None, None, None, None, None],
-         [None, None, None, None, None, None, None],
-         [None, None, None, None, None, None, None],
-         [None, None, None, None, None, None, None]]
 
 # Monster and Defender Data
-defender_list = ['ARCHR', 'WALL', 'CANON', 'RONIN']
-monster_list = ['ZOMBI', 'WWOLF', 'SKELE']
-defenders = {'ARCHR': {'NAME': 'Archer',
-                       'maxHP': 6,
-                       'min_damage': 2,
-                       'max_damage': 4,
-                       'PRICE': 5,
-                       },
-             'WALL': {'NAME': 'Wall',
-                      'maxHP': 20,
-                      'min_damage': 0,
-                      'max_damage': 0,
-                      'PRICE': 3,
-                      },
-             'CANON': {'NAME': 'Cannon',
-                       'maxHP': 8,
-                       'min_damage': 3,
-                       'max_damage': 6,
-                       'PRICE': 7,
-                       },
-             'RONIN': {'NAME': 'Ronin',
-                       'maxHP': 10,
-                       'min_damage': 5,
-                       'max_damage': 8,
-                       'PRICE': 5,
-                       },
-             }
-
-monsters = {'ZOMBI': {'NAME': 'Zombie',
-                      'maxHP': 15,
-                      'min_damage': 3,
-                      'max_damage': 6,
-                      'MOVES': 3,
-                      'REWARD': 3
-                      },
-            'WWOLF': {'NAME': 'Werewolf',
-                      'maxHP': 10,
-                      'min_damage': 1,
-                      'max_damage': 4,
-                      'MOVES': 2,
-                      'REWARD': 4
-                      },
-            'SKELE': {'NAME': 'Skeleton',
-                      'maxHP': 10,
-                      'min_damage': 1,
-                      'max_damage': 3,
-                      'MOVES': 1,
-                      'REWARD': 4
-                      },
-            }
-
-
-# place_unit()
-#    Places a unit at the given position
-#    This function works for both defender and monster
-#    Returns False if the position is invalid
-#       - Position is not on the field of play
-#       - Position is occupied
-#       - Defender is placed past the first 3 columns
-#    Returns True if placement is successful
-
-def place_unit(position, unit_name):
-    # check if the position is valid
-    # note that units of any type can be placed into any row , check row validity
-    if position[0].isalpha() is True and position[0].upper() in row_name[:game_vars["rows"]]:
-        if game_vars["columns"] >= int(position[1:]) > 0:  # check column validity, 0< input <max
-            unit_row_index = row_name.index(position[0].upper())
-            unit_column_index = int(position[1:]) - 1
-            if field[unit_row_index][unit_column_index] is None:  # if empty proceed,
-
-                # IF UNIT IS ALLY
-                if unit_name in defender_list and int(position[1:]) <= 3:  # if unit bought not in correct position
-                    # units always start of with max health, and upgrade level 0
-                    field[unit_row_index][unit_column_index] = [unit_name, defenders[unit_name]["maxHP"],
-                                                                defenders[unit_name]["maxHP"], 0]
-
-                    return True
-
-                # ELSE IF UNIT IS ENEMY
-                elif unit_name in monster_list:
-                    field[unit_row_index][unit_column_index] = [unit_name, monsters[unit_name]["maxHP"],
-                                                                monsters[unit_name]["maxHP"]]
-
-                    return True
-
-                # Prompt user to enter valid position
-                else:
-                    print("Units bought MUST be placed in the first three columns")
+#   Unit types are read from units.json, in the order they are listed there, which
+#   is also the order of their type codes. A new unit type only needs an entry.
+#   Besides their stats, defenders have behaviour traits, and an entry that leaves
+#   a trait out gets the one in defender_traits:
+#       attacks             - False for units that never attack, i.e. walls
+#       fire_every          - only attacks on turns that divide by it, i.e. 2 for every other turn
+#       attack_range        - cells in front it can strike, None for the whole lane
+#       pushback_per_level  - None for no pushback. Otherwise a monster that survives
+#                             a hit is pushed back 1 cell on a roll over 50 out of 100,
+#                             and every upgrade level raises the lowest roll by this much
+#       damage_against      - {monster: percent of the damage it takes}, rounded up
+#       upgrade_hp, upgrade_damage, upgrade_range
+#                           - what every upgrade level adds
+#       upgrade_cost, upgrade_cost_step
+#                           - gold for the first upgrade, and how much more each one after it costs
+#   Monsters can have an endless_REWARD, the reward they give in endless mode,
+#   which is double their REWARD if they leave it out.
+#   GameEngine.stats_for() compiles them into the UnitStats of each type code and
+#   level, so the combat loop never looks at a unit's name.
+units_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "units.json")
+defender_traits = {"attacks": True, "fire_every": 1, "attack_range": None, "pushback_per_level": None,
+                   "damage_against": {}, "upgrade_hp": 1, "upgrade_damage": 1, "upgrade_range": 1,
+                   "upgrade_cost": 5, "upgrade_cost_step": 2}
+
+
+# with_traits()
+#   - Copies of the defender entries with every trait filled in, from the entry
+#     of the same name in base if it has one, or else from defender_traits
+#   - unit stats saved before there were traits, i.e. in older replays, still
+#     play the same
+def with_traits(units, base):
+    return {name: copy.deepcopy({**defender_traits, **base.get(name, {}), **stats}) for name, stats in units.items()}
+
+
+# load_units()
+#   - Returns (defenders, monsters) from a unit data file like units.json
+#   - type codes are saved as one byte, so there can be at most 255 unit types
+def load_units(path):
+    with open(path) as data_file:
+        tables = json.load(data_file)
+    if len(tables["defenders"]) + len(tables["monsters"]) > 255:
+        raise ValueError("{} has more than 255 unit types".format(path))
+    return with_traits(tables["defenders"], {}), tables["monsters"]
+
+
+defenders, monsters = load_units(units_file)
+defender_list = list(defenders)
+monster_list = list(monsters)
+
+# Spells
+#   effect      - "damage" hits monsters, "heal" heals defenders up to their max HP
+#   shape       - "square", "diamond" (cells within radius steps) or "lane" (along the center row)
+#   radius      - cells out from the center, any size
+#   power       - damage or healing per unit, times center_multiplier on the center cell
+spells = {"fireball": {"NAME": "Fireball", "COST": 7, "effect": "damage", "shape": "square", "radius": 1,
+                       "power": 5, "center_multiplier": 2},
+          "heal": {"NAME": "Healing Circle", "COST": 5, "effect": "heal", "shape": "square", "radius": 1,
+                   "power": 5, "center_multiplier": 2},
+          }
+spell_costs = {spell: spells[spell]["COST"] for spell in spells}
+
+# Game events
+#   Everything the engine reports is an event of one of these kinds, with the
+#   names of its values and the message it is shown as
+event_types = {"not_front_columns": ((), "Units bought MUST be placed in the first three columns"),
+               "invalid_column": ((), "Column specified is not valid"),
+               "invalid_row": ((), "Row specified is not valid"),
+               "spell_damage": (("spell", "damage", "target"), "{} did {} damage to {}!"),
+               "spell_total_damage": (("spell", "damage"), "{} did a total of {} damage!"),
+               "healed": (("target", "healing"), "{} was healed for {} HP!"),
+               "spell_total_healing": (("spell", "healing"), "{} rejuvenated units for {} HP!"),
+               "threat_spawn": ((), "Threat level exceeds 10! A new monster has emerged!"),
+               "danger_up": ((), "The monsters grow increasingly stronger ..."),
+               "killed": (("monster", "reward"), "{} was killed! You gained {} gold as a reward!"),
+               "cannon_charging": (("attacker",), "{} is preparing to fire!"),
+               "ronin_waiting": (("attacker",), "The {} waits patiently to strike"),
+               "arrows_missed": (("attacker", "target"), "The {} shoots! But the arrows passed through the {}!"),
+               "defender_attack": (("attacker", "damage", "target"), "{} inflicted {} damage to {}!"),
+               "pushed_back": (("attacker", "target"), "The {} fired! The {} moves back 1 step!"),
+               "held_ground": (("attacker", "target"), "{} fired! But the {} holds its ground!"),
+               "monster_step": (("monster", "steps", "lane"), "{} has taken {} step(s) in lane {}"),
+               "reached_city": (("monster",), "{} has reached the city!"),
+               "game_lost": ((), "Monsters have plunged the town in darkness! Everyone dies!"),
+               "monster_attack": (("attacker", "damage", "target"), "{} inflicted {} damage to {}!"),
+               "spawn_dropped": (("monster", "lane"), "The {} could not find a way onto lane {}"),
+               }
+
+# game_vars that only the menus use, to show the tutorials once
+tutorial_flags = ("first_time_shop", "first_time_spell_shop")
+
+# Unit type codes, 0 is an empty cell
+#   defenders come first, so a unit is a monster when its code is at least
+#   first_monster_code, which the turn loop checks instead of the unit's name
+unit_names = [None] + defender_list + monster_list
+unit_codes = {name: code for code, name in enumerate(unit_names) if name is not None}
+first_monster_code = len(defender_list) + 1
+
+# Binary save files
+#   header - save_magic, the format version (uint16), then the game_vars listed in
+#            save_layouts[version], each as an int64
+#   cells  - rows * columns records, row by row, of type code (uint8),
+#            current HP (int32), max HP (int32) and level, see cell_records[version]
+#   Empty cells are all zeros. The level of a monster is the danger level it
+#   spawned at. Versions 1 and 2 keep the level in a uint16, and monsters saved
+#   before they kept their level have 0 there, which loads as the game's danger
+#   level. From version 3 it is a uint32, which endless games never outgrow.
+#   A new game_vars key needs a new version, so older saves still load.
+save_magic = b"DDSV"
+save_version = 3
+save_layouts = {1: ["turn", "monster_kill_target", "monsters_killed", "num_monsters", "spawn_frequency", "gold",
+                    "THREAT", "max_threat", "danger_level", "DANGER", "columns", "rows", "first_time_shop",
+                    "first_time_spell_shop", "game_mode", "options_changed"],
+                }
+save_layouts[2] = save_layouts[1] + ["spawn_queue_limit"]
+save_layouts[3] = save_layouts[2]
+save_header = struct.Struct("<4sH")
+cell_records = {1: struct.Struct("<BiiH"), 2: struct.Struct("<BiiH"), 3: struct.Struct("<BiiI")}
+cell_record = cell_records[save_version]
+
+
+# UnitStats
+#   Everything about a unit that only depends on its type and level, worked out
+#   once by GameEngine.stats_for() and shared by every unit it applies to
+#   - level is the upgrade level of a defender, and the danger level a monster
+#     spawned at
+#   - max_hp is the max HP of a new unit, hp_per_upgrade what an upgrade adds to it
+#   - code is the type code, see unit_codes
+#   - reach is how far in front a defender can strike, None for the whole lane
+#   - attacks, fire_every and damage_against ({type code: percent}) are the
+#     defender's traits (see units.json), pushback_floor is the lowest pushback
+#     roll at its level, None if it never pushes monsters back
+UnitStats = collections.namedtuple("UnitStats", ["name", "code", "level", "max_hp", "hp_per_upgrade", "min_damage",
+                                                 "max_damage", "reach", "moves", "reward", "upgrade_cost", "attacks",
+                                                 "fire_every", "pushback_floor", "damage_against"])
+
+
+# Unit
+#   One unit on the field. Everything but its HP lives in its stats.
+#   Saves and replays keep units as lists, [name, current HP, max HP, level], see
+#   to_list(). Lists from before monsters kept their level leave it out for them.
+class Unit:
+    __slots__ = ("stats", "hp", "max_hp")
+
+    def __init__(self, stats, hp, max_hp):
+        self.stats = stats
+        self.hp = hp
+        self.max_hp = max_hp
+
+    @property
+    def name(self):
+        return self.stats.name
+
+    @property
+    def level(self):
+        return self.stats.level
+
+    def to_list(self):
+        return [self.stats.name, self.hp, self.max_hp, self.stats.level]
+
+
+# unit_changes()
+#   - units is ([column], [amount], [gold]) of the units of a row, sorted by column
+#   - Returns (column, change of amount, change of gold) for where each unit comes
+#     into and goes out of reach going right along the row, sorted by column. The
+#     columns are not clipped to the field.
+def unit_changes(units, reach):
+    unit_columns, amounts, rewards = units
+    repeat = itertools.repeat
+    changes = list(zip(map(operator.sub, unit_columns, repeat(reach)), amounts, rewards))
+    changes += zip(map(operator.add, unit_columns, repeat(reach + 1)), map(operator.neg, amounts),
+                   map(operator.neg, rewards))
+    changes.sort(key=operator.itemgetter(0))
+    return changes
+
+
+# pack_rows()
+#   - The units of a field as cell_record bytes
+#   - only occupied cells are packed, empty ones stay all zeros
+def pack_rows(field, rows, columns):
+    cells = bytearray(rows * columns * cell_record.size)
+    for row in range(rows):
+        for column, unit in field[row].items():
+            cell_record.pack_into(cells, (row * columns + column) * cell_record.size, unit_codes[unit.name],
+                                  unit.hp, unit.max_hp, unit.level)
+    return cells
+
+
+# pack_header()
+#   - The header of a binary save file, save_magic, the version and game_vars
+def pack_header(saved_game_vars):
+    keys = save_layouts[save_version]
+    return save_header.pack(save_magic, save_version) \
+        + struct.pack("<{}q".format(len(keys)), *[saved_game_vars[key] for key in keys])
+
+
+# write_save()
+#   - Writes a binary save file from game_vars and packed cells
+#   - the file is written under a temporary name and then renamed, so a game that
+#     stops halfway through saving leaves the old save as it was
+def write_save(path, saved_game_vars, cells):
+    with open(path + ".tmp", "wb") as save_file:
+        save_file.write(pack_header(saved_game_vars))
+        save_file.write(cells)
+    os.replace(path + ".tmp", path)
+
+
+# SparseRow
+#   One row of the field, column -> unit for the cells that hold a unit.
+#   It reads like a list of cells, an empty cell is None, but only the units are
+#   stored, so a very wide field costs as much as the units on it.
+#   - a cell is emptied with del, never by setting it to None (see _remove_unit())
+#   - it has no length, go through range(columns) or columns() instead
+class SparseRow(dict):
+    __slots__ = ()
+    __getitem__ = dict.get  # quicker than __missing__, most cells looked at are empty
+
+    # columns()
+    #   - the occupied columns, left to right
+    def columns(self):
+        return sorted(self)
+
+
+# generate_field()
+#   - Builds an empty field of the given size
+#   - every cell starts off as None, rows are SparseRows so nothing is stored yet
+def generate_field(rows, columns):
+    new_field = []
+    for i in range(0, rows):
+        new_field.append(SparseRow())
+    return new_field
+
+
+# saved_cells()
+#   - [row, column, unit list] of every unit of a saved field, which is rows of
+#     lists or SparseRows of unit lists, going row by row
+#   - the unit lists are copies, so the saved field can change afterwards
+def saved_cells(saved_field):
+    cells = []
+    for row in range(len(saved_field)):
+        units = saved_field[row]
+        if isinstance(units, SparseRow):
+            columns = units.columns()
+        else:
+            columns = [column for column in range(len(units)) if units[column] is not None]
+        cells += [[row, column, list(units[column])] for column in columns]
+    return cells
+
+
+# cells_to_field()
+#   - A saved field of SparseRows of unit lists of the given size, from
+#     [row, column, unit list] cells (see saved_cells())
+def cells_to_field(rows, columns, cells):
+    field = generate_field(rows, columns)
+    for row, column, unit in cells:
+        field[row][column] = list(unit)
+    return field
+
+
+# Event
+#   One thing that happened in a game, kind is a key of event_types and values
+#   are in the order of its names. Nothing is formatted until a sink asks for it.
+Event = collections.namedtuple("Event", ["kind", "turn", "values"])
+
+
+# event_text()
+#   - the message the event is shown as, i.e. "ARCHR inflicted 3 damage to ZOMBI!"
+def event_text(event):
+    return event_types[event.kind][1].format(*event.values)
+
+
+# event_record()
+#   - the event as a dictionary, i.e. {"event": "defender_attack", "turn": 4,
+#     "attacker": "ARCHR", "damage": 3, "target": "ZOMBI"}
+def event_record(event):
+    record = {"event": event.kind, "turn": event.turn}
+    record.update(zip(event_types[event.kind][0], event.values))
+    return record
+
+
+# Event sinks
+#   The output of a GameEngine is a sink, anything with a send(event) method.
+#   A plain function such as print or list.append is wrapped in a TextSink.
+#   TextSink      - formats every event and passes the text on, the console output
+#   BatchSink     - keeps the events in memory until drain() hands them over
+#   JsonLinesSink - appends every event to a file as one line of JSON
+#   NullSink      - drops everything. The engine does not even make the events.
+class TextSink:
+    def __init__(self, write=print):
+        self.write = write
+
+    def send(self, event):
+        self.write(event_text(event))
+
+
+class BatchSink:
+    def __init__(self):
+        self.events = []
+
+    def send(self, event):
+        self.events.append(event)
+
+    def drain(self):
+        events = self.events
+        self.events = []
+        return events
+
+
+class JsonLinesSink:
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def send(self, event):
+        self.file.write(json.dumps(event_record(event)) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class NullSink:
+    def send(self, event):
+        pass
+
+
+# as_sink()
+#   - The sink for an engine's output argument, None if nothing needs the events
+def as_sink(output):
+    if output is None or isinstance(output, NullSink):
+        return None
+    if hasattr(output, "send"):
+        return output
+    return TextSink(output)
+
+
+# GameEngine
+#   Headless version of the game rules, used by the menus and by anything that
+#   wants to play the game without a keyboard (simulations, bots, tests).
+#   - Owns its own copy of game_vars, the field and the unit stats, so several
+#     games can run side by side in one process
+#   - Never calls input() or print(). What happens is sent as events to the output
+#     sink (see Event sinks), and no events are made at all without one
+#   - step(actions) applies the player's actions, then ends the turn
+#   - status is "playing" until the game has been "won" or "lost"
+#   - Every part of the game draws from its own random stream, all made from the
+#     game seed, so a seed and the player's actions decide the whole game. Extra
+#     attacks do not change which monsters spawn, and the other way around.
+#   - With record=True the player's actions are kept in history, which can be
+#     saved with save_replay() and played again with replay_game()
+class GameEngine:
+    # the methods the phases call for every defender and monster, which
+    # TurnStats times on top of the phases
+    unit_calls = ("defender_attack", "monster_advance")
+
+    def __init__(self, settings=None, saved_field=None, seed=None, output=None, unit_stats=None, record=False):
+        if settings is None:
+            settings = game_vars
+        if unit_stats is None:
+            unit_stats = {"defenders": defenders, "monsters": monsters}
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.game_vars = dict(game_vars)  # settings from older saves may not have every key
+        self.game_vars.update(settings)
+        self.defenders = with_traits(unit_stats["defenders"], defenders)
+        self.monsters = copy.deepcopy(unit_stats["monsters"])
+        self.combat_rng = random.Random("{}:combat".format(seed))  # defender damage and cannon pushback
+        self.monster_rng = random.Random("{}:monster".format(seed))  # monster damage
+        self.spawn_rng = random.Random("{}:spawn".format(seed))  # which monster spawns where
+        self.threat_rng = random.Random("{}:threat".format(seed))  # threat increase each turn
+        self.output = as_sink(output)
+        self.history = None
+        if record:
+            # everything needed to start this exact game again
+            # the saved field is kept as the cells of its units, see saved_cells()
+            self.history = {"seed": seed,
+                            "game_vars": dict(settings),
+                            "field": None if saved_field is None else saved_cells(saved_field),
+                            "unit_stats": copy.deepcopy(unit_stats),
+                            "actions": [],
+                            }
+        self.status = "playing"
+        self.stat_tables = {}  # (name, level) -> UnitStats, see stats_for()
+        self.kill_counts = {}  # monsters killed by each defender type, and by "FIREBALL"
+
+        if self.game_vars["game_mode"] == 1:
+            # In endless, monsters give their endless_REWARD, or double the reward.
+            # It is filled in, so the stats of an endless game give the same
+            # rewards again when a copy of the game is started from them.
+            for stats in self.monsters.values():
+                stats.setdefault("endless_REWARD", 2 * stats["REWARD"])
+                stats.update({"REWARD": stats["endless_REWARD"]})
+
+        if saved_field is None:
+            self.field = generate_field(self.game_vars["rows"], self.game_vars["columns"])
+            if self.game_vars["game_mode"] == 1:
+                # starting gold is increased, and more monsters need to be killed in order to win
+                self.game_vars.update({"gold": 25})
+                self.game_vars.update({"monster_kill_target": 30})
+        else:
+            # saved units are lists, in rows of lists or in SparseRows
+            self.field = generate_field(len(saved_field), self.game_vars["columns"])
+            for row, column, unit in saved_cells(saved_field):
+                self.field[row][column] = self.make_unit(unit)
+
+        # lanes[row] is the sorted list of columns that hold a monster in that row
+        self.lanes = []
+        for row in self.field:
+            self.lanes.append([column for column in row.columns() if row[column].name in monster_list])
+        # free_spawn_rows is the sorted list of rows whose last cell is empty, so
+        # spawning picks a free cell straight away. Monsters that cannot be placed
+        # wait in their lane's spawn queue, up to spawn_queue_limit of them.
+        spawn_column = self.game_vars["columns"] - 1
+        self.free_spawn_rows = [row for row in range(len(self.field)) if self.field[row][spawn_column] is None]
+        # queues are at most spawn_queue_limit long, plain lists are smaller than deques
+        self.spawn_queues = [[] for row in self.field]
+        self.queued_monsters = 0
+        # Counters the field changes keep up to date, so what they answer never
+        # needs a scan of the field (see count_units(), free_front_cells() and
+        # upgradable_cells()):
+        #   unit_counts[name] and lane_counts[row][name], units of each type
+        #   free_front, the empty (row, column) cells of the first 3 columns
+        #   upgradable, the (row, column) of every defender
+        #   game_vars["num_monsters"], the monsters on the field
+        #   level_counts[danger level], the monsters on the field that spawned at it,
+        #     so the stats of a danger level are dropped once nothing uses them
+        self.unit_counts, self.lane_counts, self.free_front, self.upgradable, self.level_counts, num_monsters = \
+            self.field_counts()
+        self.game_vars.update({"num_monsters": num_monsters})
+        self.debug = False  # check_counters() after every turn
+        self.dropped_monsters = 0  # monsters that did not fit in a full spawn queue
+        # row_versions[row] goes up whenever a cell of that row changes, so the
+        # field drawing only redraws rows that changed since the last frame
+        self.row_versions = [0] * len(self.field)
+        self.change_sets = []  # sets that _touch() adds every changed (row, column) to, see Journal
+        self.spell_rows = {}  # (spell, row) -> what the spell would do to the units of the row, see spell_targets()
+        self.journal = None
+        self.autosaver = None
+        self.turn_stats = None
+        self.cells_scanned = 0  # cells the phases of every turn so far looked at, for TurnStats
+        self.viewport = None  # the window of the field render_field() draws, see Viewport
+
+    # _emit()
+    #   - Sends an event of the given kind (see event_types) to the output, if there is one
+    def _emit(self, kind, *values):
+        if self.output is not None:
+            self.output.send(Event(kind, self.game_vars["turn"], values))
+
+    # _emit_names()
+    #   - Same as _emit(), for the events whose values are the NAME of a defender
+    #     type and, if one is given, of a monster type (see units.json)
+    #   - the names are only looked up if there is an output
+    def _emit_names(self, kind, defender_name, monster_name=None):
+        if self.output is not None:
+            names = (self.defenders[defender_name]["NAME"],)
+            if monster_name is not None:
+                names += (self.monsters[monster_name]["NAME"],)
+            self.output.send(Event(kind, self.game_vars["turn"], names))
+
+    # _record()
+    #   - Adds a player action to the history, if the game is being recorded
+    def _record(self, *action):
+        if self.history is not None:
+            self.history["actions"].append(list(action))
+
+    # stats_for()
+    #   - The UnitStats of a unit type at a level, built the first time it is needed
+    #   - a monster's level is the danger level it spawned at, level 0 is the
+    #     danger level of the game. Monsters get 1 more max HP, damage and reward
+    #     for every danger level after the first, and keep them for good, so a
+    #     higher danger level only changes the monsters that spawn after it.
+    def stats_for(self, name, level=0):
+        if level == 0 and name in monster_list:
+            level = self.game_vars["danger_level"]
+        key = (name, level)
+        if key not in self.stat_tables:
+            if name in monster_list:
+                stats = self.monsters[name]
+                bonus = level - 1
+                self.stat_tables[key] = UnitStats(name, unit_codes[name], level, stats["maxHP"] + bonus, 0,
+                                                  stats["min_damage"] + bonus, stats["max_damage"] + bonus, None,
+                                                  stats["MOVES"], stats["REWARD"] + bonus, 0, False, 1, None, {})
+            else:
+                stats = self.defenders[name]
+                reach = None
+                if stats["attack_range"] is not None:
+                    reach = stats["attack_range"] + stats["upgrade_range"] * level
+                pushback_floor = None
+                if stats["pushback_per_level"] is not None:
+                    pushback_floor = max(stats["pushback_per_level"] * level, 1)
+                damage_against = {unit_codes[monster]: percent for monster, percent in stats["damage_against"].items()}
+                self.stat_tables[key] = UnitStats(name, unit_codes[name], level, stats["maxHP"], stats["upgrade_hp"],
+                                                  stats["min_damage"] + stats["upgrade_damage"] * level,
+                                                  stats["max_damage"] + stats["upgrade_damage"] * level, reach, 0, 0,
+                                                  stats["upgrade_cost"] + stats["upgrade_cost_step"] * level,
+                                                  stats["attacks"], stats["fire_every"], pushback_floor,
+                                                  damage_against)
+        return self.stat_tables[key]
+
+    # make_unit()
+    #   - A Unit from its saved list, [name, current HP, max HP(, level)]
+    def make_unit(self, values):
+        return Unit(self.stats_for(values[0], values[3] if len(values) > 3 else 0), values[1], values[2])
+
+    # _restat()
+    #   - Points the units in the given cells at the stat tables again, after
+    #     the unit stats changed
+    def _restat(self, cells):
+        for row, column in cells:
+            unit = self.field[row][column]
+            unit.stats = self.stats_for(unit.name, unit.level)
+
+    # to_lists()
+    #   - The field as a list of lists of unit lists, i.e. for saving
+    def to_lists(self):
+        field = []
+        for row in self.field:
+            units = [None] * self.game_vars["columns"]
+            for column, unit in row.items():
+                units[column] = unit.to_list()
+            field.append(units)
+        return field
+
+    # unit_cells()
+    #   - [row, column, unit list] of every unit on the field, row by row, i.e.
+    #     for keeping the field of a recorded game without a list per cell
+    def unit_cells(self):
+        return [[row, column, self.field[row][column].to_list()] for row, column in self.occupied_cells()]
+
+    # pack_cells()
+    #   - Every cell of the field as cell_record bytes, for save()
+    def pack_cells(self):
+        return pack_rows(self.field, self.game_vars["rows"], self.game_vars["columns"])
+
+    # unpack_cells()
+    #   - Puts the units saved in data (from offset on) on to the empty field
+    #   - version is the save file version, which decides the size of the records
+    #   - only the type codes are scanned for occupied cells, empty ones cost nothing
+    def unpack_cells(self, data, offset, version=save_version):
+        record = cell_records[version]
+        columns = self.game_vars["columns"]
+        end = offset + self.game_vars["rows"] * columns * record.size
+        codes = bytes(memoryview(data)[offset:end:record.size])
+        for occupied in re.finditer(b"[^\x00]", codes):
+            cell = occupied.start()
+            code, hp, max_hp, level = record.unpack_from(data, offset + cell * record.size)
+            self._add_unit(cell // columns, cell % columns, Unit(self.stats_for(unit_names[code], level), hp, max_hp))
+
+    # save()
+    #   - Writes game_vars and the field to a binary save file, see save_layouts
+    def save(self, path):
+        write_save(path, self.game_vars, self.pack_cells())
+
+    # snapshot()
+    #   - A copy of game_vars and of the given cells that later turns do not
+    #     change, for saving on another thread (see Autosaver)
+    #   - cells maps (row, column) to (name, current HP, max HP, upgrade level),
+    #     or None if it is empty
+    def snapshot(self, cells):
+        copied = {}
+        for row, column in cells:
+            unit = self.field[row][column]
+            copied[row, column] = None if unit is None else (unit.name, unit.hp, unit.max_hp, unit.level)
+        return {"game_vars": dict(self.game_vars), "cells": copied}
+
+    # occupied_cells()
+    #   - (row, column) of every unit on the field
+    def occupied_cells(self):
+        cells = []
+        for row in range(self.game_vars["rows"]):
+            cells += [(row, column) for column in self.field[row].columns()]
+        return cells
+
+    # field_counts()
+    #   - the counters (see __init__) worked out from the field from scratch, as
+    #     (unit_counts, lane_counts, free_front, upgradable, level_counts, num_monsters)
+    def field_counts(self):
+        rows, front = self.game_vars["rows"], min(3, self.game_vars["columns"])
+        lane_counts = [collections.Counter(unit.name for unit in self.field[row].values()) for row in range(rows)]
+        unit_counts = collections.Counter()
+        for counts in lane_counts:
+            unit_counts.update(counts)
+        free_front = {(row, column) for row in range(rows) for column in range(front)
+                      if self.field[row][column] is None}
+        upgradable = {(row, column) for row in range(rows) for column in range(front)
+                      if self.field[row][column] is not None and self.field[row][column].name in defender_list}
+        level_counts = collections.Counter(self.field[row][column].level for row in range(rows)
+                                           for column in self.field[row].columns()
+                                           if self.field[row][column].name in monster_list)
+        return unit_counts, lane_counts, free_front, upgradable, level_counts, \
+            sum(unit_counts[name] for name in monster_list)
+
+    # check_counters()
+    #   - Returns the names of the counters that do not match the field, an empty
+    #     list if they all do. Slow, it counts the whole field again.
+    #   - with engine.debug set, end_turn() checks after every turn
+    def check_counters(self):
+        unit_counts, lane_counts, free_front, upgradable, level_counts, num_monsters = self.field_counts()
+        problems = []
+        if +self.unit_counts != unit_counts:  # + drops the types counted down to 0
+            problems.append("unit_counts")
+        if [+counts for counts in self.lane_counts] != lane_counts:
+            problems.append("lane_counts")
+        if self.free_front != free_front:
+            problems.append("free_front")
+        if self.upgradable != upgradable:
+            problems.append("upgradable")
+        if +self.level_counts != level_counts:
+            problems.append("level_counts")
+        if self.game_vars["num_monsters"] != num_monsters:
+            problems.append("num_monsters")
+        return problems
+
+    # count_units()
+    #   - units of the type on the field, or in one row
+    def count_units(self, unit_name, row=None):
+        if row is None:
+            return self.unit_counts[unit_name]
+        return self.lane_counts[row][unit_name]
+
+    # free_front_cells() and upgradable_cells()
+    #   - the sets of (row, column) where a defender can be placed, and of the
+    #     defenders that can be upgraded (if there is the gold for it)
+    #   - these are the engine's own sets, copy them before changing the field
+    #     while going through them
+    def free_front_cells(self):
+        return self.free_front
+
+    def upgradable_cells(self):
+        return self.upgradable
+
+    # state_checksum()
+    #   - Fingerprint of game_vars (which hold the size of the field), the units
+    #     on the field and the status, so it costs as much as the units
+    #   - leaves out the tutorial flags, which only the menus change, and
+    #     num_monsters, which the field already says
+    #   - dense=True fingerprints every cell instead, empty ones too, the way the
+    #     checksums of version 1 replays were made
+    def state_checksum(self, dense=False):
+        rules_vars = {key: value for key, value in self.game_vars.items()
+                      if key not in tutorial_flags and key != "num_monsters"}
+        field = self.to_lists() if dense else self.unit_cells()
+        state = json.dumps([rules_vars, field, self.status], sort_keys=True)
+        return hashlib.sha256(state.encode()).hexdigest()
+
+    # save_replay()
+    #   - Writes the recorded game to a JSON file, with a checksum of where it ended up
+    #   - version 2 replays keep the starting field as the cells of its units
+    #     (see saved_cells()), version 1 replays kept every cell
+    def save_replay(self, path):
+        replay = dict(self.history)
+        replay.update({"version": 2,
+                       "final": {"turn": self.game_vars["turn"],
+                                 "status": self.status,
+                                 "checksum": self.state_checksum(),
+                                 },
+                       })
+        with open(path, "w") as replay_file:
+            json.dump(replay, replay_file)
+
+    # place_unit()
+    #    Places a unit at the given position, i.e. "A3"
+    #    This function works for both defender and monster
+    #    Returns False if the position is invalid
+    #       - Position is not on the field of play
+    #       - Position is occupied
+    #       - Defender is placed past the first 3 columns
+    #    Returns True if placement is successful
+    #    Raises ValueError / IndexError if the position cannot be read at all
+    def place_unit(self, position, unit_name):
+        # note that units of any type can be placed into any row , check row validity
+        if position[0].isalpha() is True and position[0].upper() in row_name[:self.game_vars["rows"]]:
+            unit_column = int(position[1:])
+            if self.game_vars["columns"] >= unit_column > 0:  # check column validity, 0< input <max
+                unit_row_index = row_name.index(position[0].upper())
+                if self.field[unit_row_index][unit_column - 1] is not None:
+                    # space is occupied thus return false
                     return False
+                if unit_name in defender_list and unit_column > 3:
+                    self._emit("not_front_columns")
+                    return False
+                return self._place(unit_row_index, unit_column - 1, unit_name)
             else:
-                # space is occupied thus return false
+                self._emit("invalid_column")
                 return False
         else:
-            print("Column specified is not valid")
+            self._emit("invalid_row")
+            return False
+
+    # _place()
+    #   - Places a unit using indexes instead of a position string
+    #   - Returns False if the cell is taken
+    def _place(self, row, column, unit_name):
+        if self.field[row][column] is not None:
+            return False
+        # units always start of with max health, and upgrade level 0
+        stats = self.stats_for(unit_name)
+        self._add_unit(row, column, Unit(stats, stats.max_hp, stats.max_hp))
+        return True
+
+    # Field changes
+    #   Units only ever appear, disappear or move along their lane, and every one of
+    #   those changes goes through _add_unit(), _remove_unit() or _move_unit(), so
+    #   the lane index always matches the field.
+    #   Changing a unit's HP or upgrade level in place is not a field change, but
+    #   it still has to call _touch() so the row gets redrawn and the cell gets
+    #   saved by the journal or autosave, if there is one.
+    def _touch(self, row, column):
+        self.row_versions[row] += 1
+        for changed in self.change_sets:
+            changed.add((row, column))
+
+    def _add_unit(self, row, column, unit):
+        self.field[row][column] = unit
+        self._touch(row, column)
+        self._count(unit.stats, row, column, 1)
+        if unit.stats.code >= first_monster_code:
+            bisect.insort(self.lanes[row], column)
+            self._count_level(unit.level, 1)
+        if column == self.game_vars["columns"] - 1:
+            self._spawn_cell_changed(row)
+
+    def _remove_unit(self, row, column):
+        stats = self.field[row][column].stats
+        self._count(stats, row, column, -1)
+        if stats.code >= first_monster_code:
+            lane = self.lanes[row]
+            del lane[bisect.bisect_left(lane, column)]
+            self._count_level(stats.level, -1)
+        del self.field[row][column]
+        self._touch(row, column)
+        if column == self.game_vars["columns"] - 1:
+            self._spawn_cell_changed(row)
+
+    # _move_unit()
+    #   - monsters never pass each other, so the lane index stays sorted
+    def _move_unit(self, row, column, new_column):
+        unit = self.field[row].pop(column)
+        self.field[row][new_column] = unit
+        self._touch(row, column)
+        self._touch(row, new_column)
+        if unit.stats.code >= first_monster_code:
+            lane = self.lanes[row]
+            lane[bisect.bisect_left(lane, column)] = new_column
+        if column < 3 or new_column < 3:  # the unit counts stay the same, the first 3 columns change
+            self._count(unit.stats, row, column, -1)
+            self._count(unit.stats, row, new_column, 1)
+        if column == self.game_vars["columns"] - 1 or new_column == self.game_vars["columns"] - 1:
+            self._spawn_cell_changed(row)
+
+    # _count()
+    #   - keeps the counters up to date (see __init__) for a unit with these
+    #     stats that appeared (change is 1) or went (change is -1)
+    def _count(self, stats, row, column, change):
+        self.unit_counts[stats.name] += change
+        self.lane_counts[row][stats.name] += change
+        is_monster = stats.code >= first_monster_code
+        if is_monster:
+            self.game_vars.update({"num_monsters": self.game_vars["num_monsters"] + change})
+        if column < 3:
+            if change < 0:
+                self.free_front.add((row, column))
+                self.upgradable.discard((row, column))
+            else:
+                self.free_front.discard((row, column))
+                if not is_monster:
+                    self.upgradable.add((row, column))
+
+    # _count_level()
+    #   - keeps level_counts up to date for a monster of that danger level that
+    #     appeared or went. Once the last monster of an old danger level is gone,
+    #     no monster can have it again, so its stats are dropped.
+    def _count_level(self, level, change):
+        self.level_counts[level] += change
+        if self.level_counts[level] == 0 and level != self.game_vars["danger_level"]:
+            del self.level_counts[level]
+            self._drop_stats(level)
+
+    # _drop_stats()
+    #   - forgets the monster stats of a danger level, see stats_for()
+    def _drop_stats(self, level):
+        for name in monster_list:
+            self.stat_tables.pop((name, level), None)
+
+    # _spawn_cell_changed()
+    #   - keeps free_spawn_rows up to date after the last cell of the row changed
+    def _spawn_cell_changed(self, row):
+        free = self.field[row][self.game_vars["columns"] - 1] is None
+        index = bisect.bisect_left(self.free_spawn_rows, row)
+        listed = index < len(self.free_spawn_rows) and self.free_spawn_rows[index] == row
+        if free and not listed:
+            self.free_spawn_rows.insert(index, row)
+        elif listed and not free:
+            del self.free_spawn_rows[index]
+
+    # parse_position()
+    #   - Turns a position such as "B2" into (row index, column index)
+    #   - Returns None if the position is not on the field
+    def parse_position(self, position):
+        try:
+            if position[0].isalpha() is True and position[0].upper() in row_name[:self.game_vars["rows"]]:
+                column = int(position[1:])
+                if 0 < column <= self.game_vars["columns"]:
+                    return row_name.index(position[0].upper()), column - 1
+        except (ValueError, IndexError):
+            pass
+        return None
+
+    # buy_unit()
+    #   - Places the unit and takes the gold, only if there is enough gold and
+    #     the position is valid
+    def buy_unit(self, unit_name, position):
+        if unit_name not in defender_list or self.defenders[unit_name]["PRICE"] > self.game_vars["gold"]:
+            return False
+        if self.place_unit(position, unit_name) is not True:
+            return False
+        self.game_vars.update({"gold": self.game_vars["gold"] - self.defenders[unit_name]["PRICE"]})
+        self._record("buy", unit_name, position)
+        return True
+
+    # has_defenders()
+    #   - Checks the first 3 columns for any unit that can be upgraded
+    def has_defenders(self):
+        return len(self.upgradable_cells()) > 0
+
+    # upgrade_cost()
+    #   - the unit's upgrade_cost + upgrade_cost_step (2) * number of times it has been upgraded
+    def upgrade_cost(self, row, column):
+        return self.field[row][column].stats.upgrade_cost
+
+    # upgrade_unit()
+    #   - Upgrades the defender at the given position if there is enough gold
+    #       - HP + upgrade_hp (5 for walls, 1 for everyone else)
+    #       - damage and attack range through the upgrade level
+    def upgrade_unit(self, position):
+        target = self.parse_position(position)
+        if target is None:
+            return False
+        row, column = target
+        unit = self.field[row][column]
+        if unit is None or unit.name not in defender_list:
+            return False
+        upgrade_cost = unit.stats.upgrade_cost
+        if self.game_vars["gold"] < upgrade_cost:
+            return False
+        self.game_vars.update({"gold": self.game_vars["gold"] - upgrade_cost})
+        unit.stats = self.stats_for(unit.name, unit.level + 1)
+        unit.hp += unit.stats.hp_per_upgrade
+        unit.max_hp += unit.stats.hp_per_upgrade
+        self._touch(row, column)
+        self._record("upgrade", position)
+        return True
+
+    # cheat()
+    #   - gives gold and allows defenders to 1 hit
+    def cheat(self):
+        self._record("cheat")
+        self.game_vars.update({"gold": 1000})
+        for stats in self.defenders.values():
+            if stats["attacks"]:
+                stats.update({"min_damage": 1000000})
+                stats.update({"max_damage": 10000000})
+        self.stat_tables.clear()
+        self._restat(self.occupied_cells())
+
+    # cast_spell()
+    #   - spell is a key of spells, i.e. "fireball" (7 gold) or "heal" (5 gold)
+    #   - Returns the total damage or healing done, or None if the spell could not be cast
+    def cast_spell(self, spell, position):
+        target = self.parse_position(position)
+        if target is None or spell not in spell_costs:
+            return None
+        if self.game_vars["gold"] < spell_costs[spell]:
+            return None
+        self.game_vars.update({"gold": self.game_vars["gold"] - spell_costs[spell]})
+        self._record(spell, position)
+        return self.area_effect(spells[spell], target[0], target[1])
+
+    # area_spans()
+    #   - Returns (row, first column, last column + 1) for every row the area covers,
+    #     already clipped to the field
+    #   - square covers radius rows and columns each way, diamond narrows by one column
+    #     per row away from the center, lane only covers the center row
+    def area_spans(self, shape, radius, center_row, center_column):
+        rows, columns = self.game_vars["rows"], self.game_vars["columns"]
+        if shape == "lane":
+            radius_rows = 0
+        else:
+            radius_rows = radius
+        spans = []
+        for row in range(max(center_row - radius_rows, 0), min(center_row + radius_rows + 1, rows)):
+            reach = radius
+            if shape == "diamond":
+                reach = radius - abs(row - center_row)
+            spans.append((row, max(center_column - reach, 0), min(center_column + reach + 1, columns)))
+        return spans
+
+    # area_effect()
+    #   - Applies a spell (an entry of spells) centered on a cell
+    #   - Returns the total damage or healing done
+    def area_effect(self, spell, center_row, center_column):
+        spans = self.area_spans(spell["shape"], spell["radius"], center_row, center_column)
+        if spell["effect"] == "damage":
+            return self._area_damage(spell, spans, center_row, center_column)
+        return self._area_heal(spell, spans, center_row, center_column)
+
+    # _area_damage()
+    #   - the monsters in each span are found with a bisect on the lane index
+    #   - killed monsters give gold and threat as usual
+    def _area_damage(self, spell, spans, center_row, center_column):
+        total_damage = 0
+        for row, first, last in spans:
+            lane = self.lanes[row]
+            # copied, killing a monster changes the lane
+            targets = lane[bisect.bisect_left(lane, first):bisect.bisect_left(lane, last)]
+            for column in targets:
+                unit = self.field[row][column]
+                damage = spell["power"]
+                if row == center_row and column == center_column:
+                    damage = damage * spell["center_multiplier"]
+                unit.hp = unit.hp - damage
+                self._touch(row, column)
+                total_damage += damage
+                self._emit("spell_damage", spell["NAME"], damage, unit.name)
+                if unit.hp <= 0:
+                    self._kill(row, column, spell["NAME"].upper())
+        self._emit("spell_total_damage", spell["NAME"], total_damage)
+        return total_damage
+
+    # _area_heal()
+    #   - heals every injured defender in the spans, units cannot be healed past their max HP
+    def _area_heal(self, spell, spans, center_row, center_column):
+        total_healing = 0
+        for row, first, last in spans:
+            cells = self.field[row]
+            for column in range(first, min(last, 3)):  # defenders only stand in the first 3 columns
+                unit = cells[column]
+                if unit is None or unit.name not in defender_list:  # ignores empty cells and monsters
+                    continue
+                if unit.hp == unit.max_hp:  # already at max HP
+                    continue
+                healing = spell["power"]
+                if row == center_row and column == center_column:
+                    healing = healing * spell["center_multiplier"]
+                healing_done = min(healing, unit.max_hp - unit.hp)
+                unit.hp += healing_done
+                self._touch(row, column)
+                total_healing += healing_done
+                self._emit("healed", unit.name, healing_done)
+        self._emit("spell_total_healing", spell["NAME"].capitalize(), total_healing)
+        return total_healing
+
+    # fireball() and healing_circle()
+    #   - the two spells of the spell shop, kept for scripts that cast them directly
+    def fireball(self, center_row, center_column):
+        return self.area_effect(spells["fireball"], center_row, center_column)
+
+    def healing_circle(self, center_row, center_column):
+        return self.area_effect(spells["heal"], center_row, center_column)
+
+    # spell_targets()
+    #   - Returns the k best centers for a spell as (position, damage or healing done,
+    #     gold from kills), most gold first, then most damage or healing
+    #   - Only the units are looked at, not the cells. Along a row of centers the
+    #     score only changes where a unit comes into or goes out of reach, so every
+    #     row of centers is scored as runs of centers between those changes, and the
+    #     cost grows with the number of units, not the size of the field.
+    #   - every center of a run scores the same, so only the first k centers of the
+    #     best k runs can make it, ties go to the first center in reading order
+    #   - what the spell would do to the units of a row is kept until the row
+    #     changes (see row_versions)
+    def spell_targets(self, spell, k=3):
+        rows, columns = self.game_vars["rows"], self.game_vars["columns"]
+        radius = spell["radius"]
+        radius_rows = 0 if spell["shape"] == "lane" else radius
+        units = [self._spell_row(spell, row) for row in range(rows)]
+        repeat = itertools.repeat
+
+        runs = []  # (gold, amount, -row, -first column, last column + 1) of the best runs of every row
+        row_changes = {}  # (row, reach) -> unit_changes(), the same for a few center rows running
+        for center_row in range(rows):
+            changes = []  # (column, change of amount, change of gold) going left to right
+            for row in range(max(center_row - radius_rows, 0), min(center_row + radius_rows + 1, rows)):
+                reach = radius
+                if spell["shape"] == "diamond":
+                    reach = radius - abs(row - center_row)
+                if (row, reach) not in row_changes:
+                    row_changes[row, reach] = unit_changes(units[row][1:4], reach)
+                changes += row_changes[row, reach]
+            if not changes:
+                continue
+            changes += unit_changes(units[center_row][4:], 0)  # the center multiplier
+            changes += [(0, 0, 0), (columns, 0, 0)]  # so that runs start at both edges of the field
+            changes.sort(key=operator.itemgetter(0))  # merges the rows, each is sorted already
+
+            # a run starts at the last change of a column and scores the sum of the changes so far
+            starts = list(map(operator.itemgetter(0), changes))
+            last = list(map(operator.ne, starts, starts[1:] + [None]))
+            amounts = list(itertools.compress(itertools.accumulate(map(operator.itemgetter(1), changes)), last))
+            rewards = list(itertools.compress(itertools.accumulate(map(operator.itemgetter(2), changes)), last))
+            starts = list(itertools.compress(starts, last))
+            first, end = bisect.bisect_left(starts, 0), bisect.bisect_left(starts, columns)
+            runs += heapq.nlargest(k, zip(rewards[first:end], amounts[first:end], repeat(-center_row),
+                                          map(operator.neg, starts[first:end]), starts[first + 1:end + 1]))
+
+        candidates = []
+        for reward, amount, row, column, end in heapq.nlargest(k, runs):
+            if amount > 0:
+                candidates += [(reward, amount, row, -center_column)
+                               for center_column in range(-column, min(end, k - column))]
+        return [(row_name[-row] + str(1 - column), amount, reward)
+                for reward, amount, row, column in heapq.nlargest(k, candidates)]
+
+    # _spell_row()
+    #   - (row version, columns of the units the spell would do something to, the
+    #     damage or healing each would take, the gold for the ones it would kill,
+    #     then the columns, extra damage or healing and extra gold of the units
+    #     where being the center makes a difference)
+    def _spell_row(self, spell, row):
+        key = (spell["effect"], spell["power"], spell["center_multiplier"], row)
+        version = (self.row_versions[row], self.game_vars["danger_level"])
+        cached = self.spell_rows.get(key)
+        if cached is not None and cached[0] == version:
+            return cached
+        cached = (version, [], [], [], [], [], [])
+        center_power = spell["power"] * spell["center_multiplier"]
+        for column, unit in self._spell_cells(spell, row):
+            if spell["effect"] == "damage":
+                amount = min(unit.hp, spell["power"])
+                center_amount = min(unit.hp, center_power)
+                reward = unit.stats.reward if unit.hp <= spell["power"] else 0
+                center_reward = unit.stats.reward if unit.hp <= center_power else 0
+            else:
+                amount = min(unit.max_hp - unit.hp, spell["power"])
+                center_amount = min(unit.max_hp - unit.hp, center_power)
+                reward = center_reward = 0
+            if center_amount == 0:  # nothing to damage or heal
+                continue
+            for values, value in zip(cached[1:4], (column, amount, reward)):
+                values.append(value)
+            if center_amount > amount or center_reward > reward:
+                for values, value in zip(cached[4:], (column, center_amount - amount, center_reward - reward)):
+                    values.append(value)
+        self.spell_rows[key] = cached
+        return cached
+
+    # _spell_cells()
+    #   - (column, unit) for every unit of the row the spell works on
+    def _spell_cells(self, spell, row):
+        if spell["effect"] == "damage":
+            return [(column, self.field[row][column]) for column in self.lanes[row]]
+        return [(column, self.field[row][column]) for column in range(min(3, self.game_vars["columns"]))
+                if self.field[row][column] is not None and self.field[row][column].name in defender_list]
+
+    # apply_action()
+    #   - Runs one player action, returns True if it went through
+    #       ("buy", unit_name, position)
+    #       ("upgrade", position)
+    #       ("fireball", position) or ("heal", position)
+    #       ("cheat",)
+    def apply_action(self, action):
+        if self.status != "playing":
+            return False
+        kind = action[0]
+        try:
+            if kind == "buy":
+                return self.buy_unit(action[1], action[2])
+            elif kind == "upgrade":
+                return self.upgrade_unit(action[1])
+            elif kind in spell_costs:
+                return self.cast_spell(kind, action[1]) is not None
+            elif kind == "cheat":
+                self.cheat()
+                return True
+        except (ValueError, IndexError):
             return False
-    else:
-        print("Row specified is not valid")
         return False
 
+    # step()
+    #   - Applies the actions in order, then ends the turn
+    #   - Returns the end_turn result, plus how many actions were rejected
+    def step(self, actions=()):
+        rejected = 0
+        for action in actions:
+            if not self.apply_action(action):
+                rejected += 1
+        result = self.end_turn()
+        result["rejected"] = rejected
+        return result
+
+    # end_turn()
+    #   1. Defender Attack
+    #       - Check if game is won
+    #   2. Monster Advance (and Monster Attack)
+    #       - Check if monster exits player field
+    #   3. Spawn Monster
+    #   4. Threat and danger calculation
+    #   - Also updates gold and the turn counter
+    #   - Returns a summary of the turn
+    def end_turn(self):
+        killed_before = self.game_vars["monsters_killed"]
+        if self.status == "playing":
+            self._record("end")
+            self._play_turn()
+            if self.debug:
+                problems = self.check_counters()
+                if problems:
+                    raise RuntimeError("counters do not match the field: " + ", ".join(problems))
+            if self.journal is not None:
+                self.journal.write(self)
+            if self.autosaver is not None:
+                self.autosaver.submit(self)
+            if self.turn_stats is not None:
+                self.turn_stats.write(self)
+        return {"status": self.status,
+                "turn": self.game_vars["turn"],
+                "gold": self.game_vars["gold"],
+                "monsters_killed": self.game_vars["monsters_killed"],
+                "kills": self.game_vars["monsters_killed"] - killed_before,
+                }
+
+    # _play_turn()
+    #   - Runs the phases of a turn in order, stopping as soon as the game is over
+    def _play_turn(self):
+        self._defender_phase()
+
+        # check if the user has won the game through monsters killed
+        if self.game_vars["monsters_killed"] >= self.game_vars["monster_kill_target"]:
+            self.status = "won"
+            return
+
+        self._monster_phase()
+        if self.status != "playing":
+            return
+
+        self._spawn_phase()
+        self._danger_phase()
+
+        self.game_vars.update({"gold": self.game_vars["gold"] + 1})  # add 1 gold per round
+        self.game_vars.update({"turn": self.game_vars["turn"] + 1})  # update the turn counter each round
+
+    # _defender_phase()
+    #   - defender attack, each unit in the first 3 columns of every row
+    def _defender_phase(self):
+        field = self.field
+        self.cells_scanned += self.game_vars["rows"] * 3
+        for row in range(0, self.game_vars["rows"]):
+            for column in range(3):
+                unit = field[row][column]
+                if unit is not None and unit.stats.code < first_monster_code:
+                    self.defender_attack(unit.name, row, column)
+
+    # _monster_phase()
+    #   - monster advance, each monster from left to right
+    #   - monsters only move left and never pass each other, so going through the
+    #     lane index in order visits every monster exactly once
+    def _monster_phase(self):
+        field = self.field
+        for row in range(0, self.game_vars["rows"]):
+            lane = self.lanes[row]
+            for i in range(len(lane)):
+                column = lane[i]
+                self.monster_advance(field[row][column].name, row, column)
+                if self.status != "playing":
+                    return
+
+    # _spawn_phase()
+    #   - spawn monster according to spawn frequency
+    #   - threat increase by 1 to (danger_level) each round
+    #     as threat increases, more monsters will spawn
+    def _spawn_phase(self):
+        if self.queued_monsters > 0:
+            self._release_spawn_queues()
+        if self.game_vars["turn"] % self.game_vars["spawn_frequency"] == 0:
+            self.spawn_monster()
+
+        threat_increase = self.threat_rng.randint(1, self.game_vars["danger_level"])
+        if self.game_vars["THREAT"] + threat_increase >= 10:
+            new_threat = 0
+            self._emit("threat_spawn")
+            self.spawn_monster()
+        else:
+            new_threat = self.game_vars["THREAT"] + threat_increase
+        self.game_vars.update({"THREAT": new_threat})
+
+    # _danger_phase()
+    #   - danger level - as it increases, monsters gain additional stats.
+    def _danger_phase(self):
+        self.game_vars.update({"DANGER": self.game_vars["DANGER"] + 1})  # increases by 1 each round regardless
+        if self.game_vars["DANGER"] % 12 == 0:
+            # Danger increases by 1 every 12 turns
+            self.game_vars.update({"danger_level": self.game_vars["danger_level"] + 1})
+            self._emit("danger_up")
+            # only the monsters that spawn from now on are stronger, the ones on the
+            # field keep the danger level they spawned at (see stats_for()). The
+            # last danger level's stats go too if no monster has it.
+            self._drop_unused_stats(self.game_vars["danger_level"] - 1)
+
+    # _drop_unused_stats()
+    #   - drops the monster stats of the old danger level, unless a monster on the
+    #     field still has it (then _count_level() drops them when it goes)
+    def _drop_unused_stats(self, level):
+        if self.level_counts[level] == 0:
+            self.level_counts.pop(level, None)
+            self._drop_stats(level)
+
+    # lane_summary()
+    #   - (monsters in the row, column of the one nearest to the city or None)
+    def lane_summary(self, row):
+        lane = self.lanes[row]
+        return len(lane), lane[0] if lane else None
+
+    # frontier()
+    #   - (row, column) of the monster nearest to the city, the first row on a tie,
+    #     or None if there are no monsters
+    def frontier(self):
+        nearest = None
+        for row in range(self.game_vars["rows"]):
+            lane = self.lanes[row]
+            if lane and (nearest is None or lane[0] < nearest[1]):
+                nearest = (row, lane[0])
+        return nearest
+
+    # _kill()
+    #   - Removes a dead monster from the field
+    #   - Updates kills, gold and the threat level
+    #   - killer is the defender type (or spell) that made the kill
+    def _kill(self, row, column, killer):
+        monster = self.field[row][column]
+        monster_name = monster.name
+        reward = monster.stats.reward
+        self.game_vars.update({"monsters_killed": self.game_vars["monsters_killed"] + 1})
+        self.kill_counts[killer] = self.kill_counts.get(killer, 0) + 1
+        self.game_vars.update({"gold": self.game_vars["gold"] + reward})
+        self.game_vars.update({"THREAT": self.game_vars["THREAT"] + reward})
+        self._emit("killed", monster_name, reward)
+        self._remove_unit(row, column)
+
+    # defender_attack()
+    #   - defenders that do not attack (walls) do nothing, the others only on the
+    #     turns of their fire_every (cannons on even turns)
+    #   - otherwise attack the first monster in front of the defender, found
+    #     with a bisect on the lane index
+    def defender_attack(self, defender_name, defender_row, defender_column):
+        stats = self.field[defender_row][defender_column].stats
+        if not stats.attacks:
+            return
+        if self.game_vars["turn"] % stats.fire_every != 0:
+            self._emit_names("cannon_charging", defender_name)
+            return
+        lane = self.lanes[defender_row]
+        if not lane:  # no monsters in this lane
+            return
+        target = bisect.bisect_right(lane, defender_column)
+        if target < len(lane):
+            self._strike(defender_name, defender_row, defender_column, lane[target])
+
+    # _strike()
+    #   - the defender attacks the monster at attack_column in the same lane
+    #       - a defender with an attack range (ronin) only attacks monsters within
+    #         it, i.e. directly in front (+1 range per upgrade)
+    #       - damage_against cuts the damage some monsters take, i.e. skeletons
+    #         take half damage from archers
+    #       - if health falls to 0 or below, monster dies
+    #   - if monster is alive and the defender pushes back (cannon)
+    #       - determine chance of push back
+    #   - Returns "killed", "pushed" or None, so callers can keep track of the monster
+    def _strike(self, defender_name, defender_row, defender_column, attack_column):
+        lane = self.field[defender_row]
+        defender = lane[defender_column]
+        target = lane[attack_column]
+
+        self.cells_scanned += 1  # the target, the defender's cell was counted by the phase
+        stats = defender.stats
+        if stats.reach is not None and attack_column > defender_column + stats.reach:
+            self._emit_names("ronin_waiting", defender_name)
+            return None
+
+        # calculate min and max damage while accounting for upgrade level
+        defender_damage = self.combat_rng.randint(stats.min_damage, stats.max_damage)
+
+        percent = stats.damage_against.get(target.stats.code)
+        if percent is not None:
+            defender_damage = -(-defender_damage * percent // 100)  # rounded up
+            self._emit_names("arrows_missed", defender_name, target.name)
+
+        self._emit("defender_attack", defender_name, defender_damage, target.name)
+        target.hp = target.hp - defender_damage
+        self._touch(defender_row, attack_column)
+
+        if target.hp <= 0:
+            self._kill(defender_row, attack_column, defender_name)
+            return "killed"
+
+        # Pushback applies only if the monster has NOT died
+        # the lowest roll goes up with the upgrade level (+10 for cannons)
+        if stats.pushback_floor is not None:
+            if stats.pushback_floor >= 100:
+                cannon_choice = 100
+            else:
+                cannon_choice = self.combat_rng.randint(stats.pushback_floor, 100)
+
+            # the monster can only be pushed into an empty space on the field
+            on_field = attack_column + 1 < self.game_vars["columns"]
+            if on_field:
+                self.cells_scanned += 1  # the cell behind the monster
+            if on_field and lane[attack_column + 1] is None and cannon_choice > 50:
+                self._emit_names("pushed_back", defender_name, target.name)
+                self._move_unit(defender_row, attack_column, attack_column + 1)
+                return "pushed"
+            self._emit_names("held_ground", defender_name, target.name)
+        return None
+
+    # monster_advance()
+    #   - monsters move equal to their movement speed towards the left
+    #   - IF there is something DIRECTLY in front check unit type
+    #       - Unit is a monster -> do nothing
+    #       - Unit is a defender -> do attack function
+    #   - ELSE stop in front of the first unit in the way
+    #   - walking off the left side of the field loses the game
+    def monster_advance(self, monster_name, row, column):
+        lane = self.field[row]
+        moves = lane[column].stats.moves
+
+        steps = 0
+        for x in range(column - 1, column - moves - 1, -1):
+            if x < 0:
+                self.cells_scanned += 1 + column  # its own cell and every one in front
+                self._remove_unit(row, column)
+                self._emit("monster_step", monster_name, column, row_name[row])
+                self._emit("reached_city", monster_name)
+                self._emit("game_lost")
+                self.status = "lost"
+                return
+            if lane[x] is not None:  # Check if unit in front is monster or unit
+                if steps == 0 and lane[x].stats.code < first_monster_code:
+                    self.monster_attack(monster_name, row, x)
+                break
+            steps += 1
+        # its own cell, the empty cells it walked over and the one it stopped at
+        self.cells_scanned += 1 + min(steps + 1, moves)
+
+        # print the movement to notify the user
+        if steps >= 1:
+            self._move_unit(row, column, column - steps)
+            self._emit("monster_step", monster_name, steps, row_name[row])
+
+    # monster_attack()
+    #   - uses RNG to determine damage to the defender at (row, column)
+    #   - if inflicted damage kills the defender, replace with none
+    #   - the monster attacking stands right behind the defender
+    def monster_attack(self, monster_name, row, column):
+        stats = self.field[row][column + 1].stats
+        monster_damage = self.monster_rng.randint(stats.min_damage, stats.max_damage)
+        defender = self.field[row][column]
+        self._emit("monster_attack", monster_name, monster_damage, defender.name)
+        defender.hp = defender.hp - monster_damage
+        self._touch(row, column)
+        if defender.hp <= 0:
+            self._remove_unit(row, column)
+
+    # spawn_monster()
+    #   - Spawns a random monster in a random lane on the right side
+    #   - if in endless mode, random number of mobs will spawn
+    #   - Regular game mode: one monster, in a random lane that has room for it.
+    #     If every lane is full, it waits in the queue of a random lane.
+    #   - monsters that land on a lane that is full, or has monsters waiting
+    #     already, join the back of that lane's queue
+    def spawn_monster(self):
+        if self.game_vars["game_mode"] == 0:
+            unit_name = monster_list[self.spawn_rng.randint(0, len(monster_list) - 1)]
+            if self.free_spawn_rows:
+                spawn_row = self.free_spawn_rows[self.spawn_rng.randrange(len(self.free_spawn_rows))]
+            else:
+                spawn_row = self.spawn_rng.randint(0, self.game_vars["rows"] - 1)
+            self._spawn_in_lane(spawn_row, unit_name)
+
+        # ( Endless Horde ) number of monsters that will be spawned this round is random
+        elif self.game_vars["game_mode"] == 1:
+            num_monster_spawn = self.spawn_rng.randint(1, self.game_vars["rows"])
+            for i in range(0, num_monster_spawn + 1):
+                unit_name = monster_list[self.spawn_rng.randint(0, len(monster_list) - 1)]
+                spawn_row = self.spawn_rng.randint(0, self.game_vars["rows"] - 1)  # which row to spawn
+                self._spawn_in_lane(spawn_row, unit_name)
+
+    # _spawn_in_lane()
+    #   - places the monster on the last cell of the lane, or queues it up behind
+    #     the monsters already waiting there
+    #   - a monster that does not fit in the queue is dropped
+    def _spawn_in_lane(self, row, unit_name):
+        queue = self.spawn_queues[row]
+        if not queue:
+            self.cells_scanned += 1  # the spawn cell
+            if self._place(row, self.game_vars["columns"] - 1, unit_name):
+                return
+        if len(queue) >= self.game_vars["spawn_queue_limit"]:
+            self.dropped_monsters += 1
+            self._emit("spawn_dropped", unit_name, row_name[row])
+            return
+        queue.append(unit_name)
+        self.queued_monsters += 1
+
+    # _release_spawn_queues()
+    #   - the first monster waiting in each lane comes on if the last cell is free
+    def _release_spawn_queues(self):
+        for row in list(self.free_spawn_rows):
+            queue = self.spawn_queues[row]
+            if queue:
+                self.cells_scanned += 1
+                self._place(row, self.game_vars["columns"] - 1, queue.pop(0))
+                self.queued_monsters -= 1
+
+
+# load_save()
+#   - Starts a new engine (GameEngine unless engine_class is given) from a save file
+#   - binary saves are memory mapped, so only the occupied cells are ever read
+#   - older JSON saves of [game_vars, field] load as well
+def load_save(path, engine_class=None, output=None, record=False):
+    if engine_class is None:
+        engine_class = GameEngine
+    with open(path, "rb") as save_file:
+        if save_file.read(len(save_magic)) != save_magic:
+            save_file.seek(0)
+            saved_game_vars, saved_field = json.load(save_file)
+            return engine_class(saved_game_vars, saved_field, output=output, record=record)
+        data = mmap.mmap(save_file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    version = save_header.unpack_from(data, 0)[1]
+    if version not in save_layouts:
+        raise ValueError("save file version {} is not supported".format(version))
+    keys = save_layouts[version]
+    settings = dict(game_vars)  # keys added after this version keep their defaults
+    settings.update(zip(keys, struct.unpack_from("<{}q".format(len(keys)), data, save_header.size)))
+    offset = save_header.size + 8 * len(keys)
+    if len(data) != offset + settings["rows"] * settings["columns"] * cell_records[version].size:
+        raise ValueError("save file is cut short or has the wrong field size")
+
+    engine = engine_class(settings, generate_field(settings["rows"], settings["columns"]), output=output,
+                          record=record)
+    engine.unpack_cells(data, offset, version)
+    if engine.history is not None:
+        engine.history["field"] = engine.unit_cells()
+    return engine
+
+
+# convert_json_save()
+#   - Rewrites an old JSON save as a binary save
+def convert_json_save(json_path, path):
+    load_save(json_path).save(path)
+
+
+# Journal
+#   Autosaves a game after every turn by appending only what changed that turn to
+#   path.log, one JSON line per turn:
+#       {"checkpoint": 40, "turn": 43, "status": "playing",
+#        "vars": {"gold": 21, ...}, "cells": [[row, column, unit or null], ...]}
+#   Every checkpoint_every turns the whole game is saved to path.dat instead (see
+#   GameEngine.save()) and the log is emptied, so it never holds more than
+#   checkpoint_every turns. "checkpoint" is the turn of the checkpoint an entry
+#   follows on from, which tells recover_journal() to skip entries left over from
+#   before a checkpoint if the game stopped between saving it and emptying the log.
+class Journal:
+    def __init__(self, engine, path, checkpoint_every=20):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.log_file = open(path + ".log", "a")
+        self.changed = set()
+        engine.change_sets.append(self.changed)
+        engine.journal = self
+        self.checkpoint(engine)
+
+    # checkpoint()
+    #   - save() replaces the old checkpoint in one go, so there is always a whole one on disk
+    def checkpoint(self, engine):
+        engine.save(self.path + ".dat")
+        self.log_file.truncate(0)
+        self.checkpoint_turn = engine.game_vars["turn"]
+        self.saved_vars = dict(engine.game_vars)
+        self.changed.clear()
+
+    # write()
+    #   - called by GameEngine.end_turn(), costs as much as the turn changed
+    #   - a finished game is always logged, checkpoints do not keep the status
+    def write(self, engine):
+        if engine.status == "playing" \
+                and engine.game_vars["turn"] - self.checkpoint_turn >= self.checkpoint_every:
+            self.checkpoint(engine)
+            return
+        changed_vars = {key: value for key, value in engine.game_vars.items() if self.saved_vars.get(key) != value}
+        cells = []
+        for row, column in self.changed:
+            unit = engine.field[row][column]
+            cells.append([row, column, None if unit is None else unit.to_list()])
+        entry = {"checkpoint": self.checkpoint_turn,
+                 "turn": engine.game_vars["turn"],
+                 "status": engine.status,
+                 "vars": changed_vars,
+                 "cells": cells,
+                 }
+        self.log_file.write(json.dumps(entry) + "\n")
+        self.log_file.flush()
+        self.saved_vars.update(changed_vars)
+        self.changed.clear()
+
+    def close(self, engine):
+        self.log_file.close()
+        engine.change_sets.remove(self.changed)
+        engine.journal = None
+
+
+# recover_journal()
+#   - Starts a new engine from the last checkpoint of a journal and plays the log
+#     back on top of it
+#   - a line cut short by the game stopping halfway through writing it is ignored
+#   - the engine is not journaled itself, start a new Journal to go on saving
+def recover_journal(path, engine_class=None, output=None, record=False):
+    engine = load_save(path + ".dat", engine_class, output, record)
+    checkpoint_turn = engine.game_vars["turn"]
+    if not os.path.exists(path + ".log"):
+        return engine
+    with open(path + ".log") as log_file:
+        for line in log_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            if entry["checkpoint"] != checkpoint_turn:
+                continue
+            for row, column, unit in entry["cells"]:
+                if engine.field[row][column] is not None:
+                    engine._remove_unit(row, column)
+                if unit is not None:
+                    engine._add_unit(row, column, engine.make_unit(unit))
+            engine.game_vars.update(entry["vars"])
+            engine.status = entry["status"]
+    if engine.history is not None:
+        engine.history["game_vars"] = dict(engine.game_vars)
+        engine.history["field"] = engine.unit_cells()
+    return engine
+
+
+# Autosaver
+#   Saves a game after every turn on a background thread, so the turn loop never
+#   waits for the save to be written.
+#   - at the end of every turn only the cells that changed are copied into a
+#     snapshot (see GameEngine.snapshot())
+#   - snapshots that come in while a save is still being written are merged into
+#     one, and written together once the thread is free
+#   - saves rotate through slots files, path.0.dat, path.1.dat, ... so a save
+#     that goes wrong never replaces the only one
+#   - unsaved[slot] holds the cells changed since that slot was last written, and
+#     a save only writes those into the slot file, so it costs as much as the
+#     turns changed and not the size of the field. The first save of each slot
+#     writes a new file, with every cell the game has changed since it started.
+#   - the save_magic of a slot file is blanked out while its cells are being
+#     written and put back last, so a save that stops halfway is never loaded
+#     (see latest_save())
+class Autosaver:
+    def __init__(self, engine, path, slots=3):
+        self.path = path
+        self.slots = slots
+        self.next_slot = 0
+        self.unsaved = [{} for slot in range(slots)]
+        self.written = set()  # slots whose file this Autosaver wrote, the others may be from another game
+        self.rows = engine.game_vars["rows"]
+        self.columns = engine.game_vars["columns"]
+        self.pending = None
+        self.saves = 0  # saves written
+        self.merged = 0  # snapshots merged into another one before it was written
+        self.closing = False
+        self.changed = set()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        engine.change_sets.append(self.changed)
+        engine.autosaver = self
+        self.changed.update(engine.occupied_cells())  # the first save has every unit in it
+        self.submit(engine)
+
+    def slot_path(self, slot):
+        return "{}.{}.dat".format(self.path, slot)
+
+    # submit()
+    #   - called by GameEngine.end_turn()
+    def submit(self, engine):
+        snapshot = engine.snapshot(self.changed)
+        self.changed.clear()
+        with self.condition:
+            if self.pending is None:
+                self.pending = snapshot
+            else:
+                self.pending["game_vars"] = snapshot["game_vars"]
+                self.pending["cells"].update(snapshot["cells"])
+                self.merged += 1
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closing:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                snapshot = self.pending
+                self.pending = None
+            for unsaved in self.unsaved:
+                unsaved.update(snapshot["cells"])
+            self._write(self.next_slot, snapshot["game_vars"])
+            self.next_slot = (self.next_slot + 1) % self.slots
+            self.saves += 1
+
+    # _write()
+    #   - Writes the unsaved cells of the slot into its file, then the header
+    #   - the file is memory mapped, so only the pages of the changed cells are written
+    def _write(self, slot, saved_game_vars):
+        path = self.slot_path(slot)
+        header = pack_header(saved_game_vars)
+        if slot in self.written:
+            save_file = open(path, "r+b")
+        else:
+            # a new file of all empty cells, which takes no time to make
+            save_file = open(path + ".tmp", "w+b")
+            save_file.truncate(len(header) + self.rows * self.columns * cell_record.size)
+        with save_file, mmap.mmap(save_file.fileno(), 0) as data:
+            data[:len(save_magic)] = bytes(len(save_magic))
+            for (row, column), unit in self.unsaved[slot].items():
+                offset = len(header) + (row * self.columns + column) * cell_record.size
+                if unit is None:
+                    cell_record.pack_into(data, offset, 0, 0, 0, 0)
+                else:
+                    cell_record.pack_into(data, offset, unit_codes[unit[0]], unit[1], unit[2], unit[3])
+            data[:len(header)] = header
+        if slot not in self.written:
+            os.replace(path + ".tmp", path)
+            self.written.add(slot)
+        self.unsaved[slot] = {}
+
+    # close()
+    #   - Writes the snapshot still waiting, if any, then stops the thread
+    def close(self, engine):
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+        self.thread.join()
+        engine.change_sets.remove(self.changed)
+        engine.autosaver = None
+
+
+# TurnStats
+#   Optional timing and counters for end_turn, i.e. TurnStats(engine, "turn_stats")
+#   - times every phase of the turn and every call of the engine's unit_calls
+#     (defender_attack / monster_advance on GameEngine), and counts kills,
+#     pushbacks and the cells the phases looked at (see cells_scanned)
+#   - after every turn, appends the turn's record to path.jsonl and rewrites the
+#     running totals to path.prom in the Prometheus text format
+#   - the hooks are wrappers set on the engine itself, so an engine without
+#     TurnStats runs exactly the same code as before. close() takes them off.
+timed_phases = ["_defender_phase", "_monster_phase", "_spawn_phase", "_danger_phase"]
+
+
+class TurnStats:
+    def __init__(self, engine, path):
+        self.engine = engine
+        self.path = path
+        self.record = self.new_record()
+        self.totals = self.new_record()
+        self.turns = 0
+        self.killed_before = engine.game_vars["monsters_killed"]
+        self.scanned_before = engine.cells_scanned
+        self.log = open(path + ".jsonl", "a")
+        self.timed_calls = timed_phases + list(engine.unit_calls)
+        for name in self.timed_calls:
+            setattr(engine, name, self._timed(name, getattr(engine, name)))
+        engine._strike = self._counted_strike(engine._strike)
+        engine.turn_stats = self
+
+    @staticmethod
+    def new_record():
+        return {"seconds": {}, "calls": {}, "cells_scanned": 0, "kills": 0, "pushbacks": 0}
+
+    # measure()
+    #   - Calls function(*args) and adds its time and one call to name
+    def measure(self, name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = self.record["seconds"]
+        seconds[name] = seconds.get(name, 0) + time.perf_counter() - start
+        self.record["calls"][name] = self.record["calls"].get(name, 0) + 1
+        return result
+
+    def _timed(self, name, method):
+        label = name.lstrip("_")
+
+        def timed(*args):
+            return self.measure(label, method, *args)
+        return timed
+
+    def _counted_strike(self, strike):
+        def counted(*args):
+            outcome = strike(*args)
+            if outcome == "pushed":
+                self.record["pushbacks"] += 1
+            return outcome
+        return counted
+
+    # write()
+    #   - Called by end_turn. The record also holds anything measured between the
+    #     last turn and this one, such as drawing the field.
+    def write(self, engine):
+        record = self.record
+        record["kills"] = engine.game_vars["monsters_killed"] - self.killed_before
+        self.killed_before = engine.game_vars["monsters_killed"]
+        record["cells_scanned"] = engine.cells_scanned - self.scanned_before
+        self.scanned_before = engine.cells_scanned
+        self.log.write(json.dumps(dict(record, turn=engine.game_vars["turn"])) + "\n")
+        self.log.flush()
+
+        self.turns += 1
+        for key in ("seconds", "calls"):
+            for name, value in record[key].items():
+                self.totals[key][name] = self.totals[key].get(name, 0) + value
+        for key in ("cells_scanned", "kills", "pushbacks"):
+            self.totals[key] += record[key]
+        self.record = self.new_record()
+        self.write_prometheus()
+
+    def write_prometheus(self):
+        lines = ["# HELP dd_seconds_total Wall time spent in each part of the turn",
+                 "# TYPE dd_seconds_total counter"]
+        lines += ['dd_seconds_total{{part="{}"}} {:.9f}'.format(name, value)
+                  for name, value in sorted(self.totals["seconds"].items())]
+        lines += ["# HELP dd_calls_total Calls of each part of the turn", "# TYPE dd_calls_total counter"]
+        lines += ['dd_calls_total{{part="{}"}} {}'.format(name, value)
+                  for name, value in sorted(self.totals["calls"].items())]
+        for name, value in (("turns", self.turns), ("cells_scanned", self.totals["cells_scanned"]),
+                            ("kills", self.totals["kills"]), ("pushbacks", self.totals["pushbacks"])):
+            lines += ["# TYPE dd_{}_total counter".format(name), "dd_{}_total {}".format(name, value)]
+        with open(self.path + ".prom.tmp", "w") as prometheus_file:
+            prometheus_file.write("\n".join(lines) + "\n")
+        os.replace(self.path + ".prom.tmp", self.path + ".prom")
+
+    def close(self):
+        for name in self.timed_calls + ["_strike"]:
+            delattr(self.engine, name)
+        self.engine.turn_stats = None
+        self.log.close()
+
+
+# latest_save()
+#   - The most recently written of the given save files, or None if there are none
+#   - a binary save without its save_magic, an autosave that stopped halfway
+#     through being written, is left out
+def latest_save(paths):
+    saved = [path for path in paths if os.path.exists(path) and whole_save(path)]
+    if not saved:
+        return None
+    return max(saved, key=os.path.getmtime)
+
+
+# whole_save()
+#   - False for a .dat file that does not start with save_magic
+def whole_save(path):
+    if not path.endswith(".dat"):
+        return True
+    with open(path, "rb") as save_file:
+        return save_file.read(len(save_magic)) == save_magic
+
+
+# load_replay()
+#   - Reads a replay saved by GameEngine.save_replay()
+def load_replay(path):
+    with open(path, "r") as replay_file:
+        return json.load(replay_file)
+
+
+# replay_game()
+#   - Plays a recorded game again from its seed and actions, without drawing anything
+#   - engine_class can be any GameEngine, i.e. to check that another engine plays
+#     the same game
+#   - turn_stats is a path to record TurnStats of the replayed turns to
+#   - Returns the engine at the end of the replay
+#   - Raises ValueError if an action is rejected or the game ends up somewhere else
+def replay_game(replay, engine_class=None, output=None, turn_stats=None):
+    if engine_class is None:
+        engine_class = GameEngine
+    version = replay.get("version")
+    if version not in (1, 2):
+        raise ValueError("Unknown replay version {}".format(version))
+    saved_field = copy.deepcopy(replay["field"])
+    if version == 2 and saved_field is not None:
+        settings = dict(game_vars)
+        settings.update(replay["game_vars"])
+        saved_field = cells_to_field(settings["rows"], settings["columns"], saved_field)
+    engine = engine_class(replay["game_vars"], saved_field, replay["seed"], output, replay["unit_stats"])
+    if turn_stats is not None:
+        TurnStats(engine, turn_stats)
+    try:
+        for action in replay["actions"]:
+            if action[0] == "end":
+                engine.end_turn()
+            elif not engine.apply_action(action):
+                raise ValueError("Replay action {} was rejected on turn {}".format(action, engine.game_vars["turn"]))
+    finally:
+        if engine.turn_stats is not None:
+            engine.turn_stats.close()
+    if "final" in replay and engine.state_checksum(dense=version == 1) != replay["final"]["checksum"]:
+        raise ValueError("Replay ended on turn {} in a different state than it was recorded".format(
+            engine.game_vars["turn"]))
+    return engine
 
-# generate_field()
-#   - function that only executes when field settings have been changed
-#   - else, the default 5x7 field will be used
-def generate_field():
-    global field
-    new_field = []
-    for i in range(0, game_vars["rows"]):
-        row = []
-        for j in range(0, game_vars["columns"]):
-            row.append(None)
-        new_field.append(row)
-        field = new_field
-    return field
+
+# ----------------------------------------------------------------------------------#
+# Command scripts
+#   The same actions as the menus, one command per line and without any prompts:
+#       buy ARCHR A1    upgrade B2      fireball C5     heal A1     cheat
+#       end             end 10          save slot3      status      draw
+#   Blank lines and lines starting with # are skipped.
+save_name_pattern = re.compile(r"[A-Za-z0-9_-]{1,64}$")  # save names can not leave the folder
+
+
+# CommandError
+#   Raised by run_command() for a command that is not understood or was rejected
+class CommandError(ValueError):
+    pass
+
+
+# status_line()
+#   - i.e. "Turn 3, 12 gold, threat 4/10, danger level 1, 2/20 monsters killed, playing"
+def status_line(engine):
+    return "Turn {}, {} gold, threat {}/{}, danger level {}, {}/{} monsters killed, {}".format(
+        engine.game_vars["turn"], engine.game_vars["gold"], engine.game_vars["THREAT"],
+        engine.game_vars["max_threat"], engine.game_vars["danger_level"], engine.game_vars["monsters_killed"],
+        engine.game_vars["monster_kill_target"], engine.status)
+
+
+# run_command()
+#   - Runs one command line on the engine
+#   - Returns the reply to show, "" for commands that have nothing to say
+#   - Raises CommandError if the command is not understood or the game rejects it
+def run_command(engine, line):
+    words = line.split()
+    if not words or words[0].startswith("#"):
+        return ""
+    command = words[0].lower()
+    arguments = words[1:]
+    if command == "end":
+        if len(arguments) > 1 or (arguments and not arguments[0].isdigit()):
+            raise CommandError("usage: end [turns]")
+        for turn in range(int(arguments[0]) if arguments else 1):
+            if engine.status != "playing":
+                break
+            engine.end_turn()
+        return ""
+    if command == "status" and not arguments:
+        return status_line(engine)
+    if command == "draw" and not arguments:
+        return render_field(engine)
+    if command == "view":
+        if engine.viewport is None:
+            engine.viewport = Viewport()
+        if not engine.viewport.apply(engine, arguments):
+            raise CommandError("usage: view left|right|up|down [cells], view follow or view POSITION")
+        return render_field(engine)
+    if command == "save":
+        if len(arguments) != 1 or not save_name_pattern.match(arguments[0]):
+            raise CommandError("usage: save NAME, made of letters, digits, - and _")
+        engine.save(arguments[0] + ".dat")
+        return "Saved {}.dat".format(arguments[0])
+
+    if command == "buy" and len(arguments) == 2:
+        action = ("buy", arguments[0].upper(), arguments[1])
+    elif (command == "upgrade" or command in spell_costs) and len(arguments) == 1:
+        action = (command, arguments[0])
+    elif command == "cheat" and not arguments:
+        action = ("cheat",)
+    else:
+        raise CommandError("unknown command: {}".format(line.strip()))
+    if not engine.apply_action(action):
+        raise CommandError("rejected: {}".format(line.strip()))
+    return ""
+
+
+# run_script()
+#   - Runs command lines on the engine, reading them batch_size at a time
+#   - replies go to reply, problems to report as "line N: ...", both optional
+#   - Returns the number of commands that failed
+def run_script(engine, lines, reply=None, report=None, batch_size=1000):
+    failed = 0
+    number = 0
+    lines = iter(lines)
+    batch = list(itertools.islice(lines, batch_size))
+    while batch:
+        for line in batch:
+            number += 1
+            try:
+                text = run_command(engine, line)
+            except CommandError as error:
+                failed += 1
+                if report is not None:
+                    report("line {}: {}".format(number, error))
+                continue
+            if text and reply is not None:
+                reply(text.rstrip("\n"))
+        batch = list(itertools.islice(lines, batch_size))
+    return failed
+
+
+# ----------------------------------------------------------------------------------#
+# Menus
+#   The menus are a thin client on top of GameEngine. They only prompt the user,
+#   print, and pass the choices on to the current game.
+#   Menus never call each other. Each one returns the name of the next screen
+#   (see screens below) and run_game() shows it, so the stack stays flat no
+#   matter how many turns are played. Returning None ends the game.
+game = None  # GameEngine of the game being played
+journal_every = 0  # turns between journal checkpoints, 0 is no journal (see options)
+autosave_slots = 0  # autosave files to rotate through, 0 is no autosave (see options)
+turn_stats_on = False  # record turn_stats.jsonl / turn_stats.prom (see options)
+
+
+# run_game()
+#   - Shows one screen after the other, until a screen returns None
+def run_game(screen="main"):
+    while screen is not None:
+        screen = screens[screen]()
 
 
 # show_main_menu()
@@ -228,64 +2047,83 @@ def show_main_menu():
             continue
         else:
             if main_menu_choice == 1:  # 1. start game
-                # The default game variables are stored in the dictionary as game_vars
-                # Checking if the field has been altered in the menu
-                if game_vars["options_changed"] == 1:
-                    generate_field()
-                    print(field)
-                if game_vars["game_mode"] == 1:
-                    # In endless, reward is doubled, and starting gold is increased
-                    # Increase the amount of monster needed to kill in order to win
-                    game_vars.update({"gold": 25})
-                    monsters["ZOMBI"].update({"REWARD": 6})
-                    monsters["WWOLF"].update({"REWARD": 8})
-                    monsters["SKELE"].update({"REWARD": 8})
-                    game_vars.update({"monster_kill_target": 30})
-                start_game()
+                # The game starts from the settings in game_vars, including changes made in options
+                return start_game()
             elif main_menu_choice == 2:  # 2. load game
-                load_game()
+                return load_game()
             elif main_menu_choice == 3:  # 3. options
-                options_menu()
+                return "options"
             elif main_menu_choice == 4:  # 4. quit
-                quit_game()
-            break
-    return
+                return quit_game()
 
 
 # Start the game
 def start_game():
+    global game
+    game = GameEngine(game_vars, output=print, record=True)
+    game.viewport = Viewport()
+    start_saving()
     print("-" * 19 + "\nDefend the city from undead monsters!\nGood Luck and have fun!\n")
-    draw_field()
+    return "field"
+
+
+# start_saving()
+#   - Turns on journal saves, autosaves and turn stats for the new game, if they
+#     are on in options
+def start_saving():
+    if journal_every > 0:
+        Journal(game, "journal", journal_every)
+    if autosave_slots > 0:
+        Autosaver(game, "autosave", autosave_slots)
+    if turn_stats_on:
+        TurnStats(game, "turn_stats")
+
+
+# stop_saving()
+#   - Waits for the last autosave to be written
+def stop_saving():
+    if game is not None and game.autosaver is not None:
+        game.autosaver.close(game)
+    if game is not None and game.turn_stats is not None:
+        game.turn_stats.close()
 
 
 # load_game()
-#   - Read from existing text file through json module
-#   - Note that there is only 1 save file at a time
-#   - Overwrite the field and game_vars with the new values
+#   - Loads whichever was written last of save.dat, the journal and the autosaves
+#   - an old save.txt from before binary saves is converted to save.dat first
+#   - a journal is recovered from its last checkpoint and log
+#   - Start a new GameEngine from the saved game_vars and field
+#   - Back to the main menu if there is no saved game
 def load_game():
-    global field
-    global game_vars
+    global game
     print("LOADING....")
-    save_file = open("save.txt", "r")  # Open the file containing the save
-    save_information = json.load(save_file)
-    game_vars, field = save_information
-    save_file.close()
-    draw_field()
-
-
-# options_menu()
-#   - Prompt user to choose which setting they want to change
-#       1. Size of field
-#       2. Monster spawning frequency
-#       3. Game mode
-#   - Updates game_vars values accordingly
+    if not os.path.exists("save.dat") and os.path.exists("save.txt"):
+        convert_json_save("save.txt", "save.dat")
+        print("Converted the old save.txt to save.dat")
+    newest = latest_save(["save.dat", "journal.log"] + ["autosave.{}.dat".format(slot) for slot in range(10)])
+    if newest is None:
+        print("No saved game found.")
+        return "main"
+    if newest == "journal.log":
+        game = recover_journal("journal", output=print, record=True)
+        print("Recovered the game from the journal at turn {}".format(game.game_vars["turn"]))
+    else:
+        game = load_save(newest, output=print, record=True)
+        print("Loaded {} at turn {}".format(newest, game.game_vars["turn"]))
+    game.viewport = Viewport()
+    start_saving()
+    return "field"
+
+
 def options_menu():
+    global journal_every, autosave_slots, turn_stats_on
     print("Customize the game the way you want to play!")
-    print("1. Edit field size\n2. Adjust spawning frequency\n3. Change game mode")
+    print("1. Edit field size\n2. Adjust spawning frequency\n3. Change game mode\n4. Journal saves"
+          + "\n5. Autosave\n6. Turn stats")
     while True:
         try:
             user_choice = int(input("Your Choice? "))
-            assert 1 <= user_choice <= 3
+            assert 1 <= user_choice <= 6
         except TypeError:
             print("Please enter a valid input")
             continue
@@ -338,7 +2176,7 @@ def options_menu():
                                     game_vars.update({"options_changed": 1})
                                     print("The field will now have {} rows. Good Luck!".format(
                                         game_vars["rows"]))
-                                    show_main_menu()
+                                    return "main"
                         # Editing number of columns
                         elif user_choice == 2:
                             while True:
@@ -363,10 +2201,10 @@ def options_menu():
                                     game_vars.update({"options_changed": 1})
                                     print("The field will now have {} columns. Good Luck!".format(
                                         game_vars["columns"]))
-                                    show_main_menu()
+                                    return "main"
 
                         else:
-                            show_main_menu()
+                            return "main"
 
             # Changing monster spawn frequency
             elif user_choice == 2:
@@ -388,7 +2226,55 @@ def options_menu():
                         game_vars.update({"spawn_frequency": user_choice})
                         game_vars.update({"options_changed": 1})
                         print("Monsters will now spawn every {} turns. Good Luck!".format(game_vars["spawn_frequency"]))
-                        show_main_menu()
+                        return "main"
+            # Journal saves, the game is saved to journal.dat / journal.log after every turn
+            elif user_choice == 4:
+                while True:
+                    print("How many turns between full saves? Only changes are saved in between (0 = off)")
+                    try:
+                        user_choice = int(input("Your Choice? "))
+                        assert user_choice >= 0
+                    except AssertionError:
+                        print("Please enter 0 or a positive number")
+                        continue
+                    except ValueError:
+                        print("Please enter a number")
+                        continue
+                    else:
+                        journal_every = user_choice
+                        if journal_every > 0:
+                            print("The game will be saved after every turn.")
+                        else:
+                            print("Journal saves are off.")
+                        return "main"
+            # Autosave, the game is saved in the background after every turn
+            elif user_choice == 5:
+                while True:
+                    print("How many autosave files to take turns writing? (Max = 10, 0 = off)")
+                    try:
+                        user_choice = int(input("Your Choice? "))
+                        assert 0 <= user_choice <= 10
+                    except AssertionError:
+                        print("Please enter a number between 0 and 10")
+                        continue
+                    except ValueError:
+                        print("Please enter a number")
+                        continue
+                    else:
+                        autosave_slots = user_choice
+                        if autosave_slots > 0:
+                            print("The game will be autosaved after every turn.")
+                        else:
+                            print("Autosave is off.")
+                        return "main"
+            # Turn stats, timings and counters of every turn for finding slow turns
+            elif user_choice == 6:
+                turn_stats_on = not turn_stats_on
+                if turn_stats_on:
+                    print("Every turn will be timed in turn_stats.jsonl and turn_stats.prom.")
+                else:
+                    print("Turn stats are off.")
+                return "main"
             # Change game mode
             else:
                 while True:
@@ -415,55 +2301,61 @@ def options_menu():
                             game_vars.update({"game_mode": 1})
                             print("A thick fog surrounds the city. An endless horde awaits."
                                   + "\nGame mode changed to endless")
-                        show_main_menu()
+                        return "main"
+
+
+# save_last_replay()
+#   - Keeps a replay of the game that is ending in replay.json
+def save_last_replay():
+    if game is not None and game.history is not None:
+        game.save_replay("replay.json")
+        print("A replay of this game has been saved to replay.json")
 
 
 # quit_game()
+#   - returns None, which ends run_game()
 def quit_game():
+    stop_saving()
+    save_last_replay()
     print("Bye! Know that the monsters are still invading while you are gone!")
-    exit()
+    return None
 
 
 # show_combat_menu() , prompts the user at the start of each round
 #   - Displays the choices that the user can take at the start of each round
 #   - Updates the variables depending on the user choice
 def show_combat_menu():
-    print("{:<16}{:<16}\n{:<16}{:<16}\n{:<16}{:<16}".format("1. Buy Unit", "2. Upgrade Unit",
-                                                            "3. End Turn", "4. Save game",
-                                                            "5. Spells", "6. Quit"))
+    print("{:<16}{:<16}\n{:<16}{:<16}\n{:<16}{:<16}\n{:<16}".format("1. Buy Unit", "2. Upgrade Unit",
+                                                                   "3. End Turn", "4. Save game",
+                                                                   "5. Spells", "6. Quit", "7. Move view"))
     while True:
         try:
             combat_choice = int(input("Your choice? "))
-            assert 6 >= combat_choice >= 0
+            assert 7 >= combat_choice >= 0
         except ValueError:
-            print("Invalid input, please enter number between 1 and 6")
+            print("Invalid input, please enter number between 1 and 7")
             continue
         except AssertionError:
-            print("Invalid input, please enter number between 1 and 6")
+            print("Invalid input, please enter number between 1 and 7")
             continue
         else:
             if combat_choice == 0:  # 0. Cheat mode ( hidden from user)
-                game_vars.update({"gold": 1000})
-                defenders["ARCHR"].update({"min_damage": 1000000})
-                defenders["ARCHR"].update({"max_damage": 10000000})
-                defenders["CANON"].update({"min_damage": 1000000})
-                defenders["CANON"].update({"max_damage": 10000000})
-                defenders["RONIN"].update({"min_damage": 1000000})
-                defenders["RONIN"].update({"max_damage": 10000000})
-                show_combat_menu()
+                game.cheat()
+                return "combat"
             elif combat_choice == 1:  # 1. buy unit
-                buy_unit()
+                return "buy"
             elif combat_choice == 2:  # 2. Upgrade unit
-                upgrade_unit_menu()
+                return "upgrade"
             elif combat_choice == 3:  # 3. end turn
-                end_turn()
+                return "end_turn"
             elif combat_choice == 4:  # 4. save game
-                save_game()
+                return "save"
             elif combat_choice == 5:  #
-                spells_menu()
+                return "spells"
             elif combat_choice == 6:  # quit
-                quit_game()
-            break
+                return quit_game()
+            elif combat_choice == 7:  # 7. move the window of the field
+                return "view"
 
 
 # buy_unit() , opens the shop then calls the place functions once unit selected
@@ -476,16 +2368,16 @@ def show_combat_menu():
 #   - Once user has placed the unit, it will return to the combat menu
 def buy_unit():
     # tutorial
-    if game_vars["first_time_shop"] == 1:
+    if game.game_vars["first_time_shop"] == 1:
         print("Welcome to the shop! You can purchase your units to help you defend the city using gold.")
-        game_vars.update({"first_time_shop": 0})  # update first time shop
+        game.game_vars.update({"first_time_shop": 0})  # update first time shop
 
     # Display Shop UI
     print("What do you wish to buy?")
     for i in range(0, len(defender_list)):
         print("{}. {} ({} Gold)".format(i + 1,
-                                        defenders[defender_list[i]]["NAME"],
-                                        defenders[defender_list[i]]["PRICE"]
+                                        game.defenders[defender_list[i]]["NAME"],
+                                        game.defenders[defender_list[i]]["PRICE"]
                                         ))
     print("{}. Return to combat menu".format(len(defender_list) + 1))
 
@@ -502,17 +2394,13 @@ def buy_unit():
             continue
         else:  # Verify if the user has enough gold
             if unit_choice == len(defender_list) + 1:
-                show_combat_menu()
-            if defenders[defender_list[unit_choice - 1]]["PRICE"] <= game_vars["gold"]:
-                new_gold = game_vars["gold"] - defenders[defender_list[unit_choice - 1]]["PRICE"]
-                game_vars.update({"gold": new_gold})
-                print("You have successfully bought the unit!")
-                print("You have {} gold left.".format(game_vars["gold"]))
-                unit_name = defender_list[unit_choice - 1]
+                return "combat"
+            unit_name = defender_list[unit_choice - 1]
+            if game.defenders[unit_name]["PRICE"] <= game.game_vars["gold"]:
                 while True:  # prompt user where to place
                     position = input("Place where? ")
                     try:
-                        assert place_unit(position, unit_name) is True
+                        assert game.buy_unit(unit_name, position) is True
                     except AssertionError:
                         print("Specified position is invalid")
                         continue
@@ -523,237 +2411,104 @@ def buy_unit():
                         print("You have entered invalid position, please enter row and column")
                         continue
                     else:
-                        return show_combat_menu()
+                        print("You have successfully bought the unit!")
+                        print("You have {} gold left.".format(game.game_vars["gold"]))
+                        return "combat"
 
             else:
-                print("Insufficient gold, you only have {} gold".format(game_vars["gold"]))
-                return show_combat_menu()
+                print("Insufficient gold, you only have {} gold".format(game.game_vars["gold"]))
+                return "combat"
 
 
-# upgrade_unit()
-#    1. Introduction
-#    Returns False if the position is invalid
-#       - Position is not on the field of play
-#       - Position is occupied
-#       - Defender is placed past the first 3 columns
-#    Returns True if placement is successful
+# upgrade_unit_menu()
+#    1. Check that there is a defender to upgrade, else return to the combat menu
+#    2. Prompt the user for the coordinate of the unit
+#    3. Show the upgrade cost and ask the user to confirm
+#    4. Upgrade the unit if the user has enough gold
 def upgrade_unit_menu():
-    # First, check if there are any units that can be upgraded
-    no_unit_on_field = True
-    for i in range(0, game_vars["rows"]):
-        for j in range(0, 3):
-            try:
-                assert field[i][j][0] in defender_list  # verify that unit is defender, not monster
-            except TypeError:
-                continue
-            except AssertionError:
-                continue
-            else:
-                no_unit_on_field = False
-                break
-
     # if there are no units that can be upgraded, return player to combat menu
-    if no_unit_on_field:
+    if not game.has_defenders():
         print("You have no units on the field to upgrade. Now returning to combat menu.")
-        show_combat_menu()
+        return "combat"
 
     # print an introductory message
     print("Equip your units with better equipment using gold!")
 
     # prompt user to choose which unit to upgrade
-    valid_for_upgrade = False
     while True:
-        try:
-            unit_choice = input("Please enter the coordinate of the unit you wish to upgrade or press 'x' to exit."
-                                + "\nYour choice? ")
-            if unit_choice == "x":
-                show_combat_menu()
-
-            # check row validity
-            if unit_choice[0].isalpha() is True and unit_choice[0].upper() in row_name[:game_vars["rows"]]:
-                # check column validity
-                if game_vars["columns"] >= int(unit_choice[1:]) > 0:
-                    unit_row_index = row_name.index(unit_choice[0].upper())
-                    unit_column_index = int(unit_choice[1:]) - 1
-                    print("You have selected '{}'".format(field[unit_row_index][unit_column_index][0]))
-                    assert field[unit_row_index][unit_column_index][0] in defender_list
-                else:
-                    raise ValueError
-            else:
-                raise ValueError
+        unit_choice = input("Please enter the coordinate of the unit you wish to upgrade or press 'x' to exit."
+                            + "\nYour choice? ")
+        if unit_choice == "x":
+            return "combat"
+        target = game.parse_position(unit_choice)
         # Reject invalid inputs, including empty coordinate, and enemies
-        except TypeError:
+        if target is None:
+            print("You have entered an invalid coordinate, please try again.")
+            continue
+        unit_row_index, unit_column_index = target
+        unit = game.field[unit_row_index][unit_column_index]
+        if unit is None:
             print("Coordinate is empty, please input a valid coordinate.")
             continue
-        except AssertionError:
+        print("You have selected '{}'".format(unit.name))
+        if unit.name not in defender_list:
             print("You cannot upgrade enemy monsters, please try again.")
             continue
+        break
+
+    upgrade_cost = game.upgrade_cost(unit_row_index, unit_column_index)
+    while True:
+        try:
+            # print the costs and current gold or exit
+            print("You currently own {} gold, you will need {} gold to upgrade the unit." \
+                  .format(game.game_vars['gold'], upgrade_cost))
+            print("It will cost an additional {} gold each time you upgrade a unit"
+                  .format(game.defenders[unit.name]["upgrade_cost_step"]))
+            print("1. Upgrade\n2. Exit")
+            user_choice = int(input("Your Choice? "))
+            assert user_choice == 1 or user_choice == 2
         except ValueError:
-            print("You have entered an invalid coordinate, please try again.")
+            print("Please enter a valid input.")
             continue
-        except IndexError:
-            print("Coordinate is empty, please input a valid coordinate.")
+        except AssertionError:
+            print("Please enter a valid input")
             continue
-
-        # Else, if user has input a valid coordinate, allow unit to be upgraded
         else:
-            valid_for_upgrade = True
-            break
-
-    if valid_for_upgrade is True:
-
-        # check which kind of unit is present
-        if field[unit_row_index][unit_column_index][0] == "WALL":
-            upgrade_cost = 3 + field[unit_row_index][unit_column_index][3] * 2
-        else:  # for everyone else
-            upgrade_cost = 5 + field[unit_row_index][unit_column_index][3] * 2
-
-        while True:
-            try:
-                # print the costs and current gold or exit
-                print("You currently own {} gold, you will need {} gold to upgrade the unit." \
-                      .format(game_vars['gold'], upgrade_cost))
-                print("It will cost an additional 2 gold each time you upgrade a unit")
-                print("1. Upgrade\n2. Exit")
-                user_choice = int(input("Your Choice? "))
-                assert user_choice == 1 or user_choice == 2
-            except TypeError:
-                print("Please enter a valid input.")
-                continue
-            except AssertionError:
-                print("Please enter a valid input")
-                continue
-            else:
-                if user_choice == 1:
-                    break
-                else:
-                    return show_combat_menu()
-
-        if game_vars["gold"] >= upgrade_cost:
-            # Check for gold, then update the gold values respectively
-            new_gold = game_vars["gold"] - upgrade_cost
-            game_vars.update({"gold": new_gold})
-
-            # proceed to upgrading the unit regardless, influences future cost
-            field[unit_row_index][unit_column_index][3] += 1
-            # Upgrade walls HP
-            if field[unit_row_index][unit_column_index][0] == "WALL":
-                field[unit_row_index][unit_column_index][1] += 5
-                field[unit_row_index][unit_column_index][2] += 5
-            # Else, for other units, upgrade Min and Max HP by 1
+            if user_choice == 1:
+                break
             else:
-                field[unit_row_index][unit_column_index][1] += 1
-                field[unit_row_index][unit_column_index][2] += 1
-            print("Successfully upgraded the unit!")
-            return show_combat_menu()
-        else:
-            print("You do not have enough gold. Now returning to combat menu.")
-            show_combat_menu()
+                return "combat"
+
+    if game.upgrade_unit(unit_choice):
+        print("Successfully upgraded the unit!")
     else:
-        return show_combat_menu()
+        print("You do not have enough gold. Now returning to combat menu.")
+    return "combat"
 
 
 # end_turn()
-#   - After the user has the decided to end the turn, this function will update
-#     multiple game variables REGARDLESS of what the user has performed
-#       1. Defender Attack
-#           - Check if game is won
-#       2. Monster Advance
-#           - Check if monster exits player field
-#       3. Monster Attack
-#       4. Spawn Monster
-#       5. Threat and danger calculation
-#   - It includes gold, turn counter, threat and danger
+#   - After the user has the decided to end the turn, the game processes the turn
+#     REGARDLESS of what the user has performed, printing all the actions taken
+#   - Ends the program if the game has been won or lost
 def end_turn():
     print("", "-" * 43)
     print("You have ended your turn")
     print("Unit and Defender actions:")
-
-    # defender attack
-    for x in range(0, game_vars["rows"]):  # go through each row
-        row = x
-        for y in range(3):  # process each unit in the first 3 columns
-            column = y
-            try:
-                assert field[x][y][0] in defender_list
-            except TypeError:  # filters None
-                continue
-            except AssertionError:
-                continue
-            else:
-                defender_name = field[x][y][0]
-                defender_attack(defender_name, row, column)
-
-                continue
-
-    # check if the user has won the game through monsters killed
-    if game_vars["monsters_killed"] >= game_vars["monster_kill_target"]:
-        win_game()
-
-    # monster advance
-    for i in range(0, game_vars["rows"]):  # go through each row
-        row = i
-        for j in range(0, game_vars["columns"]):  # process each monster from left to right
-            column = j
-            try:
-                assert field[i][j][0] in monster_list
-            except AssertionError:  # if the unit in question is in defender list
-                continue
-            except TypeError:  # if it is None
-                continue
-            else:
-                monster_name = field[i][j][0]
-                monster_advance(monster_name, row, column)
-
-    # spawn monster according to spawn frequency
-    if game_vars["turn"] % game_vars["spawn_frequency"] == 0:
-        spawn_monster()
-    # first monster spawns after the first turn
-    elif game_vars["turn"] == 0:
-        spawn_monster()
-
-    # threat increase by 1 to (danger_level) each round
-    # as threat increases, more monsters will spawn
-    threat_increase = random.randint(1, game_vars["danger_level"])
-    if game_vars["THREAT"] + threat_increase >= 10:
-        new_threat = 0
-        print("Threat level exceeds 10! A new monster has emerged!")
-        spawn_monster()
-    else:
-        new_threat = game_vars["THREAT"] + threat_increase
-    game_vars.update({"THREAT": new_threat})
-
-    # danger level - as it increases, monsters gain additional stats.
-    game_vars.update({"DANGER": game_vars["DANGER"] + 1})  # increases by 1 each round regardless
-    if game_vars["DANGER"] % 12 == 0:
-        # danger_level is a variable that determines "Danger Level " in the UI
-        # Danger increases by 1 every 12 turns
-        game_vars.update({"danger_level": game_vars["danger_level"] + 1})
-        print("The monsters grow increasingly stronger ...")
-        for mon in monsters:
-            # Increase the monster attributes by 1 every time Danger increases
-            monsters[mon].update({"maxHP": monsters[mon]["maxHP"] + 1})
-            monsters[mon].update({"min_damage": monsters[mon]["min_damage"] + 1})
-            monsters[mon].update({"max_damage": monsters[mon]["max_damage"] + 1})
-            monsters[mon].update({"REWARD": monsters[mon]["REWARD"] + 1})
-
+    result = game.end_turn()
+    if result["status"] == "won":
+        return win_game()
+    elif result["status"] == "lost":
+        return quit_game()
     print("", "-" * 43)
-    # process var first
-    game_vars.update({"gold": game_vars["gold"] + 1})  # add 1 gold per round
-    game_vars.update({"turn": game_vars["turn"] + 1})  # update the turn counter each round
-    draw_field()
+    return "field"
 
 
 # save_game()
-#   Saves the current game progress, by storing game_vars and field
+#   Saves the current game progress, by storing game_vars and field in save.dat
 #   Also prompts user if they would like to continue or quit game
 def save_game():
     print("SAVING....")
-    save_file = open("save.txt", "w")
-    # saving the game variables,
-    save_information = [game_vars, field]
-    json.dump(save_information, save_file)
-    save_file.close()
+    game.save("save.dat")
     print("Save complete")
 
     while True:
@@ -775,474 +2530,340 @@ def save_game():
         else:
             if user_choice == 1:
                 print("+-----Resuming the game-----+")
-                show_combat_menu()
+                return "combat"
             else:
-                quit_game()
+                return quit_game()
+
+
+# spell_area_label()
+#   - i.e. "3x3" for a square of radius 1, "diamond 5" for a diamond of radius 2
+def spell_area_label(spell):
+    width = 2 * spell["radius"] + 1
+    if spell["shape"] == "square":
+        return "{}x{}".format(width, width)
+    return "{} {}".format(spell["shape"], width)
 
 
 # spells_menu():
 #   Prompts user tutorial if first time accessing shop
+#       lists every spell of spells, i.e.
 #       1. Fireball
 #       2. healing circle
+#   Suggests the best centers for the spell (see GameEngine.spell_targets())
 #   Displays total damage dealt or total healing
 #   Draw field , but do NOT take a turn
 def spells_menu():
     # tutorial for shop
-    if game_vars["first_time_spell_shop"] == 1:
+    if game.game_vars["first_time_spell_shop"] == 1:
         print("... Welcome to my atelier, harness the power of the mystic arts... for a price.")
         print("Tip: Spells do not consume turns!")
-        game_vars.update({"first_time_spell_shop": 0})  # update first time shop
+        game.game_vars.update({"first_time_spell_shop": 0})  # update first time shop
 
+    spell_list = list(spells)
     spell_choice = ''
     while True:
         print("What do you wish to buy?")
-        print("1. Fireball 3x3 (7 Gold)"
-              + "\n2. Healing Circle 3x3 (5 Gold)"
-              + "\n3. Return to combat menu")
+        for i in range(len(spell_list)):
+            spell = spells[spell_list[i]]
+            print("{}. {} {} ({} Gold)".format(i + 1, spell["NAME"], spell_area_label(spell), spell["COST"]))
+        print("{}. Return to combat menu".format(len(spell_list) + 1))
 
         try:
             user_choice = int(input("Your Choice? "))
-            assert 1 <= user_choice <= 3
+            assert 1 <= user_choice <= len(spell_list) + 1
         except AssertionError:
-            print("Please select a number between 1 and 3")
-        except TypeError:
-            print("Please select a number between 1 and 3")
+            print("Please select a number between 1 and {}".format(len(spell_list) + 1))
         except ValueError:
-            print("Please select a number between 1 and 3")
+            print("Please select a number between 1 and {}".format(len(spell_list) + 1))
         else:
-            if user_choice == 1:  # 1. Fire Blast 3x3 7 gold
-                # check if user has enough gold
-                if game_vars["gold"] < 7:
-                    print("Insufficient Gold, returning to combat menu.")
-                    show_combat_menu()
-                spell_choice = 1
-                break
-
-            elif user_choice == 2:  # 2. Healing circle 3x3 5 gold
-                # check if user has enough gold
-                if game_vars["gold"] < 5:
-                    print("Insufficient Gold, returning to combat menu.")
-                    show_combat_menu()
-                spell_choice = 2
-                break
+            if user_choice == len(spell_list) + 1:  # Return to combat menu
+                return "combat"
+            spell_choice = spell_list[user_choice - 1]
+            # check if user has enough gold
+            if game.game_vars["gold"] < spell_costs[spell_choice]:
+                print("Insufficient Gold, returning to combat menu.")
+                return "combat"
+            break
 
-            else:  # 3. Return to combat menu
-                show_combat_menu()
+    # suggest the best centers, if the spell would do anything at all
+    targets = game.spell_targets(spells[spell_choice])
+    if targets:
+        if spells[spell_choice]["effect"] == "damage":
+            print("Best targets: " + ", ".join("{} ({} damage, {} gold)".format(*target) for target in targets))
+        else:
+            print("Best targets: " + ", ".join("{} ({} HP)".format(*target[:2]) for target in targets))
 
-    # If player has enough gold, and has chosen either spell 1 or spell 2, execute this loop
-    # Prompt the user about where the center of the spell should be.
-    spell_row_index = ''
-    spell_column_index = ''
+    # If player has enough gold, prompt the user about where the center of the spell should be.
     while True:
-        try:
-            center = input("Where to target center of spell? ")
-            if center[0].isalpha() is True and center[0].upper() in row_name[:game_vars["rows"]]:
-                if 0 < int(center[1:]) <= game_vars["columns"]:
-                    spell_row_index = row_name.index(center[0].upper())
-                    spell_column_index = int(center[1:]) - 1
-                else:
-                    raise ValueError
-            else:
-                raise ValueError
-        except ValueError:
+        center = input("Where to target center of spell? ")
+        if game.parse_position(center) is None:
             print("Please enter a valid coordinate on the field i.e. 'A3'")
             continue
-        except TypeError:
-            print("Please enter a valid coordinate on the field i.e. 'A3'")
-            continue
-        except IndexError:
-            print("You have entered invalid position, please enter row and column")
-            continue
-        else:
-            break
-
-    # Calculate the radius of the spell
-    # If the row above the input coordinate is outside field, replace with coordinate row
-    top_row = int(spell_row_index) - 1
-    if top_row == -1:
-        top_row = int(spell_row_index)
-    # If the row below the input coordinate is outside field, replace with coordinate row
-    bottom_row = int(spell_row_index) + 1
-    if bottom_row == game_vars["rows"] + 1:
-        bottom_row = int(spell_row_index)
-    # If the column left of the input coordinate is outside field, replace with coordinate column
-    left_column = int(spell_column_index) - 1
-    if left_column == -1:
-        left_column = int(spell_column_index)
-    # If the column right of the input coordinate is outside field, replace with coordinate column
-    right_column = int(spell_column_index) + 1
-    if right_column == game_vars["columns"] + 1:
-        right_column = int(spell_column_index)
-
-    # FIREBALL
-    if spell_choice == 1:
-        print("*" + "=*" * 21)
-        total_damage = 0
-        for row in range(top_row, bottom_row + 1):
-            for column in range(left_column, right_column + 1):
-                try:
-                    assert field[row][column][0] in monster_list
-                except AssertionError:  # ignores allies
-                    continue
-                except TypeError:  # ignores if empty
-                    continue
-                except IndexError:  # ignores invalid index positions aka out of bound
-                    continue
-                else:
-                    # Damage the monster with the fireball damage
-                    # If the monster is in the direct center, it does twice the damage
-                    fireball_damage = 5
-                    center_multiplier = 2
-                    if row == spell_row_index and column == spell_column_index:
-                        fireball_damage = fireball_damage * center_multiplier
-                    field[row][column][1] = field[row][column][1] - fireball_damage
-                    total_damage += fireball_damage
-                    print("Fireball did {} damage to {}!".format(fireball_damage, field[row][column][0]))
-                    # If the monster is killed, then the monster is removed from field
-                    # Also updates the gold and threat level
-                    if field[row][column][1] <= 0:
-                        new_monsters_killed = game_vars["monsters_killed"] + 1
-                        game_vars.update({"monsters_killed": new_monsters_killed})
-                        gold_after_kill = game_vars["gold"] + monsters[field[row][column][0]]["REWARD"]
-                        game_vars.update({"gold": gold_after_kill})
-                        print("{} was killed! You gained {} gold as a reward!".format(
-                            (field[row][column][0]),
-                            monsters[
-                                field[row][column]
-                                [0]]["REWARD"]
-                        ))
-                        new_threat = game_vars["THREAT"] + monsters[field[row][column][0]]["REWARD"]
-                        game_vars.update({"THREAT": new_threat})
-                        field[row][column] = None
-                    continue
+        break
 
-        print("Fireball did a total of {} damage!".format(total_damage))
-        print("*" + "=*" * 21)
-        draw_field()
+    print("*" + "=*" * 21)
+    game.cast_spell(spell_choice, center)
+    print("*" + "=*" * 21)
+    return "field"
 
-    # HEALING CIRCLE
-    if spell_choice == 2:
-        print("*" + "=*" * 21)
-        total_healing = 0
-        for row in range(top_row, bottom_row + 1):
-            for column in range(left_column, right_column + 1):
-                try:
-                    assert field[row][column][0] in defender_list
-                except AssertionError:  # ignores monsters
-                    continue
-                except TypeError:  # ignores if empty
-                    continue
-                except IndexError:  # ignores invalid index positions aka out of bound
-                    continue
-                else:
-                    # If the unit is at max HP, then ignore and continue
-                    if field[row][column][1] == field[row][column][2]:
-                        continue
 
-                    # Calculate the healing of injured units
-                    healing = 5
-                    center_multiplier = 2
-                    if row == spell_row_index and column == spell_column_index:
-                        healing = healing * center_multiplier
-
-                    # Apply the healing to the unit
-                    original_HP = field[row][column][1]
-                    field[row][column][1] += healing
-
-                    # If the min HP is now higher than max HP
-                    # Total healing done is max HP minus the original hp
-                    if field[row][column][1] > field[row][column][2]:
-                        healing_done = field[row][column][2] - original_HP
-                        total_healing += healing_done
-                        field[row][column][1] = field[row][column][2]
-                        print("{} was healed for {} HP!".format(field[row][column][0], healing_done))
-                        continue
-                    else:
-                        total_healing += healing
-                        print("{} was healed for {} HP!".format(field[row][column][0], healing))
-                        continue
-        # Print the total healing done by the spell, and show the field again before returning to main menu
-        print("Healing circle rejuvenated units for {} HP!".format(total_healing))
-        print("*" + "=*" * 21)
-        draw_field()
-
-
-# defender_attack(field,game_vars)
-#   - should check if it is a wall
-#   - check if unit is a cannon, and check turn. If even, do nothing.
-#   - if it is not a wall, it will check for enemies in the lane
-#   - if there are enemies, then attack
-#       - if unit is ronin, check if enemy is directly in range, else do nothing.
-#       - if health falls to 0 or below, monster dies
-#       - print that the monster has died
-#   - if monster is alive and attacked by cannon
-#       - determine chance of push back
-def defender_attack(defender_name, defender_row, defender_column):
-    if defender_name == "WALL":  # wall just doesn't do anything
-        return
-    if defender_name == "CANON" and game_vars["turn"] % 2 != 0:  # only attacks on odd turns
-        print("Cannon is preparing to fire!")
-        return
-    # Scanning columns beginning with the position directly in front, to the end of row
-    for attack_column in range(defender_column + 1, game_vars["columns"]):
+# view_menu()
+#   - Moves the window of the field that is drawn, see Viewport.apply()
+#   - an empty line goes back to the combat menu without drawing the field again
+def view_menu():
+    print("Move the view with left, right, up or down and a number of cells (i.e. right 20),")
+    print("follow to keep the monster nearest to the city in view, or a position (i.e. B120).")
+    while True:
+        words = input("View? ").split()
+        if not words:
+            return "combat"
+        if game.viewport.apply(game, words):
+            return "field"
+        print("Invalid input, i.e. 'left 10', 'follow' or 'B120'")
+
+
+# Viewport
+#   The window of the field that render_field() draws, so drawing a wide or tall
+#   field costs what the window costs, not the field. Set it as engine.viewport.
+#   - width and height are in cells, a field smaller than that is drawn whole
+#   - follow keeps the monster nearest to the city in view, a third of the way in
+#     from the left so what is ahead of it shows. Panning stops following.
+#   - column and row are the top left cell of the window
+class Viewport:
+    __slots__ = ("width", "height", "column", "row", "follow")
+
+    def __init__(self, width=12, height=10):
+        self.width = width
+        self.height = height
+        self.column = 0
+        self.row = 0
+        self.follow = True
+
+    # window()
+    #   - (first row, last row + 1, first column, last column + 1) of the window on
+    #     the engine's field right now
+    def window(self, engine):
+        rows, columns = engine.game_vars["rows"], engine.game_vars["columns"]
+        height, width = min(self.height, rows), min(self.width, columns)
+        if self.follow:
+            nearest = engine.frontier()
+            if nearest is None:
+                self.column = 0
+            else:
+                self.row = nearest[0] - height // 2
+                self.column = nearest[1] - width // 3
+        self.row = max(0, min(self.row, rows - height))
+        self.column = max(0, min(self.column, columns - width))
+        return self.row, self.row + height, self.column, self.column + width
+
+    # apply()
+    #   - Runs one view command, words are its words without "view"
+    #       left [N], right [N], up [N], down [N]   pan, by half the window if N is left out
+    #       follow                                  follow the monster nearest to the city
+    #       POSITION                                i.e. B120, move the window to that cell
+    #   - Returns False if the command is not understood
+    def apply(self, engine, words):
+        directions = {"left": (0, -1), "right": (0, 1), "up": (-1, 0), "down": (1, 0)}
+        if len(words) == 1 and words[0].lower() == "follow":
+            self.follow = True
+            return True
+        if len(words) == 1 and engine.parse_position(words[0]) is not None:
+            row, column = engine.parse_position(words[0])
+            self.follow = False
+            self.row = row - self.height // 2
+            self.column = column - self.width // 3
+            return True
+        if 1 <= len(words) <= 2 and words[0].lower() in directions and (len(words) == 1 or words[1].isdigit()):
+            first_row, last_row, first_column, last_column = self.window(engine)
+            row_step, column_step = directions[words[0].lower()]
+            if len(words) == 2:
+                distance = int(words[1])
+            else:
+                distance = max((last_column - first_column if column_step else last_row - first_row) // 2, 1)
+            self.follow = False
+            self.row += row_step * distance
+            self.column += column_step * distance
+            return True
+        return False
 
-        try:
-            # ignore allies
-            if field[defender_row][attack_column][0] in defender_list:
-                raise ValueError
-            assert field[defender_row][attack_column][0] is None  # assert if empty
-        except AssertionError:  # assertion error means monster in the way
-
-            # RONIN EFFECTS
-            # Ronin can only attack monsters directly in front of it, thus only checks 1 space in front
-            if field[defender_row][defender_column][0] == "RONIN" \
-                    and attack_column > defender_column + 1 + (1 * field[defender_row][defender_column][3]):
-                print("The Ronin waits patiently to strike")
-                return
 
-            # calculate min and max damage while accounting for upgrade level
-            total_min_damage = defenders[defender_name]["min_damage"] + 1 * field[defender_row][defender_column][3]
-            total_max_damage = defenders[defender_name]["max_damage"] + 1 * field[defender_row][defender_column][3]
-            # the unit being attacked is field[row][column - 1], [1] references current HP
-            defender_damage = random.randint(total_min_damage, total_max_damage)
-
-            # if the monster is skeleton, and attacked by archer, half the damage
-            if field[defender_row][attack_column][0] == "SKELE" and defender_name == "ARCHR":
-                defender_damage = math.ceil(defender_damage / 2)  # ensure number is int.
-                print("The archer shoots! But the arrows passed through the Skeleton!")
-
-            # print damage dealt and units involved
-            print("{} inflicted {} damage to {}!".format(defender_name,
-                                                         defender_damage,
-                                                         field[defender_row][attack_column][0]))
-            field[defender_row][attack_column][1] = field[defender_row][attack_column][1] - defender_damage
-
-            # If the monster is killed, then the monster is removed from field
-            # Also updates the gold and threat level
-            if field[defender_row][attack_column][1] <= 0:
-                new_monsters_killed = game_vars["monsters_killed"] + 1
-                game_vars.update({"monsters_killed": new_monsters_killed})
-                gold_after_kill = game_vars["gold"] + monsters[field[defender_row][attack_column][0]]["REWARD"]
-                game_vars.update({"gold": gold_after_kill})
-                print("{} was killed! You gained {} gold as a reward!".format((field[defender_row][attack_column][0]),
-                                                                              monsters[
-                                                                                  field[defender_row][attack_column]
-                                                                                  [0]]["REWARD"]
-                                                                              ))
-                new_threat = game_vars["THREAT"] + monsters[field[defender_row][attack_column][0]]["REWARD"]
-                game_vars.update({"THREAT": new_threat})
-                field[defender_row][attack_column] = None
-
-            # Cannon Special Effect applies only if the  monster has NOT died
-            # cannon_choice > 50, push back monster
-            elif field[defender_row][defender_column][0] == "CANON" and attack_column < game_vars["columns"]:
-
-                # Check the upgrade level of cannon +10 % chance to pushback per upgrade level
-                if field[defender_row][defender_column][3] == 0:
-                    cannon_choice = random.randint(1, 100)
-                else:
-                    if field[defender_row][defender_column][3] >= 10:
-                        cannon_choice = 100
-                    else:
-                        chance = 10 * field[defender_row][defender_column][3]
-                        cannon_choice = random.randint(chance, 100)
-
-                # verify if the cannon RNG allows it to push back monster
-                if field[defender_row][attack_column + 1] is None and cannon_choice > 50:
-                    print("The Canon fired! The {} moves back 1 step!".format(field[defender_row][attack_column][0]))
-                    field[defender_row][attack_column + 1] = field[defender_row][attack_column]
-                    field[defender_row][attack_column] = None
-                else:
-                    print("Cannon fired! But the {} holds its ground!".format(field[defender_row][attack_column][0]))
+# Rendered rows of the last frame, reused by render_field() for every row whose
+# row_versions entry and columns drawn have not changed since. Only kept for one
+# game at a time.
+row_cache = {"game": None, "versions": [], "rows": []}
 
-            break
-        except TypeError:  # if there is nothing in the way
-            continue
-        except ValueError:  # if it is a defender in the way
-            continue
 
+# render_row()
+#   - Returns the three lines of one row of the field as a string, for the
+#     columns first .. last - 1
+#   - format is [unit name, current HP, max Hp]
+#   - if hp is more than 100, only display 99 but retain value
+def render_row(engine, row, first, last):
+    names = []
+    health = []
+    cells = engine.field[row]
+    for column in range(first, last):
+        unit = cells[column]
+        if unit is None:
+            names.append("     |")
+            health.append("     |")
         else:
-            continue
-    return
-
-
-# monster_advance()
-#   - Need to check the spaces in front of the unit
-#   - But only from the space in front of the maximum possible space using for loop
-#   - IF there is something DIRECTLY in front check unit type
-#           IF
-#           Unit is a monster -> do nothing
-#           ELSE
-#           Unit is a defender -> do attack function
-#   - ELSE if there is nothing in front
-#           IF
-#           enter player field -> game over
-#           ELSE
-#           monster just moves
-
-def monster_advance(monster_name, row, column):
-    # immediately check for a game over scenario
-    temp_mon = field[row][column]
-    moves = monsters[monster_name]["MOVES"]
-
-    # scan the columns ahead of the unit
-    steps = 0
-    attack_allowed = True
-    for x in range(column - 1, column - moves - 1, -1):  # i.e. range(6 , 4, - 1) -> 6 5
-        field[row][x + 1] = None  # Delete the previous position
-        if field[row][x] is not None:  # Check if unit in front is monster or unit
-            if field[row][x][0] in defender_list and attack_allowed is True:
-                monster_attack(monster_name, row, x + 1)
-                field[row][x + 1] = temp_mon
-                if steps >= 1:
-                    print("{} has taken {} step(s) in lane {}".format(monster_name, steps, row_name[row]))
-
-                return
-            else:
-                field[row][x + 1] = temp_mon
-                if steps >= 1:
-                    print("{} has taken {} step(s) in lane {}".format(monster_name, steps, row_name[row]))
-                return
+            names.append(f"{unit.name:5}|")
+            health.append(f"{min(unit.hp, 99):>2}/{min(unit.max_hp, 99):<2}|")
+    return "{}|{}\n |{}\n +{}\n".format(row_name[row], "".join(names), "".join(health), "-----+" * (last - first))
+
+
+# render_lanes()
+#   - The minimap below a window: one line per lane with how many monsters it has
+#     and the column of the one nearest to the city, with < or > if that monster
+#     is left or right of the window
+def render_lanes(engine, first, last):
+    lines = ["{:<6}{:>8}{:>10}\n".format("Lane", "Monsters", "Nearest")]
+    for row in range(engine.game_vars["rows"]):
+        monsters, nearest = engine.lane_summary(row)
+        if nearest is None:
+            lines.append("{:<6}{:>8}{:>10}\n".format(row_name[row], monsters, "-"))
+        elif first <= nearest < last:
+            lines.append("{:<6}{:>8}{:>10}\n".format(row_name[row], monsters, nearest + 1))
         else:
-            if x == -1:
-                print("{} has taken {} step(s) in lane {}".format(monster_name, steps, row_name[row]))
-                print("{} has reached the city!".format(monster_name))
-                print("Monsters have plunged the town in darkness! Everyone dies!")
-                quit_game()
-            else:
-                field[row][x] = temp_mon
-                steps += 1
-                attack_allowed = False
-
-    # print the movement to notify the user
-    print("{} has taken {} step(s) in lane {}".format(monster_name, steps, row_name[row]))
-
-
-# monster_attack
-#   - function serves to calculate the damage that a monster will do to a unit
-#   - uses RNG to determine damage
-#   - print damage dealt
-#   - if inflicted damage kills monster, replace with none
-def monster_attack(monster_name, row, column):
-    # the unit being attacked is field[row][column - 1], [1] references current HP
-    monster_damage = random.randint(monsters[monster_name]["min_damage"],
-                                    monsters[monster_name]["max_damage"])
-    print("{} inflicted {} damage to {}!".format(monster_name,
-                                                 monster_damage,
-                                                 field[row][column - 1][0]
-                                                 ))
-    field[row][column - 1][1] = field[row][column - 1][1] - monster_damage
-    if field[row][column - 1][1] <= 0:
-        field[row][column - 1] = None
-
-    return
-
-
-# spawn_monster()
-#   - Spawns a random monster in a random lane on the right side
-#   - if in endless mode, random number of mobs will spawn
-def spawn_monster():
-    game_mode = game_vars["game_mode"]
-
-    # Regular game mode: mob spawns according to spawn frequency
-    if game_mode == 0:
-        while True:
-            try:
-                unit_name = monster_list[random.randint(0, len(monster_list) - 1)]
-                spawn_row_index = random.randint(0, game_vars["rows"] - 1)  # randomize which row to spawn
-                spawn_row = row_name[spawn_row_index]
-                spawn_column = game_vars["columns"]
-                position = spawn_row + str(spawn_column)
-                assert place_unit(position, unit_name) is True
-            except AssertionError:
-                continue
-            else:
-                place_unit(position, unit_name)
-                break
-
-    # ( Endless Horde )
-    elif game_mode == 1:
-        # number of monsters that will be spawned this round is random
-        num_monster_spawn = random.randint(1, game_vars["rows"])
-        for i in range(0, num_monster_spawn + 1):
-            unit_name = monster_list[random.randint(0, len(monster_list) - 1)]
-            spawn_row_index = random.randint(0, game_vars["rows"] - 1)  # which row to spawn
-            spawn_row = row_name[spawn_row_index]
-            spawn_column = game_vars["columns"]
-            position = spawn_row + str(spawn_column)
-            place_unit(position, unit_name)
-
-    return
+            lines.append("{:<6}{:>8}{:>10} {}\n".format(row_name[row], monsters, nearest + 1,
+                                                         "<" if nearest < first else ">"))
+    return lines
+
+
+# render_field()
+#   - Builds the whole frame (map and the UI below it) as one string
+#   - only the window of engine.viewport is drawn, if it has one, with a line
+#     saying where the window is and the minimap of every lane
+#   - rows are taken from row_cache unless the engine says they changed
+def render_field(engine):
+    rows, columns = engine.game_vars["rows"], engine.game_vars["columns"]
+    if engine.viewport is None:
+        first_row, last_row, first_column, last_column = 0, rows, 0, columns
+    else:
+        first_row, last_row, first_column, last_column = engine.viewport.window(engine)
+    if row_cache["game"] is not engine:
+        row_cache.update({"game": engine, "versions": [None] * rows, "rows": [""] * rows})
+    versions = row_cache["versions"]
+    cached_rows = row_cache["rows"]
+    for row in range(first_row, last_row):
+        version = (engine.row_versions[row], first_column, last_column)
+        if versions[row] != version:
+            cached_rows[row] = render_row(engine, row, first_column, last_column)
+            versions[row] = version
+
+    # column numbers. If the largest one drawn does not fit over a cell, the
+    # first column drawn is given once above them, and the cells are numbered
+    # +0, +1, ... from it
+    if len(str(last_column)) <= 5:
+        frame = ["  " + "".join("{:^5} ".format(column + 1) for column in range(first_column, last_column))
+                 .rstrip() + "\n"]
+    else:
+        frame = ["  Column {} +\n".format(first_column + 1),
+                 "  " + "".join("{:^5} ".format("+{}".format(column - first_column))
+                                for column in range(first_column, last_column)).rstrip() + "\n"]
+    frame.append(" +" + "-----+" * (last_column - first_column) + "\n")
+    frame += cached_rows[first_row:last_row]
+    windowed = (last_row - first_row, last_column - first_column) != (rows, columns)
+    if windowed:
+        frame.append("Rows {}-{} of {}, columns {}-{} of {}{}\n".format(
+            row_name[first_row], row_name[last_row - 1], rows, first_column + 1, last_column, columns,
+            ", following the monster nearest to the city" if engine.viewport.follow else ""))
+        frame += render_lanes(engine, first_column, last_column)
+    frame.append("{:<6}{:<6}".format("Turn", engine.game_vars["turn"]))  # current turn number
+    frame.append("Threat = [" + "-" * engine.game_vars["THREAT"]
+                 + " " * (engine.game_vars["max_threat"] - engine.game_vars["THREAT"]) + "]")  # threat bar
+    frame.append("{:<5}{:<13}{}\n".format("", "Danger Level", engine.game_vars["danger_level"]))
+    frame.append("{:<8}{:<4}".format("Gold =", engine.game_vars["gold"]))  # current gold
+    frame.append("Monsters killed = {}/{}\n".format(engine.game_vars["monsters_killed"],
+                                                    engine.game_vars["monster_kill_target"]))  # progress
+    return "".join(frame)
 
 
 # draw_field() function , UI for main game showing map, appears upon starting game
 #                         and at the end every round
-#   - retrieve the variables that define game state
-#   - printing the actual map
-#   - Row 1 , 2 , 3 --- Rules state that players can only place in first 3 columns
+#   - every column drawn is numbered, players can only place in the first 3 columns
 #   - print row name A, B , C ... --- reference to game_var setting
-#   - try: if any monster or unit is there
-#   - except: print blank space instead
-#   - print the UI below
-#   - format is [unit name, current HP, max Hp]
+#   - the frame is built by render_field() through the game's viewport and written in one go
 def draw_field():
-    print("{:4}{:6}{:6}{:6}".format("", "1", "2", "3"))
-    print(" +" + "-----+" * game_vars["columns"])
-
-    for i in range(0, game_vars["rows"]):  # print per row
-        # first line
-        print(row_name[i], end="")  # row name
-        print("|", end="")
-        for j in range(0, game_vars["columns"]):  # print per column
-            try:
-                # noinspection PyUnresolvedReferences
-                print(f"{field[i][j][0]:5}|", end="")  # print unit name
-            except TypeError:
-                print("{:5}|".format(""), end="")  # if return None, then print blank
-            except IndexError:
-                print("{:5}|".format(""), end="")
-        # second line
-        print("\n |", end="")
-        for j in range(0, game_vars["columns"]):
-            try:
-                if field[i][j][2] >= 100:  # if max hp is more than 100, only display 99 but retain value
-                    display_max_HP = 99
-                else:
-                    display_max_HP = field[i][j][2]
-                if field[i][j][1] >= 100:
-                    display_min_HP = 99
-                else:
-                    display_min_HP = field[i][j][1]
-
-                print(f"{display_min_HP:>2}/{display_max_HP:<2}|", end="")  # print unit current hp / max hp
-            except TypeError:
-                print("{:5}|".format(""), end="")
-            except IndexError:
-                print("{:5}|".format(""), end="")
-        print("\n +" + "-----+" * game_vars["columns"])
-
-    print("{:<6}{:<6}".format("Turn", game_vars["turn"]), end="")  # current turn number
-    print("{}{}".format("Threat = [", "-" * game_vars["THREAT"]), end="")  # current threat bar
-    print("{}]".format(" " * (game_vars["max_threat"] - game_vars["THREAT"])), end="")  # Threat bar inverse
-    print("{:<5}{:<13}{}".format("", "Danger Level", game_vars["danger_level"]))  # current danger Level
-    print("{:<8}{:<4}".format("Gold =", game_vars["gold"]), end="")  # current gold
-    print("{}{}/{}".format("Monsters killed = ", game_vars["monsters_killed"],
-                           game_vars["monster_kill_target"]))  # progress
-
-    show_combat_menu()
+    if game.turn_stats is not None:
+        print(game.turn_stats.measure("draw_field", render_field, game), end="")
+    else:
+        print(render_field(game), end="")
+    return "combat"
 
 
 # win_game()
+#   - returns None, which ends run_game()
 def win_game():
     print("+" + "-" * 60 + "+")
     print("Congratulations! You managed to defend the city from monsters!")
     print("+" + "-" * 60 + "+")
-    exit()
+    stop_saving()
+    save_last_replay()
+    return None
+
+
+# Screens that run_game() can show, by the name the menus return
+screens = {"main": show_main_menu,
+           "options": options_menu,
+           "field": draw_field,
+           "combat": show_combat_menu,
+           "buy": buy_unit,
+           "upgrade": upgrade_unit_menu,
+           "end_turn": end_turn,
+           "save": save_game,
+           "spells": spells_menu,
+           "view": view_menu,
+           }
 
 
 # ===================================#
 # Begin the game.
-show_main_menu()
+# script_main()
+#   - python DesperateDefenders.py --script commands.txt (or - for stdin)
+#   - Exits with status 0 if the game was won, 1 if it was lost, 2 if it is still going
+def script_main(arguments):
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Play Desperate Defenders from a command script.")
+    parser.add_argument("--script", required=True, help="file of commands, - reads them from stdin")
+    parser.add_argument("--load", help="save file to start from instead of a new game")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--rows", type=int, default=game_vars["rows"])
+    parser.add_argument("--columns", type=int, default=game_vars["columns"])
+    parser.add_argument("--mode", choices=["classic", "endless"], default="classic")
+    parser.add_argument("--verbose", action="store_true", help="print every event")
+    parser.add_argument("--debug", action="store_true", help="check the board counters after every turn")
+    args = parser.parse_args(arguments)
+
+    output = print if args.verbose else None
+    if args.load:
+        engine = load_save(args.load, output=output)
+    else:
+        settings = dict(game_vars)
+        settings.update({"rows": args.rows, "columns": args.columns, "game_mode": 1 if args.mode == "endless" else 0})
+        engine = GameEngine(settings, seed=args.seed, output=output)
+    engine.viewport = Viewport()
+    engine.debug = args.debug
+    report = lambda problem: print(problem, file=sys.stderr)
+    if args.script == "-":
+        run_script(engine, sys.stdin, print, report)
+    else:
+        with open(args.script) as script_file:
+            run_script(engine, script_file, print, report)
+    print(status_line(engine))
+    sys.exit({"won": 0, "lost": 1}.get(engine.status, 2))
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1:
+        script_main(sys.argv[1:])
+    else:
+        run_game()
 # ===================================#
 # obsolete saving mechanism
 '''saved_game_vars = save_file.readline()  # Read the first line containing the saved game_vars
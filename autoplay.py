@@ -0,0 +1,259 @@
+# autoplay.py
+#   Search-based auto-player, the baseline opponent for balance checks.
+#   Every turn it tries a handful of plans (buy, upgrade, cast a spell, or just end
+#   the turn) by playing them forward on copies of the game with the real rules,
+#   and picks the plan with the best expected outcome.
+#       python autoplay.py --games 20 --budget 0.1 --processes 4
+#
+#   - expectimax: a plan is scored by the mean over a few samples of the turn's
+#     random outcomes of the best plan of the next turn, and so on down to the
+#     search depth, where the position is scored by evaluate()
+#   - the random streams of every sample are seeded from the state and the sample
+#     number, so the score of a state only depends on the state and the depth.
+#     That makes the transposition table exact, whichever path reached the state.
+#   - iterative deepening: depth 1, 2, 3 ... turns until the time budget runs out,
+#     the deepest search that finished picks the plan
+#   - root parallel: with a process pool, every worker searches the same turn with
+#     its own samples at the root and the scores are averaged
+import argparse
+import collections
+import multiprocessing
+import time
+
+import DesperateDefenders
+from DesperateDefenders import GameEngine, defender_list, row_name, spells, spell_costs
+from simulate import greedy_policy, play_game, wilson_interval
+
+root_samples = 4  # random outcomes tried for each plan of the turn being decided
+samples = 2  # random outcomes tried for each plan further down
+inner_plans = 3  # plans tried on the turns after the one being decided
+max_depth = 6  # turns searched at most
+max_table_size = 100000  # transposition table entries kept before it is cleared
+win_score = 100000
+
+
+# SearchTimeout
+#   Raised inside the search when the time budget runs out
+class SearchTimeout(Exception):
+    pass
+
+
+# state_key()
+#   - same for two states exactly when the game goes on the same way from both
+def state_key(engine):
+    return engine.state_checksum()[:16] + repr([list(queue) for queue in engine.spawn_queues])
+
+
+# unit_stats()
+#   - the engine's own defender and monster stats, i.e. after the cheat, for the
+#     copies the search plays on
+def unit_stats(engine):
+    return {"defenders": engine.defenders, "monsters": engine.monsters}
+
+
+# clone()
+#   - A GameEngine copy of the state with its own random streams. It works on any
+#     engine, the search itself always plays on GameEngine.
+def clone(engine, seed):
+    copied = GameEngine(engine.game_vars, engine.to_lists(), seed=seed, unit_stats=unit_stats(engine))
+    copied.status = engine.status
+    copied.spawn_queues = [list(queue) for queue in engine.spawn_queues]
+    copied.queued_monsters = engine.queued_monsters
+    return copied
+
+
+# evaluate()
+#   - Score of a position from the player's side, higher is better
+#   - winning beats everything, losing later beats losing sooner
+#   - otherwise kills, gold and defender HP count for the player, and monster HP
+#     against, more so the closer the monster is to the city
+def evaluate(engine):
+    game_vars = engine.game_vars
+    if engine.status == "won":
+        return win_score - game_vars["turn"]
+    if engine.status == "lost":
+        return -win_score + game_vars["turn"]
+    columns = game_vars["columns"]
+    score = 10 * game_vars["monsters_killed"] + game_vars["gold"] - game_vars["THREAT"]
+    for row, column in engine.occupied_cells():
+        unit = engine.field[row][column]
+        if unit.name in defender_list:
+            score += unit.hp + 4 * unit.level
+        else:
+            score -= unit.hp * (3 - 2 * column / columns)
+    return score
+
+
+# candidate_plans()
+#   - The plans worth trying this turn, most promising first:
+#       nothing, the greedy policy's plan, then for the two most threatened lanes
+#       every defender that can be bought in the rearmost free cell and every
+#       defender that can be upgraded, then each spell on its best center
+#   - limit keeps only the first plans
+def candidate_plans(engine, limit=None):
+    plans = [[]]
+    greedy = greedy_policy(engine)
+    if greedy:
+        plans.append(greedy)
+    gold = engine.game_vars["gold"]
+    free, upgradable = engine.free_front_cells(), engine.upgradable_cells()
+    summaries = [engine.lane_summary(row) for row in range(engine.game_vars["rows"])]
+    threatened = sorted((nearest, row) for row, (count, nearest) in enumerate(summaries) if count)
+    for front, row in threatened[:2]:
+        for column in range(min(3, front)):
+            if (row, column) in free:
+                position = row_name[row] + str(column + 1)
+                plans += [[("buy", unit_name, position)] for unit_name in defender_list
+                          if engine.defenders[unit_name]["PRICE"] <= gold]
+                break
+        for column in range(3):
+            if (row, column) in upgradable and engine.upgrade_cost(row, column) <= gold:
+                plans.append([("upgrade", row_name[row] + str(column + 1))])
+    for spell in spells:
+        if spell_costs[spell] <= gold:
+            plans += [[(spell, target[0])] for target in engine.spell_targets(spells[spell], 1)]
+    if limit is not None:
+        return plans[:limit]
+    return plans
+
+
+# Search
+#   Expectimax with a transposition table, see the top of this file.
+#   table maps (state key, depth) to the score of the state searched that deep.
+class Search:
+    def __init__(self):
+        self.table = {}
+        self.nodes = 0
+
+    def plan_score(self, engine, key, plan, depth, deadline, seeds):
+        total = 0
+        for seed in seeds:
+            copied = clone(engine, "{}:{}".format(key, seed))
+            copied.step(plan)
+            self.nodes += 1
+            total += self.score(copied, depth - 1, deadline)
+        return total / len(seeds)
+
+    def score(self, engine, depth, deadline):
+        if depth == 0 or engine.status != "playing":
+            return evaluate(engine)
+        if time.perf_counter() > deadline:
+            raise SearchTimeout()
+        key = state_key(engine)
+        if (key, depth) in self.table:
+            return self.table[key, depth]
+        best = max(self.plan_score(engine, key, plan, depth, deadline, range(samples))
+                   for plan in candidate_plans(engine, inner_plans))
+        if len(self.table) >= max_table_size:
+            self.table.clear()
+        self.table[key, depth] = best
+        return best
+
+    # search()
+    #   - Scores every plan at depth 1, 2, 3 ... until the deadline
+    #   - worker picks this search's root samples, so parallel searches differ
+    #   - Returns {depth: [score of each plan]} for every depth that finished
+    def search(self, engine, plans, deadline, worker=0):
+        key = state_key(engine)
+        seeds = ["{}:{}".format(worker, sample) for sample in range(root_samples)]
+        scores = {}
+        for depth in range(1, max_depth + 1):
+            try:
+                scores[depth] = [self.plan_score(engine, key, plan, depth, deadline, seeds) for plan in plans]
+            except SearchTimeout:
+                break
+        return scores
+
+
+worker_search = None  # each pool worker keeps its transposition table between turns
+
+
+def _search_worker(job):
+    global worker_search
+    game_vars, field, status, stats, queues, plans, budget, worker = job
+    deadline = time.perf_counter() + budget
+    if worker_search is None:
+        worker_search = Search()
+    engine = GameEngine(game_vars, field, unit_stats=stats)
+    engine.status = status
+    engine.spawn_queues = [list(queue) for queue in queues]
+    engine.queued_monsters = sum(len(queue) for queue in queues)
+    return worker_search.search(engine, plans, deadline, worker)
+
+
+# AutoPlayer
+#   A policy for GameEngine.step(), i.e. player(engine) returns this turn's actions
+#   - budget is the seconds each decision may take
+#   - processes > 1 searches on a pool of that many worker processes; close() it after
+#   - keeps the time and depth of every decision it made
+class AutoPlayer:
+    def __init__(self, budget=0.1, processes=1):
+        self.budget = budget
+        self.processes = processes
+        self.pool = None
+        if processes > 1:
+            self.pool = multiprocessing.Pool(processes)
+        self.search = Search()
+        self.decision_times = []
+        self.depths = []
+
+    def __call__(self, engine):
+        start = time.perf_counter()
+        plans = candidate_plans(engine)
+        if len(plans) == 1:  # nothing to decide
+            self.decision_times.append(time.perf_counter() - start)
+            return []
+        # leave some of the budget for working out the plans and collecting the scores
+        budget = self.budget * 0.8 - (time.perf_counter() - start)
+        if self.pool is None:
+            results = [self.search.search(engine, plans, time.perf_counter() + budget)]
+        else:
+            job = (engine.game_vars, engine.to_lists(), engine.status, unit_stats(engine),
+                   [list(queue) for queue in engine.spawn_queues], plans, budget)
+            results = self.pool.map(_search_worker, [job + (worker,) for worker in range(self.processes)])
+
+        depth = min(max(result, default=0) for result in results)
+        self.depths.append(depth)
+        if depth == 0:  # not even one turn ahead fitted in the budget
+            choice = plans[min(1, len(plans) - 1)]
+        else:
+            scores = [sum(result[depth][index] for result in results) for index in range(len(plans))]
+            choice = plans[scores.index(max(scores))]
+        self.decision_times.append(time.perf_counter() - start)
+        return choice
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Let the search-based auto-player play Desperate Defenders.")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--budget", type=float, default=0.1, help="seconds per decision")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes searching each decision")
+    parser.add_argument("--mode", choices=["classic", "endless"], default="classic")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-turns", type=int, default=1000)
+    args = parser.parse_args()
+
+    game_settings = dict(DesperateDefenders.game_vars)
+    game_settings.update({"game_mode": 1 if args.mode == "endless" else 0})
+    player = AutoPlayer(args.budget, args.processes)
+    results = collections.Counter()
+    try:
+        for game in range(args.games):
+            status, turns, gold_curve, kill_counts = play_game(game_settings, "{}:{}".format(args.seed, game),
+                                                               player, args.max_turns)
+            results[status] += 1
+            print("Game {}: {} after {} turns".format(game + 1, status, turns))
+    finally:
+        player.close()
+
+    win_rate = wilson_interval(results["won"], args.games)
+    print("Win rate {:.3f}  [{:.3f}, {:.3f}]".format(*win_rate))
+    times = sorted(player.decision_times)
+    print("{} decisions, mean {:.1f} ms, slowest {:.1f} ms, mean depth {:.2f} turns".format(
+        len(times), 1000 * sum(times) / len(times), 1000 * times[-1], sum(player.depths) / max(len(player.depths), 1)))
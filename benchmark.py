@@ -0,0 +1,245 @@
+# benchmark.py
+#   Benchmarks for the turn loop and everything around it, across field sizes,
+#   monster densities and game modes.
+#       python benchmark.py                                   full sweep, up to 26x10,000
+#       python benchmark.py --quick --output results.json     small sweep, saved for later
+#       python benchmark.py --baseline results.json           compare with an earlier run
+#
+#   Measured for every case, in milliseconds per call:
+#       end_turn and its phases (defender, monster, spawn, danger), draw_field with
+#       every row drawn, after one turn and through a Viewport, place_unit,
+#       spawn_monster, save and load, a fireball, a fireball covering the whole
+#       field and spell_targets
+#   - every field is filled from a fixed seed, so runs are comparable
+#   - each measurement is the best of a few repeats, which is the least noisy
+#   - with --baseline, a measurement that got slower by more than the tolerance
+#     is a regression, and the script exits with status 1
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import DesperateDefenders
+from DesperateDefenders import GameEngine, Viewport, defender_list, monster_list, row_name, spells, load_save, \
+    render_field, row_cache
+
+try:
+    from vector_engine import VectorEngine
+except ImportError:  # numpy is not installed
+    VectorEngine = None
+
+sizes = [(5, 7), (10, 50), (26, 100), (26, 1000), (26, 10000)]
+quick_sizes = [(5, 7), (26, 100), (26, 1000)]
+densities = [0.05, 0.3]  # share of the cells past the first 3 columns that hold a monster
+game_modes = {"classic": 0, "endless": 1}
+phases = ["_defender_phase", "_monster_phase", "_spawn_phase", "_danger_phase"]
+turns = 5  # turns played for each end_turn measurement
+calls = 20  # calls made for each place_unit / spawn_monster / fireball measurement
+noise_floor = 0.05  # ms, differences smaller than this are never regressions
+
+
+# new_engine()
+#   - An engine with defenders on most of the first 3 columns and monsters on the
+#     given share of the other cells, always the same for the same arguments
+def new_engine(engine_class, rows, columns, density, game_mode, seed=0):
+    settings = dict(DesperateDefenders.game_vars)
+    settings.update({"rows": rows, "columns": columns, "game_mode": game_mode})
+    engine = engine_class(settings, seed=seed)
+    engine.game_vars.update({"monster_kill_target": 10 ** 9, "gold": 10 ** 6})
+    layout = random.Random(seed)
+    for row in range(rows):
+        for column in range(3):
+            if layout.random() < 0.8:
+                engine._place(row, column, defender_list[layout.randrange(len(defender_list))])
+        for column in range(3, columns):
+            if layout.random() < density:
+                engine._place(row, column, monster_list[layout.randrange(len(monster_list))])
+    return engine
+
+
+# best_of()
+#   - runs measure() repeats times on a fresh engine each time, measure returns
+#     {name: seconds per call}, keeps the fastest of each in milliseconds
+def best_of(repeats, make_engine, measure):
+    best = {}
+    for repeat in range(repeats):
+        for name, seconds in measure(make_engine()).items():
+            best[name] = min(best.get(name, float("inf")), seconds * 1000)
+    return best
+
+
+def measure_turns(engine):
+    spent = {phase: 0.0 for phase in phases}
+
+    def timed(phase, method):
+        def run():
+            start = time.perf_counter()
+            method()
+            spent[phase] += time.perf_counter() - start
+        return run
+
+    for phase in phases:  # instance attributes, only this engine is timed
+        setattr(engine, phase, timed(phase, getattr(engine, phase)))
+    start = time.perf_counter()
+    for turn in range(turns):
+        engine.end_turn()
+    results = {"end_turn": (time.perf_counter() - start) / turns}
+    for phase in phases:
+        results["end_turn" + phase] = spent[phase] / turns
+    return results
+
+
+def measure_drawing(engine):
+    row_cache.update({"game": None})
+    start = time.perf_counter()
+    render_field(engine)
+    every_row = time.perf_counter() - start
+    engine.end_turn()
+    start = time.perf_counter()
+    render_field(engine)
+    after_turn = time.perf_counter() - start
+    engine.viewport = Viewport()
+    start = time.perf_counter()
+    render_field(engine)
+    return {"draw_field": every_row, "draw_field_after_turn": after_turn,
+            "draw_viewport": time.perf_counter() - start}
+
+
+def measure_placing(engine):
+    rows = engine.game_vars["rows"]
+    spent = 0.0
+    for call in range(calls):
+        row, column = call % rows, call // rows % 3
+        if engine.field[row][column] is not None:
+            engine._remove_unit(row, column)
+        start = time.perf_counter()
+        engine.place_unit(row_name[row] + str(column + 1), "ARCHR")
+        spent += time.perf_counter() - start
+    return {"place_unit": spent / calls}
+
+
+def measure_spawning(engine):
+    last = engine.game_vars["columns"] - 1
+    spent = 0.0
+    for call in range(calls):
+        for row in range(engine.game_vars["rows"]):  # every spawn cell free, nothing queued
+            if engine.field[row][last] is not None:
+                engine._remove_unit(row, last)
+            engine.spawn_queues[row].clear()
+        engine.queued_monsters = 0
+        start = time.perf_counter()
+        engine.spawn_monster()
+        spent += time.perf_counter() - start
+    return {"spawn_monster": spent / calls}
+
+
+def measure_saving(engine):
+    handle, path = tempfile.mkstemp(suffix=".dat")
+    os.close(handle)
+    try:
+        start = time.perf_counter()
+        engine.save(path)
+        saving = time.perf_counter() - start
+        start = time.perf_counter()
+        load_save(path, type(engine))
+        return {"save": saving, "load": time.perf_counter() - start}
+    finally:
+        os.remove(path)
+
+
+def measure_spells(engine):
+    rows, columns = engine.game_vars["rows"], engine.game_vars["columns"]
+    layout = random.Random(1)
+    start = time.perf_counter()
+    for call in range(calls):
+        engine.area_effect(spells["fireball"], layout.randrange(rows), layout.randrange(columns))
+    fireball = (time.perf_counter() - start) / calls
+    start = time.perf_counter()
+    engine.area_effect(dict(spells["fireball"], radius=max(rows, columns)), rows // 2, columns // 2)
+    whole_field = time.perf_counter() - start
+    start = time.perf_counter()
+    engine.spell_targets(spells["fireball"])
+    return {"fireball": fireball, "fireball_whole_field": whole_field,
+            "spell_targets": time.perf_counter() - start}
+
+
+measurements = [measure_turns, measure_drawing, measure_placing, measure_spawning, measure_saving, measure_spells]
+
+
+# run_benchmarks()
+#   - Returns the report: where it ran, then one entry per case
+def run_benchmarks(engine_classes, sweep_sizes, sweep_densities, repeats, log=None):
+    cases = []
+    for engine_class in engine_classes:
+        for rows, columns in sweep_sizes:
+            for density in sweep_densities:
+                for mode_name, game_mode in game_modes.items():
+                    case = "{} {}x{} density {} {}".format(engine_class.__name__, rows, columns, density, mode_name)
+                    results = {}
+                    for measure in measurements:
+                        results.update(best_of(repeats, lambda: new_engine(engine_class, rows, columns, density,
+                                                                           game_mode), measure))
+                    cases.append({"case": case, "engine": engine_class.__name__, "rows": rows, "columns": columns,
+                                  "density": density, "game_mode": mode_name,
+                                  "ms": {name: round(value, 4) for name, value in results.items()}})
+                    if log is not None:
+                        log("{:<45} end_turn {:>9.3f} ms".format(case, results["end_turn"]))
+    return {"python": platform.python_version(), "platform": platform.platform(), "repeats": repeats,
+            "turns": turns, "calls": calls, "cases": cases}
+
+
+# compare()
+#   - Returns [(case, measurement, baseline ms, current ms)] for every measurement
+#     that got slower than the baseline by more than tolerance (0.25 is 25%)
+def compare(report, baseline, tolerance):
+    baseline_cases = {case["case"]: case["ms"] for case in baseline["cases"]}
+    regressions = []
+    for case in report["cases"]:
+        before = baseline_cases.get(case["case"])
+        if before is None:
+            continue
+        for name, now in case["ms"].items():
+            if name in before and now > before[name] * (1 + tolerance) and now - before[name] > noise_floor:
+                regressions.append((case["case"], name, before[name], now))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Desperate Defenders engine.")
+    parser.add_argument("--quick", action="store_true", help="fields up to 26x1000 and one density")
+    parser.add_argument("--engine", choices=["GameEngine", "VectorEngine", "both"], default="both")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    parser.add_argument("--baseline", help="report from an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="slowdown allowed before it is a regression")
+    args = parser.parse_args()
+
+    classes = [GameEngine]
+    if args.engine != "GameEngine" and VectorEngine is not None:
+        classes.append(VectorEngine)
+    if args.engine == "VectorEngine":
+        classes = classes[1:]
+    if not classes:
+        print("VectorEngine needs numpy")
+        sys.exit(2)
+
+    benchmark_report = run_benchmarks(classes, quick_sizes if args.quick else sizes,
+                                      densities[:1] if args.quick else densities, args.repeats,
+                                      log=lambda line: print(line, file=sys.stderr))
+    if args.output:
+        with open(args.output, "w") as report_file:
+            json.dump(benchmark_report, report_file, indent=2)
+    if args.baseline is None:
+        print(json.dumps(benchmark_report, indent=2))
+        sys.exit(0)
+
+    with open(args.baseline) as baseline_file:
+        found = compare(benchmark_report, json.load(baseline_file), args.tolerance)
+    for case_name, measurement, before_ms, now_ms in found:
+        print("{:<45} {:<28} {:>10.3f} ms -> {:>10.3f} ms".format(case_name, measurement, before_ms, now_ms))
+    print("{} regression(s) against {}".format(len(found), args.baseline))
+    sys.exit(1 if found else 0)
@@ -0,0 +1,40 @@
+# replay.py
+#   Fast-forwards through a recorded game without drawing the field.
+#       python replay.py replay.json              replay and check the final state
+#       python replay.py replay.json --verbose    also print every action message
+#       python replay.py replay.json --events events.jsonl
+#                                                 write every event as a line of JSON
+#       python replay.py replay.json --turn-stats turn_stats
+#                                                 time every turn, see TurnStats
+#   The game saves replay.json whenever a game ends.
+#   Exits with status 1 if the replay does not end the way it was recorded.
+import argparse
+import sys
+import time
+
+from DesperateDefenders import load_replay, replay_game, JsonLinesSink
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded game of Desperate Defenders.")
+    parser.add_argument("replay", help="replay file written by the game")
+    shown = parser.add_mutually_exclusive_group()
+    shown.add_argument("--verbose", action="store_true", help="print every action message")
+    shown.add_argument("--events", help="write every event to this JSON-lines file")
+    parser.add_argument("--turn-stats", help="write timings of every turn to TURN_STATS.jsonl and .prom")
+    args = parser.parse_args()
+
+    recorded = load_replay(args.replay)
+    output = print if args.verbose else None
+    if args.events:
+        output = JsonLinesSink(args.events)
+    start = time.perf_counter()
+    try:
+        engine = replay_game(recorded, output=output, turn_stats=args.turn_stats)
+    except ValueError as error:
+        print("Replay does not match: {}".format(error))
+        sys.exit(1)
+    finally:
+        if args.events:
+            output.close()
+    print("Replayed {} turns in {:.3f}s, game {} with {} monsters killed. The replay matches.".format(
+        engine.game_vars["turn"], time.perf_counter() - start, engine.status, engine.game_vars["monsters_killed"]))
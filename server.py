@@ -0,0 +1,139 @@
+# server.py
+#   Hosts many games of Desperate Defenders in one process, over a line protocol on
+#   a TCP port. Any telnet or netcat client can play.
+#       python server.py --port 4321
+#       telnet localhost 4321
+#
+#   - every connection plays its own GameEngine, nothing is shared between them
+#   - commands are the ones of command scripts (see run_command()), plus
+#       new [classic|endless] [seed]    start a new game
+#       help                            list the commands
+#       quit                            close the connection
+#   - the game's events are sent back after every command
+#   - a long "end 100" lets the other sessions go between each of its turns
+#   - saving is turned off, players could overwrite each other's save files
+import argparse
+import asyncio
+import re
+
+from DesperateDefenders import GameEngine, BatchSink, CommandError, Viewport, defender_list, event_text, game_vars, \
+    run_command, status_line, render_field
+
+max_line = 1024  # longest command line accepted, in bytes
+telnet_command = re.compile(rb"\xff[\xfb-\xfe].|\xff[\xf0-\xfa]", re.DOTALL)  # option negotiation from telnet
+help_text = ["Commands:",
+             "  buy UNIT POSITION     i.e. buy ARCHR A1, units are " + ", ".join(defender_list),
+             "  upgrade POSITION      i.e. upgrade A1",
+             "  fireball POSITION     heal POSITION",
+             "  end [TURNS]           end the turn, or that many turns",
+             "  status                draw",
+             "  view left|right|up|down [CELLS]",
+             "  view follow           view POSITION",
+             "  new [classic|endless] [SEED]",
+             "  quit"]
+
+
+# Session
+#   The game of one connection. The events of the game wait in a BatchSink until
+#   they are sent, so nothing is formatted for a game nobody is watching.
+class Session:
+    __slots__ = ("events", "engine")
+
+    def __init__(self):
+        self.events = BatchSink()
+        self.engine = None
+        self.new_game(0, None)
+
+    def new_game(self, game_mode, seed):
+        settings = dict(game_vars)
+        settings.update({"game_mode": game_mode})
+        self.events.drain()
+        self.engine = GameEngine(settings, seed=seed, output=self.events)
+        self.engine.viewport = Viewport()
+
+    def replies(self):
+        return [event_text(event) for event in self.events.drain()]
+
+
+# run_line()
+#   - Runs one command line for a session
+#   - Returns the lines to send back
+async def run_line(session, line):
+    words = line.split()
+    command = words[0].lower() if words else ""
+    if command == "help":
+        return help_text
+    if command == "new":
+        modes = {"classic": 0, "endless": 1}
+        if len(words) > 3 or (len(words) > 1 and words[1].lower() not in modes) \
+                or (len(words) > 2 and not words[2].isdigit()):
+            return ["usage: new [classic|endless] [seed]"]
+        session.new_game(modes[words[1].lower()] if len(words) > 1 else 0, int(words[2]) if len(words) > 2 else None)
+        return render_field(session.engine).splitlines()
+    if command == "save":
+        return ["Saving is turned off on the server"]
+    if command == "end" and len(words) == 2 and words[1].isdigit():
+        replies = []
+        for turn in range(int(words[1])):
+            if session.engine.status != "playing":
+                break
+            session.engine.end_turn()
+            replies += session.replies()
+            await asyncio.sleep(0)  # let the other sessions go
+        return replies + [status_line(session.engine)]
+    try:
+        reply = run_command(session.engine, line)
+    except CommandError as error:
+        return session.replies() + [str(error)]
+    replies = session.replies()
+    if reply:
+        replies += reply.splitlines()
+    if command == "end":
+        replies.append(status_line(session.engine))
+    return replies
+
+
+# serve_client()
+#   - Plays one connection until it says quit or hangs up
+async def serve_client(reader, writer):
+    session = Session()
+    writer.write(b"Desperate Defenders! Defend the city from undead monsters. Type help for the commands.\r\n> ")
+    try:
+        while True:
+            try:
+                raw = await reader.readline()
+            except ValueError:  # longer than max_line
+                writer.write(b"Line too long, bye!\r\n")
+                break
+            if not raw:
+                break
+            line = telnet_command.sub(b"", raw).decode("utf-8", "replace").strip()
+            if line.lower() in ("quit", "exit"):
+                writer.write(b"Bye! Know that the monsters are still invading while you are gone!\r\n")
+                break
+            replies = await run_line(session, line)
+            writer.write("".join(reply + "\r\n" for reply in replies).encode() + b"> ")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port):
+    server = await asyncio.start_server(serve_client, host, port, limit=max_line)
+    print("Serving Desperate Defenders on {}".format(", ".join(
+        "{}:{}".format(*sock.getsockname()[:2]) for sock in server.sockets)))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Host games of Desperate Defenders over TCP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4321)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
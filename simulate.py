@@ -0,0 +1,246 @@
+# simulate.py
+#   Monte Carlo balance simulator.
+#   Plays many complete games with a scripted policy on a pool of worker processes
+#   and reports the win rate, turns survived, gold curve and kills per unit type,
+#   each with a 95% confidence interval.
+#       python simulate.py --games 100000 --policy greedy --mode endless
+#
+#   - every game gets its own seed, made from the base seed and the game number, so
+#     results do not depend on how the games are split between the workers
+#   - workers send back running totals instead of one record per game, so the
+#     cost of collecting results does not grow with the number of games
+#   - unit stats can be overridden with a JSON file, i.e.
+#       {"defenders": {"ARCHR": {"min_damage": 3}}, "monsters": {"ZOMBI": {"MOVES": 2}}}
+import argparse
+import json
+import math
+import multiprocessing
+
+import DesperateDefenders
+from DesperateDefenders import GameEngine, row_name
+
+z_95 = 1.96  # z score of a 95% confidence interval
+gold_curve_step = 5  # turns between points on the gold curve
+
+
+# idle_policy()
+#   - never does anything, the baseline every other policy should beat
+def idle_policy(engine):
+    return []
+
+
+# greedy_policy()
+#   - lanes are handled in order of the monster closest to the city
+#   - a lane with monsters and no archer, cannon or ronin gets an archer as far
+#     back as possible
+#   - a fireball is cast on any monster that is about to reach the city
+#   - gold left over goes into upgrading the defender of the most threatened lane
+def greedy_policy(engine):
+    actions = []
+    gold = engine.game_vars["gold"]
+    columns = engine.game_vars["columns"]
+    nearest = [engine.lane_summary(row)[1] for row in range(engine.game_vars["rows"])]
+    lanes = sorted(range(engine.game_vars["rows"]),
+                   key=lambda row: columns if nearest[row] is None else nearest[row])
+
+    for row in lanes:
+        if nearest[row] is None:
+            break
+        front = [engine.field[row][column] for column in range(3)]
+        if nearest[row] <= 1 and gold >= DesperateDefenders.spell_costs["fireball"]:
+            actions.append(("fireball", row_name[row] + str(nearest[row] + 1)))
+            gold -= DesperateDefenders.spell_costs["fireball"]
+        if any(unit is not None and unit.stats.attacks for unit in front):
+            continue
+        if gold < engine.defenders["ARCHR"]["PRICE"]:
+            continue
+        for column in range(3):
+            if front[column] is None and column < nearest[row]:
+                actions.append(("buy", "ARCHR", row_name[row] + str(column + 1)))
+                gold -= engine.defenders["ARCHR"]["PRICE"]
+                break
+
+    for row in lanes:
+        for column in range(3):
+            unit = engine.field[row][column]
+            if unit is not None and unit.stats.attacks and engine.upgrade_cost(row, column) <= gold:
+                actions.append(("upgrade", row_name[row] + str(column + 1)))
+                gold -= engine.upgrade_cost(row, column)
+    return actions
+
+
+policies = {"idle": idle_policy, "greedy": greedy_policy}
+
+
+# play_game()
+#   - Plays one game to the end, or until max_turns
+#   - Returns the result, the number of turns survived, gold at every turn and kills
+def play_game(settings, seed, policy, max_turns):
+    engine = GameEngine(settings, seed=seed)
+    gold_curve = []
+    result = {"status": "playing"}
+    while result["status"] == "playing" and engine.game_vars["turn"] < max_turns:
+        gold_curve.append(engine.game_vars["gold"])
+        result = engine.step(policy(engine))
+    return result["status"], engine.game_vars["turn"], gold_curve, engine.kill_counts
+
+
+# new_totals()
+#   - Running sums for a batch of games. Means and confidence intervals are
+#     worked out from the count, sum and sum of squares of each measurement.
+def new_totals():
+    return {"games": 0, "won": 0, "lost": 0,
+            "turns": [0, 0],  # [sum, sum of squares]
+            "gold": {},  # turn -> [games still going, sum, sum of squares]
+            "kills": {},  # unit type -> [sum, sum of squares]
+            }
+
+
+def add_game(totals, status, turns, gold_curve, kill_counts):
+    totals["games"] += 1
+    if status in ("won", "lost"):
+        totals[status] += 1
+    totals["turns"][0] += turns
+    totals["turns"][1] += turns * turns
+    for turn in range(0, len(gold_curve), gold_curve_step):
+        point = totals["gold"].setdefault(turn, [0, 0, 0])
+        point[0] += 1
+        point[1] += gold_curve[turn]
+        point[2] += gold_curve[turn] * gold_curve[turn]
+    for unit_name, count in kill_counts.items():
+        kills = totals["kills"].setdefault(unit_name, [0, 0])
+        kills[0] += count
+        kills[1] += count * count
+
+
+def merge_totals(totals, other):
+    for key in ("games", "won", "lost"):
+        totals[key] += other[key]
+    totals["turns"] = [a + b for a, b in zip(totals["turns"], other["turns"])]
+    for turn, point in other["gold"].items():
+        totals["gold"][turn] = [a + b for a, b in zip(totals["gold"].get(turn, [0, 0, 0]), point)]
+    for unit_name, kills in other["kills"].items():
+        totals["kills"][unit_name] = [a + b for a, b in zip(totals["kills"].get(unit_name, [0, 0]), kills)]
+
+
+# mean_interval()
+#   - mean and 95% confidence interval from a count, sum and sum of squares
+def mean_interval(count, total, squares):
+    mean = total / count
+    if count < 2:
+        return [mean, mean, mean]
+    variance = max(squares - count * mean * mean, 0) / (count - 1)
+    margin = z_95 * math.sqrt(variance / count)
+    return [mean, mean - margin, mean + margin]
+
+
+# wilson_interval()
+#   - win rate and its 95% Wilson score interval, which behaves at 0% and 100%
+def wilson_interval(wins, games):
+    rate = wins / games
+    denominator = 1 + z_95 * z_95 / games
+    centre = (rate + z_95 * z_95 / (2 * games)) / denominator
+    margin = z_95 * math.sqrt(rate * (1 - rate) / games + z_95 * z_95 / (4 * games * games)) / denominator
+    return [rate, max(centre - margin, 0), min(centre + margin, 1)]
+
+
+# _play_batch()
+#   - Worker entry point, plays games first .. last - 1
+def _play_batch(batch):
+    settings, base_seed, policy_name, max_turns, first, last = batch
+    totals = new_totals()
+    for game in range(first, last):
+        add_game(totals, *play_game(settings, "{}:{}".format(base_seed, game), policies[policy_name], max_turns))
+    return totals
+
+
+# _set_unit_stats()
+#   - Worker initializer, applies the stat overrides to this process' copy of the game
+def _set_unit_stats(unit_stats):
+    for table_name, table in (("defenders", DesperateDefenders.defenders), ("monsters", DesperateDefenders.monsters)):
+        for unit_name, stats in unit_stats.get(table_name, {}).items():
+            table[unit_name].update(stats)
+
+
+# simulate()
+#   - Plays the given number of complete games on a pool of worker processes
+#   - settings are game_vars to start from, unit_stats overrides defenders / monsters
+#   - Returns the report as a dictionary
+def simulate(games, policy="greedy", settings=None, unit_stats=None, seed=0, processes=None,
+             max_turns=1000, batch_size=None):
+    if settings is None:
+        settings = DesperateDefenders.game_vars
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if batch_size is None:
+        # a few batches per worker evens out games of different lengths
+        batch_size = max(1, min(500, games // (processes * 4)))
+    batches = [(dict(settings), seed, policy, max_turns, first, min(first + batch_size, games))
+               for first in range(0, games, batch_size)]
+
+    totals = new_totals()
+    with multiprocessing.Pool(processes, initializer=_set_unit_stats, initargs=(unit_stats or {},)) as pool:
+        for batch_totals in pool.imap_unordered(_play_batch, batches):
+            merge_totals(totals, batch_totals)
+
+    return {"games": totals["games"],
+            "policy": policy,
+            "win_rate": wilson_interval(totals["won"], totals["games"]),
+            "loss_rate": wilson_interval(totals["lost"], totals["games"]),
+            "turns_survived": mean_interval(totals["games"], *totals["turns"]),
+            "gold_curve": {turn: mean_interval(*totals["gold"][turn]) + [totals["gold"][turn][0]]
+                           for turn in sorted(totals["gold"])},
+            "kills_per_game": {unit_name: mean_interval(totals["games"], *kills)
+                               for unit_name, kills in sorted(totals["kills"].items())},
+            }
+
+
+# print_report()
+def print_report(report):
+    def interval(values, digits=2):
+        return "{0:.{3}f}  [{1:.{3}f}, {2:.{3}f}]".format(values[0], values[1], values[2], digits)
+
+    print("{} games, {} policy, mean  [95% interval]".format(report["games"], report["policy"]))
+    print("{:<20}{}".format("Win rate", interval(report["win_rate"], 4)))
+    print("{:<20}{}".format("Loss rate", interval(report["loss_rate"], 4)))
+    print("{:<20}{}".format("Turns survived", interval(report["turns_survived"])))
+    print("Kills per game")
+    for unit_name, kills in report["kills_per_game"].items():
+        print("  {:<18}{}".format(unit_name, interval(kills)))
+    print("Gold by turn (games still going)")
+    for turn, point in report["gold_curve"].items():
+        print("  {:<18}{}  ({})".format(turn, interval(point), point[3]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play many games of Desperate Defenders and report balance stats.")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--policy", choices=sorted(policies), default="greedy")
+    parser.add_argument("--mode", choices=["classic", "endless"], default="classic")
+    parser.add_argument("--rows", type=int, default=DesperateDefenders.game_vars["rows"])
+    parser.add_argument("--columns", type=int, default=DesperateDefenders.game_vars["columns"])
+    parser.add_argument("--spawn-frequency", type=int, default=DesperateDefenders.game_vars["spawn_frequency"])
+    parser.add_argument("--spawn-queue-limit", type=int, default=DesperateDefenders.game_vars["spawn_queue_limit"],
+                        help="monsters that can wait in each lane for the spawn cell")
+    parser.add_argument("--stats", help="JSON file of defender / monster stat overrides")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, default is one per core")
+    parser.add_argument("--max-turns", type=int, default=1000)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    game_settings = dict(DesperateDefenders.game_vars)
+    game_settings.update({"rows": args.rows, "columns": args.columns, "spawn_frequency": args.spawn_frequency,
+                          "spawn_queue_limit": args.spawn_queue_limit,
+                          "game_mode": 1 if args.mode == "endless" else 0})
+    stat_overrides = None
+    if args.stats:
+        with open(args.stats) as stats_file:
+            stat_overrides = json.load(stats_file)
+
+    simulation = simulate(args.games, args.policy, game_settings, stat_overrides, args.seed, args.processes,
+                          args.max_turns)
+    if args.json:
+        print(json.dumps(simulation, indent=2))
+    else:
+        print_report(simulation)
@@ -0,0 +1,85 @@
+# soak.py
+#   Soak test for the menu loop.
+#   Plays one endless game through the real menus, ending the turn over and over,
+#   and checks that the stack depth and the memory in use stay flat.
+#   Memory is measured in blocks held by Python's allocator, which is cheap enough
+#   to check while the game runs at full speed.
+#       python soak.py [turns]      (default is 1,000,000 turns)
+#   - stdin is replaced with a script of menu choices, stdout is thrown away
+#   - the field is filled with cheat mode archers first, so the game never ends
+#   - exits with status 1 if the stack or memory grew
+import os
+import sys
+
+import DesperateDefenders
+
+checkpoints = 10  # number of times memory and stack depth are measured
+max_block_growth = 1000  # allocated memory blocks allowed between the first and last checkpoint
+
+
+# stack_depth()
+#   - number of frames below the caller
+def stack_depth():
+    depth = 0
+    frame = sys._getframe(1)
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+# ScriptedInput
+#   Stands in for sys.stdin. Sets up the field through the menus, then answers
+#   "3. End Turn" at every combat menu until enough turns have been played.
+class ScriptedInput:
+    def __init__(self, turns):
+        self.turns = turns
+        self.turns_played = 0
+        self.every = max(turns // checkpoints, 1)
+        self.samples = []
+        self.setup = ["0"]  # cheat mode
+        for row in DesperateDefenders.row_name[:DesperateDefenders.game.game_vars["rows"]]:
+            for column in range(1, 4):
+                self.setup += ["1", "1", row + str(column)]  # buy an archer
+
+    def readline(self):
+        if self.setup:
+            return self.setup.pop(0) + "\n"
+        if self.turns_played % self.every == 0:
+            self.samples.append((self.turns_played, stack_depth(), sys.getallocatedblocks()))
+        if self.turns_played == self.turns:
+            return "6\n"  # quit
+        self.turns_played += 1
+        return "3\n"
+
+
+def soak(turns):
+    settings = dict(DesperateDefenders.game_vars)
+    settings.update({"game_mode": 1})
+    DesperateDefenders.game = DesperateDefenders.GameEngine(settings, seed=0, output=print)
+    DesperateDefenders.game.game_vars.update({"monster_kill_target": turns * 100})
+
+    script = ScriptedInput(turns)
+    stdin, stdout = sys.stdin, sys.stdout
+    sys.stdin, sys.stdout = script, open(os.devnull, "w")
+    try:
+        DesperateDefenders.run_game("field")
+    finally:
+        sys.stdout.close()
+        sys.stdin, sys.stdout = stdin, stdout
+    return script.samples
+
+
+if __name__ == "__main__":
+    samples = soak(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
+    print("{:>10}{:>8}{:>14}".format("turn", "stack", "blocks"))
+    for turn, depth, memory in samples:
+        print("{:>10}{:>8}{:>14}".format(turn, depth, memory))
+
+    depths = set(depth for turn, depth, memory in samples)
+    block_growth = samples[-1][2] - samples[1][2]  # the first sample is taken before the first turn
+    print("Stack depths seen: {}, memory growth: {} blocks".format(sorted(depths), block_growth))
+    if len(depths) > 1 or block_growth > max_block_growth:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
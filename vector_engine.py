@@ -0,0 +1,627 @@
+# vector_engine.py
+#   GameEngine with the field stored as NumPy arrays instead of a list of lists.
+#   Needs numpy, which the rest of the game does not.
+#
+#   The field is split into parallel arrays of shape (rows, columns)
+#       kind  - unit type code, 0 for an empty cell (see unit_names)
+#       hp    - current HP
+#       maxhp - max HP
+#       level - upgrade level of a defender, danger level a monster spawned at
+#   The defender attack and monster advance phases work on every row at once.
+#   So do area spells, as one slice over the field.
+#   Everything else (buying, upgrading, spawning, drawing) goes through
+#   engine.field, which is a view over the arrays that looks like the usual
+#   list of lists, so those parts of GameEngine are shared as is.
+#
+#   VectorEngine draws from its random streams in the same order as GameEngine,
+#   so both engines play out exactly the same game for the same seed.
+#       python vector_engine.py     checks that, then times both engines on a wide field
+import bisect
+import random
+import time
+
+import numpy as np
+
+from DesperateDefenders import GameEngine, game_vars, defender_list, monster_list, row_name, unit_names, unit_codes, \
+    first_monster_code, cell_records, save_version
+
+# the save file cell record of each version (see cell_records in DesperateDefenders.py) as a NumPy type
+cell_dtypes = {1: np.dtype([("kind", "u1"), ("hp", "<i4"), ("maxhp", "<i4"), ("level", "<u2")])}
+cell_dtypes[2] = cell_dtypes[1]
+cell_dtypes[3] = np.dtype([("kind", "u1"), ("hp", "<i4"), ("maxhp", "<i4"), ("level", "<u4")])
+assert all(cell_dtypes[version].itemsize == record.size for version, record in cell_records.items())
+cell_dtype = cell_dtypes[save_version]
+
+
+# CellView
+#   One occupied cell of a VectorEngine field, with the same attributes as a Unit.
+#   stats are looked up every time, from the type and level in the arrays.
+class CellView:
+    __slots__ = ("engine", "row", "column")
+
+    def __init__(self, engine, row, column):
+        self.engine = engine
+        self.row = row
+        self.column = column
+
+    @property
+    def name(self):
+        return unit_names[self.engine.kind[self.row, self.column]]
+
+    @property
+    def level(self):
+        return int(self.engine.level[self.row, self.column])
+
+    @property
+    def stats(self):
+        return self.engine.stats_for(self.name, self.level)
+
+    @stats.setter
+    def stats(self, stats):
+        self.engine.level[self.row, self.column] = stats.level
+        self.engine._touch(self.row, self.column)
+
+    @property
+    def hp(self):
+        return int(self.engine.hp[self.row, self.column])
+
+    @hp.setter
+    def hp(self, hp):
+        self.engine.hp[self.row, self.column] = hp
+        self.engine._touch(self.row, self.column)
+
+    @property
+    def max_hp(self):
+        return int(self.engine.maxhp[self.row, self.column])
+
+    @max_hp.setter
+    def max_hp(self, max_hp):
+        self.engine.maxhp[self.row, self.column] = max_hp
+        self.engine._touch(self.row, self.column)
+
+    def to_list(self):
+        return [self.name, self.hp, self.max_hp, self.level]
+
+
+# RowView
+#   One lane of a VectorEngine field, field[row][column] is a CellView or None
+class RowView:
+    __slots__ = ("engine", "row")
+
+    def __init__(self, engine, row):
+        self.engine = engine
+        self.row = row
+
+    def __getitem__(self, column):
+        if self.engine.kind[self.row, column] == 0:
+            return None
+        return CellView(self.engine, self.row, column)
+
+    def __setitem__(self, column, unit):
+        self.engine.set_cell(self.row, column, unit)
+
+    def __len__(self):
+        return self.engine.kind.shape[1]
+
+    def __iter__(self):
+        for column in range(len(self)):
+            yield self[column]
+
+
+# FieldView
+#   The whole field of a VectorEngine, field[row] is a RowView
+class FieldView:
+    __slots__ = ("engine",)
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def __getitem__(self, row):
+        return RowView(self.engine, row)
+
+    def __len__(self):
+        return self.engine.kind.shape[0]
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+
+# VectorEngine
+#   Same rules and same constructor as GameEngine, see the top of this file
+class VectorEngine(GameEngine):
+    unit_calls = ()  # the phases handle the whole field at once, not unit by unit
+
+    def __init__(self, settings=None, saved_field=None, seed=None, output=None, unit_stats=None, record=False):
+        GameEngine.__init__(self, settings, saved_field, seed, output, unit_stats, record)
+        shape = (self.game_vars["rows"], self.game_vars["columns"])
+        self.kind = np.zeros(shape, dtype=np.uint8)
+        self.hp = np.zeros(shape, dtype=np.int64)
+        self.maxhp = np.zeros(shape, dtype=np.int64)
+        self.level = np.zeros(shape, dtype=np.int64)
+        self.arrays = [self.kind, self.hp, self.maxhp, self.level]
+
+        # MOVES of every unit type code, defenders do not move
+        self.moves = np.zeros(len(unit_names), dtype=np.int64)
+        for name in monster_list:
+            self.moves[unit_codes[name]] = self.monsters[name]["MOVES"]
+
+        if saved_field is not None:
+            field = self.field  # the saved units, as GameEngine set them up
+            for row, column in GameEngine.occupied_cells(self):
+                self.set_cell(row, column, field[row][column])
+        self.field = FieldView(self)
+        self.lanes = None
+        # only game_vars["num_monsters"] is kept, the other counters are answered
+        # from the arrays (see count_units())
+        self.unit_counts = self.lane_counts = self.free_front = self.upgradable = self.level_counts = None
+
+    # set_cell()
+    #   - Writes a Unit (or a CellView, or None) into the arrays
+    def set_cell(self, row, column, unit):
+        self._touch(row, column)
+        if unit is None:
+            self.kind[row, column] = 0
+            self.hp[row, column] = 0
+            self.maxhp[row, column] = 0
+            self.level[row, column] = 0
+        else:
+            # read everything first, unit may be a view of another cell
+            name, hp, max_hp, level = unit.name, unit.hp, unit.max_hp, unit.level
+            self.kind[row, column] = unit_codes[name]
+            self.hp[row, column] = hp
+            self.maxhp[row, column] = max_hp
+            self.level[row, column] = level
+        if column == self.kind.shape[1] - 1:
+            self._spawn_cell_changed(row)
+
+    def to_lists(self):
+        field = []
+        for row in range(self.kind.shape[0]):
+            field.append([None if unit is None else unit.to_list() for unit in self.field[row]])
+        return field
+
+    # pack_cells()
+    #   - the arrays copied into save file records in one go
+    def pack_cells(self):
+        cells = np.zeros(self.kind.shape, dtype=cell_dtype)
+        for name, array in zip(("kind", "hp", "maxhp", "level"), self.arrays):
+            cells[name] = array
+        return cells.tobytes()
+
+    # _restat()
+    #   - nothing to do, cell views look their stats up every time
+    def _restat(self, cells):
+        pass
+
+    # snapshot()
+    #   - same as GameEngine, read straight from the arrays
+    def snapshot(self, cells):
+        copied = {}
+        for row, column in cells:
+            if self.kind[row, column] == 0:
+                copied[row, column] = None
+            else:
+                copied[row, column] = (unit_names[self.kind[row, column]], int(self.hp[row, column]),
+                                       int(self.maxhp[row, column]), int(self.level[row, column]))
+        return {"game_vars": dict(self.game_vars), "cells": copied}
+
+    def occupied_cells(self):
+        rows, columns = np.nonzero(self.kind)
+        return list(zip(rows.tolist(), columns.tolist()))
+
+    # unpack_cells()
+    #   - The arrays become views of the records in data, nothing is copied.
+    #     data is a copy-on-write memory map, so playing on never changes the file.
+    #   - the uint16 levels of versions 1 and 2 are copied into a wider array, and
+    #     monsters that have level 0 there keep the danger level of the game
+    def unpack_cells(self, data, offset, version=save_version):
+        cells = np.frombuffer(data, dtype=cell_dtypes[version], count=self.kind.size,
+                              offset=offset).reshape(self.kind.shape)
+        self.kind, self.hp, self.maxhp, self.level = cells["kind"], cells["hp"], cells["maxhp"], cells["level"]
+        monsters = self.kind >= first_monster_code
+        if version < 3:
+            self.level = self.level.astype(np.int64)
+            self.level[monsters & (self.level == 0)] = self.game_vars["danger_level"]
+        self.arrays = [self.kind, self.hp, self.maxhp, self.level]
+        for row in range(self.kind.shape[0]):
+            self.row_versions[row] += 1
+        self.free_spawn_rows = np.flatnonzero(self.kind[:, -1] == 0).tolist()
+        self.game_vars.update({"num_monsters": int(np.count_nonzero(monsters))})
+
+    # Field changes
+    #   VectorEngine finds monsters straight from the arrays, so it keeps no
+    #   lane index and these only write the arrays and count the monsters
+    def _add_unit(self, row, column, unit):
+        if unit.stats.code >= first_monster_code:
+            self.game_vars.update({"num_monsters": self.game_vars["num_monsters"] + 1})
+        self.set_cell(row, column, unit)
+
+    def _remove_unit(self, row, column):
+        if self.kind[row, column] >= first_monster_code:
+            self.game_vars.update({"num_monsters": self.game_vars["num_monsters"] - 1})
+        self.set_cell(row, column, None)
+
+    def _move_unit(self, row, column, new_column):
+        self.set_cell(row, new_column, self.field[row][column])
+        self.set_cell(row, column, None)
+
+    def count_units(self, unit_name, row=None):
+        cells = self.kind if row is None else self.kind[row]
+        return int(np.count_nonzero(cells == unit_codes[unit_name]))
+
+    def free_front_cells(self):
+        rows, columns = np.nonzero(self.kind[:, :3] == 0)
+        return set(zip(rows.tolist(), columns.tolist()))
+
+    def upgradable_cells(self):
+        front = self.kind[:, :3]
+        rows, columns = np.nonzero((front > 0) & (front < first_monster_code))
+        return set(zip(rows.tolist(), columns.tolist()))
+
+    # _drop_unused_stats()
+    #   - the danger levels still on the field are read from the arrays instead
+    #     of counted, and the monster stats of every other old level are dropped
+    def _drop_unused_stats(self, level):
+        used = set(np.unique(self.level[self.kind >= first_monster_code]).tolist())
+        used.add(self.game_vars["danger_level"])
+        for name, old_level in [key for key in self.stat_tables if key[0] in monster_list]:
+            if old_level not in used:
+                del self.stat_tables[name, old_level]
+
+    def check_counters(self):
+        if self.game_vars["num_monsters"] != int(np.count_nonzero(self.kind >= first_monster_code)):
+            return ["num_monsters"]
+        return []
+
+    def lane_summary(self, row):
+        monsters = np.flatnonzero(self.kind[row] >= first_monster_code)
+        return len(monsters), int(monsters[0]) if len(monsters) else None
+
+    def frontier(self):
+        is_monster = self.kind >= first_monster_code
+        lanes = np.flatnonzero(is_monster.any(axis=1))
+        if len(lanes) == 0:
+            return None
+        nearest = is_monster[lanes].argmax(axis=1)
+        index = int(nearest.argmin())  # the first row on a tie
+        return int(lanes[index]), int(nearest[index])
+
+    # _defender_phase()
+    #   - Finds the monsters of every lane that has a defender in one pass over the
+    #     field, then each defender looks up its target with a bisect
+    #   - kills and pushbacks update the lane's target list as they happen
+    def _defender_phase(self):
+        kind = self.kind
+        front = kind[:, :3]
+        defender_rows = np.flatnonzero(((front > 0) & (front < first_monster_code)).any(axis=1))
+        self.cells_scanned += front.size + len(defender_rows) * kind.shape[1]
+        if len(defender_rows) == 0:
+            return
+        monster_rows, monster_columns = np.nonzero(kind[defender_rows] >= first_monster_code)
+        bounds = np.searchsorted(monster_rows, np.arange(len(defender_rows) + 1)).tolist()
+        monster_columns = monster_columns.tolist()
+
+        for i, row in enumerate(defender_rows.tolist()):
+            targets = monster_columns[bounds[i]:bounds[i + 1]]
+            for column in range(3):
+                code = kind[row, column]
+                if code == 0 or code >= first_monster_code:
+                    continue
+                defender_name = unit_names[code]
+                stats = self.stats_for(defender_name, int(self.level[row, column]))
+                if not stats.attacks:
+                    continue
+                if self.game_vars["turn"] % stats.fire_every != 0:
+                    self._emit_names("cannon_charging", defender_name)
+                    continue
+                target = bisect.bisect_right(targets, column)
+                if target == len(targets):  # nothing in the lane
+                    continue
+                outcome = self._strike(defender_name, row, column, targets[target])
+                if outcome == "killed":
+                    del targets[target]
+                elif outcome == "pushed":
+                    targets[target] += 1
+
+    # _monster_phase()
+    #   Every monster of every lane moves at once. Going from left to right, each
+    #   unit ends up at
+    #       new[k] = max(column[k] - moves[k], new[k - 1] + 1)
+    #   as it stops behind whatever the unit before it did. Walls and the other
+    #   defenders are units with 0 moves. Subtracting the unit's index turns this
+    #   into a running maximum, which is one np.maximum.accumulate over the field.
+    #   A monster only attacks if the unit directly in front of it is a defender.
+    def _monster_phase(self):
+        kind = self.kind
+        unit_rows, unit_columns = np.nonzero(kind)  # every unit, lane by lane, left to right
+        self.cells_scanned += kind.size
+        if len(unit_rows) == 0:
+            return
+        codes = kind[unit_rows, unit_columns]
+        is_monster = codes >= first_monster_code
+        index = np.arange(len(codes))
+
+        # keep lanes apart in the running maximum by lifting each lane above the one before
+        lane_offset = unit_rows * (2 * (kind.shape[1] + len(codes)) + int(self.moves.max()) + 1)
+        new_columns = np.maximum.accumulate(unit_columns - self.moves[codes] - index + lane_offset) \
+            - lane_offset + index
+        steps = unit_columns - new_columns
+
+        same_lane = np.zeros(len(codes), dtype=bool)
+        same_lane[1:] = unit_rows[1:] == unit_rows[:-1]
+        attacks = np.zeros(len(codes), dtype=bool)
+        attacks[1:] = same_lane[1:] & ~is_monster[:-1] & (unit_columns[:-1] == unit_columns[1:] - 1)
+        attacks &= is_monster
+
+        # the first monster to walk off the field ends the game, the lanes after it do not move
+        breaches = np.flatnonzero(is_monster & (new_columns < 0))
+        limit = len(codes) if len(breaches) == 0 else int(breaches[0])
+
+        if self.output is not None:
+            movers = np.flatnonzero(is_monster[:limit] & ((steps[:limit] > 0) | attacks[:limit]))
+        else:
+            movers = np.flatnonzero(attacks[:limit])
+        for k in movers.tolist():
+            monster_name = unit_names[codes[k]]
+            if attacks[k]:
+                self.monster_attack(monster_name, int(unit_rows[k]), int(unit_columns[k]) - 1)
+            else:
+                self._emit("monster_step", monster_name, int(steps[k]),
+                           row_name[unit_rows[k]])
+
+        moved = np.flatnonzero(steps[:limit] > 0)
+        if len(moved) > 0:
+            old = (unit_rows[moved], unit_columns[moved])
+            new = (unit_rows[moved], new_columns[moved])
+            values = [array[old] for array in self.arrays]
+            for array in self.arrays:
+                array[old] = 0
+            for array, value in zip(self.arrays, values):
+                array[new] = value
+            for row in np.unique(unit_rows[moved]).tolist():
+                self.row_versions[row] += 1
+            for row in unit_rows[moved][unit_columns[moved] == kind.shape[1] - 1].tolist():
+                self._spawn_cell_changed(row)  # left the spawn cell
+            if self.change_sets:
+                rows = unit_rows[moved].tolist()
+                old_cells = list(zip(rows, unit_columns[moved].tolist()))
+                new_cells = list(zip(rows, new_columns[moved].tolist()))
+                for changed in self.change_sets:
+                    changed.update(old_cells)
+                    changed.update(new_cells)
+
+        if limit < len(codes):
+            row, column = int(unit_rows[limit]), int(unit_columns[limit])
+            monster_name = unit_names[codes[limit]]
+            self._remove_unit(row, column)
+            self._emit("monster_step", monster_name, column, row_name[row])
+            self._emit("reached_city", monster_name)
+            self._emit("game_lost")
+            self.status = "lost"
+
+    # area_effect()
+    #   - Same as GameEngine, as one slice over the box around the spell. The
+    #     damage or healing, the kills and their rewards are all worked out for
+    #     the whole area at once, so a spell costs about the same at any radius.
+    #   - messages are only made one by one if something listens to them
+    def area_effect(self, spell, center_row, center_column):
+        spans = self.area_spans(spell["shape"], spell["radius"], center_row, center_column)
+        top, left = spans[0][0], min(span[1] for span in spans)
+        mask = np.zeros((len(spans), max(span[2] for span in spans) - left), dtype=bool)
+        for i, (row, first, last) in enumerate(spans):
+            mask[i, first - left:last - left] = True
+        box = (slice(top, top + mask.shape[0]), slice(left, left + mask.shape[1]))
+        kind, hp, maxhp = self.kind[box], self.hp[box], self.maxhp[box]
+
+        amount = np.full(mask.shape, spell["power"], dtype=np.int64)
+        amount[center_row - top, center_column - left] *= spell["center_multiplier"]
+        if spell["effect"] == "damage":
+            hit = mask & (kind >= first_monster_code)
+            hp[hit] -= amount[hit]
+            killed = hit & (hp <= 0)
+        else:
+            hit = mask & (kind > 0) & (kind < first_monster_code) & (hp < maxhp)
+            amount = np.minimum(amount, maxhp - hp)
+            hp[hit] += amount[hit]
+            killed = np.zeros(mask.shape, dtype=bool)
+        hit_rows, hit_columns = np.nonzero(hit)
+        total = int(amount[hit].sum())
+
+        rewards = np.zeros(mask.shape, dtype=np.int64)
+        rewards[killed] = self.monster_rewards(kind[killed], self.level[box][killed])
+        if self.output is not None:
+            for row, column in zip(hit_rows.tolist(), hit_columns.tolist()):
+                unit_name = unit_names[kind[row, column]]
+                if spell["effect"] == "damage":
+                    self._emit("spell_damage", spell["NAME"], int(amount[row, column]), unit_name)
+                    if killed[row, column]:
+                        self._emit("killed", unit_name, int(rewards[row, column]))
+                else:
+                    self._emit("healed", unit_name, int(amount[row, column]))
+
+        kills = int(killed.sum())
+        if kills > 0:
+            reward = int(rewards[killed].sum())
+            self.game_vars.update({"monsters_killed": self.game_vars["monsters_killed"] + kills})
+            self.game_vars.update({"num_monsters": self.game_vars["num_monsters"] - kills})
+            self.game_vars.update({"gold": self.game_vars["gold"] + reward})
+            self.game_vars.update({"THREAT": self.game_vars["THREAT"] + reward})
+            killer = spell["NAME"].upper()
+            self.kill_counts[killer] = self.kill_counts.get(killer, 0) + kills
+            for array in (kind, hp, maxhp, self.level[box]):
+                array[killed] = 0
+            if left + mask.shape[1] == self.kind.shape[1]:  # the box reaches the spawn cells
+                for row in np.flatnonzero(killed[:, -1]).tolist():
+                    self._spawn_cell_changed(top + row)
+
+        for row in np.unique(hit_rows).tolist():
+            self.row_versions[top + row] += 1
+        if self.change_sets:
+            cells = list(zip((hit_rows + top).tolist(), (hit_columns + left).tolist()))
+            for changed in self.change_sets:
+                changed.update(cells)
+
+        if spell["effect"] == "damage":
+            self._emit("spell_total_damage", spell["NAME"], total)
+        else:
+            self._emit("spell_total_healing", spell["NAME"].capitalize(), total)
+        return total
+
+    # monster_rewards()
+    #   - the reward of the monster in each cell of the kind and level arrays given,
+    #     0 for the other cells
+    #   - looked up in a table of the danger levels the monsters have, so
+    #     stats_for() is only asked about those, whatever the game's danger level.
+    #     The rows of the defenders and of empty cells are all 0.
+    def monster_rewards(self, kind, level):
+        levels = level[kind >= first_monster_code].astype(np.int64)
+        if levels.size == 0:
+            return np.zeros(kind.shape, dtype=np.int64)
+        low = int(levels.min())
+        used = (np.flatnonzero(np.bincount(levels - low)) + low).tolist()
+        table = np.zeros((len(unit_names), used[-1] - low + 1), dtype=np.int64)
+        for danger in used:
+            for name in monster_list:
+                table[unit_codes[name], danger - low] = self.stats_for(name, danger).reward
+        return table[kind, np.clip(level.astype(np.int64) - low, 0, table.shape[1] - 1)]
+
+    # spell_targets()
+    #   - same as GameEngine, with the summed-area table made by two cumsums over
+    #     the whole field instead of row by row
+    def spell_targets(self, spell, k=3):
+        rows, columns = self.kind.shape
+        kind, hp = self.kind, self.hp.astype(np.int64)
+        power, center_power = spell["power"], spell["power"] * spell["center_multiplier"]
+        if spell["effect"] == "damage":
+            rewards = self.monster_rewards(kind, self.level)
+            monster = kind >= first_monster_code
+            amount = np.where(monster, np.minimum(hp, power), 0)
+            center_amount = np.where(monster, np.minimum(hp, center_power), 0)
+            reward = np.where(monster & (hp <= power), rewards, 0)
+            center_reward = np.where(monster & (hp <= center_power), rewards, 0)
+        else:
+            defender = (kind > 0) & (kind < first_monster_code)
+            defender[:, 3:] = False
+            missing = self.maxhp - hp
+            amount = np.where(defender, np.minimum(missing, power), 0)
+            center_amount = np.where(defender, np.minimum(missing, center_power), 0)
+            reward = center_reward = np.zeros(kind.shape, dtype=np.int64)
+
+        radius = spell["radius"]
+        low = np.maximum(np.arange(columns) - radius, 0)
+        high = np.minimum(np.arange(columns) + radius + 1, columns)
+        totals = []
+        for values in (amount, reward):
+            table = np.zeros((rows + 1, columns + 1), dtype=np.int64)
+            table[1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+            if spell["shape"] == "diamond":
+                scores = np.zeros(kind.shape, dtype=np.int64)
+                prefix = table[1:] - table[:-1]  # prefix sums of each row
+                for offset in range(-min(radius, rows - 1), min(radius, rows - 1) + 1):
+                    reach = radius - abs(offset)
+                    window = prefix[:, np.minimum(np.arange(columns) + reach + 1, columns)] \
+                        - prefix[:, np.maximum(np.arange(columns) - reach, 0)]
+                    if offset < 0:
+                        scores[-offset:] += window[:offset]
+                    elif offset > 0:
+                        scores[:-offset] += window[offset:]
+                    else:
+                        scores += window
+            else:
+                radius_rows = 0 if spell["shape"] == "lane" else radius
+                top = np.maximum(np.arange(rows) - radius_rows, 0)
+                bottom = np.minimum(np.arange(rows) + radius_rows + 1, rows)
+                band = table[bottom] - table[top]
+                scores = band[:, high] - band[:, low]
+            totals.append(scores)
+        totals[0] += center_amount - amount
+        totals[1] += center_reward - reward
+
+        # gold and damage as one number to rank by, only centers that do something are above 0
+        amounts, gold = totals[0].ravel(), totals[1].ravel()
+        score = gold * (int(amounts.max()) + 1) + amounts
+        if k < score.size:
+            score_k = np.partition(score, score.size - k)[score.size - k]
+            candidates = np.flatnonzero((score >= score_k) & (score > 0))
+        else:
+            candidates = np.flatnonzero(score > 0)
+        # best first, ties go to the first center in reading order
+        candidates = candidates[np.lexsort((candidates, -score[candidates]))][:k]
+        return [(row_name[cell // columns] + str(cell % columns + 1), int(amounts[cell]), int(gold[cell]))
+                for cell in candidates.tolist()]
+
+    # monster_attack()
+    #   - same as GameEngine, without going through the field view
+    def monster_attack(self, monster_name, row, column):
+        stats = self.stats_for(monster_name, int(self.level[row, column + 1]))
+        monster_damage = self.monster_rng.randint(stats.min_damage, stats.max_damage)
+        self._emit("monster_attack", monster_name, monster_damage,
+                   unit_names[self.kind[row, column]])
+        self.hp[row, column] -= monster_damage
+        self._touch(row, column)
+        if self.hp[row, column] <= 0:
+            self.set_cell(row, column, None)
+
+
+# compare_engines()
+#   - Plays the same seeded games on GameEngine and VectorEngine and checks that
+#     the messages, game_vars and field agree after every turn
+#   - Returns the number of turns compared
+def compare_engines(games=50, turns=150, settings=None):
+    if settings is None:
+        settings = game_vars
+    compared = 0
+    for seed in range(games):
+        reference_log, vector_log = [], []
+        reference = GameEngine(settings, seed=seed, output=reference_log.append)
+        vector = VectorEngine(settings, seed=seed, output=vector_log.append)
+        policy = random.Random(seed)
+        for turn in range(turns):
+            actions = [("buy", policy.choice(defender_list),
+                        row_name[policy.randrange(settings["rows"])] + str(policy.randint(1, 3))),
+                       ("upgrade", row_name[policy.randrange(settings["rows"])] + str(policy.randint(1, 3)))]
+            if turn % 4 == 3:
+                actions.append(("fireball", row_name[policy.randrange(settings["rows"])]
+                                + str(policy.randint(1, settings["columns"]))))
+            if turn % 6 == 5:
+                actions.append(("heal", row_name[policy.randrange(settings["rows"])] + str(policy.randint(1, 4))))
+            reference_result = reference.step(actions)
+            vector_result = vector.step(actions)
+            if reference_result != vector_result or reference_log != vector_log \
+                    or reference.game_vars != vector.game_vars or reference.to_lists() != vector.to_lists():
+                raise AssertionError("engines disagree, seed {} turn {}".format(seed, turn))
+            compared += 1
+            if reference_result["status"] != "playing":
+                break
+    return compared
+
+
+# time_turns()
+#   - Average seconds per end_turn on a field crowded with monsters
+def time_turns(engine_class, rows, columns, turns=5):
+    settings = dict(game_vars)
+    settings.update({"rows": rows, "columns": columns, "game_mode": 1, "monster_kill_target": 10 ** 9})
+    engine = engine_class(settings, seed=0)
+    layout = random.Random(0)
+    for row in range(rows):
+        for column in range(3):
+            engine._place(row, column, defender_list[layout.randrange(len(defender_list))])
+        for column in range(columns // 2, columns, 3):
+            engine._place(row, column, monster_list[layout.randrange(len(monster_list))])
+    start = time.perf_counter()
+    for turn in range(turns):
+        engine.end_turn()
+    return (time.perf_counter() - start) / turns
+
+
+if __name__ == "__main__":
+    for options in [{}, {"game_mode": 1}, {"rows": 26, "columns": 60, "game_mode": 1, "spawn_frequency": 1}]:
+        check_settings = dict(game_vars)
+        check_settings.update(options)
+        check_settings.update({"monster_kill_target": 1000})
+        print("{} turns match for {}".format(compare_engines(settings=check_settings), options or "defaults"))
+
+    for size in [(26, 1000), (26, 10000)]:
+        print("{}x{}: GameEngine {:.2f} ms/turn, VectorEngine {:.2f} ms/turn".format(
+            size[0], size[1], time_turns(GameEngine, *size) * 1000, time_turns(VectorEngine, *size) * 1000))